@@ -0,0 +1,294 @@
+
+# benchmarks for each stage of the data processing and outputs, run from the command line
+from grim_reader import *
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+import matplotlib.pyplot as plt
+import numpy
+
+
+''' benchmark set up '''
+
+
+def extend_years(data_object, n_years):
+    """
+    Make a data object's arrays a synthetic number of years long by repeating its years, to see how the stages that
+    work on the arrays scale with the number of years.
+
+    Args:
+        data_object: The data object to be extended
+        n_years: The number of years for the extended arrays
+    """
+
+    repeats = numpy.arange(n_years) % len(data_object.grim_books_data['deaths']['years'])
+    for data_structure, key in [(data_object.grim_books_data['deaths'], 'data'),
+                                (data_object.grim_books_data['deaths'], 'adjusted_data'),
+                                (data_object.grim_books_data['population'], 'adjusted_data'),
+                                (data_object.rates, 'unadjusted')]:
+        data_structure[key] = numpy.take(data_structure[key], repeats, axis=1)
+    first_year = data_object.grim_books_data['deaths']['years'][0]
+    data_object.grim_books_data['deaths']['years'] = range(first_year, first_year + n_years)
+    data_object.find_average_rates_by_year()
+    data_object.index = DimensionIndex(data_object.grim_books_data, data_object.grim_sheets_to_read)
+
+
+def build_data_object(causes, n_years, cache_directory):
+    """
+    Data object with the requested causes read, from the cache, and optionally extended to a synthetic number of years.
+
+    Args:
+        causes: List of the causes to read, starting with all-causes-combined
+        n_years: The number of years for the arrays, or None to keep the years of the data
+        cache_directory: The directory of the cache to read the workbooks from
+    """
+
+    data_object = Spring(cache_directory=cache_directory, lazy=True)
+    for cause in causes[1:]:
+        data_object.load_cause(cause)
+    if n_years:
+        extend_years(data_object, n_years)
+    return data_object
+
+
+def set_up_ingest_cold(causes, n_years, cache_directory, backend):
+    """
+    Reading the death workbooks with no cache.
+    """
+
+    return lambda: read_all_grim_sheets(causes, backend=backend)
+
+
+def set_up_ingest_warm(causes, n_years, cache_directory, backend):
+    """
+    Reading the death workbooks from an up to date cache.
+    """
+
+    read_all_grim_sheets(causes, cache_directory=cache_directory, backend=backend)
+    return lambda: read_all_grim_sheets(causes, cache_directory=cache_directory)
+
+
+def set_up_missing(causes, n_years, cache_directory, backend):
+    """
+    Redistributing the deaths with missing age group.
+    """
+
+    data_object = build_data_object(causes, n_years, cache_directory)
+    return lambda: distribute_missing_across_agegroups(data_object.grim_books_data['deaths']['data'],
+                                                       data_object.grim_books_data['deaths']['age_groups'])
+
+
+def set_up_rates(causes, n_years, cache_directory, backend):
+    """
+    Dividing deaths by populations.
+    """
+
+    data_object = build_data_object(causes, n_years, cache_directory)
+    return lambda: find_rates_from_deaths_and_populations(data_object.grim_books_data['deaths']['adjusted_data'],
+                                                          data_object.grim_books_data['population']['adjusted_data'],
+                                                          len(data_object.grim_sheets_to_read))
+
+
+def set_up_average_rates(causes, n_years, cache_directory, backend):
+    """
+    Crude and standardised rates averaged over age groups.
+    """
+
+    return build_data_object(causes, n_years, cache_directory).find_average_rates_by_year
+
+
+def set_up_life_tables(causes, n_years, cache_directory, backend):
+    """
+    Survival and cumulative deaths by cause, including graduating the rates to single years of age, which are neither
+    read from nor written to the cache (where they would be those of the synthetic years).
+    """
+
+    data_object = build_data_object(causes, n_years, cache_directory)
+    data_object.cache_directory = None
+
+    def run():
+        data_object.single_year_rates = None
+        data_object.find_life_tables()
+
+    return run
+
+
+def set_up_plot_rates_by_age_group(causes, n_years, cache_directory, backend):
+    """
+    Rates by age group over time, for the last cause and each gender.
+    """
+
+    outputs_object = Outputs(build_data_object(causes, n_years, cache_directory))
+    return lambda: outputs_object.plot_rates_by_age_group_over_time(cause=causes[-1])
+
+
+def set_up_plot_deaths_by_cause(causes, n_years, cache_directory, backend):
+    """
+    Crude and standardised rates by cause for each upper age limit.
+    """
+
+    outputs_object = Outputs(build_data_object(causes, n_years, cache_directory))
+    return outputs_object.plot_deaths_by_cause
+
+
+stage_set_ups = [('ingest_cold', set_up_ingest_cold),
+                 ('ingest_warm', set_up_ingest_warm),
+                 ('missing', set_up_missing),
+                 ('rates', set_up_rates),
+                 ('average_rates', set_up_average_rates),
+                 ('life_tables', set_up_life_tables),
+                 ('plot_rates_by_age_group', set_up_plot_rates_by_age_group),
+                 ('plot_deaths_by_cause', set_up_plot_deaths_by_cause)]
+
+# stages that read the workbooks themselves, so can't have synthetic years, and stages that save figures
+file_stages = ['ingest_cold', 'ingest_warm']
+plot_stages = ['plot_rates_by_age_group', 'plot_deaths_by_cause']
+
+
+''' running benchmarks '''
+
+
+def run_stage(stage, causes, n_years, cache_directory, backend, repeats, queue):
+    """
+    Set up and time a single stage, to be run in a fresh process so that the peak memory is that of the stage only.
+
+    Args:
+        stage: The name of the stage in stage_set_ups
+        causes: List of the causes to read
+        n_years: The number of synthetic years, or None for the years of the data
+        cache_directory: The directory of the cache
+        backend: The reader to parse the workbooks with
+        repeats: The number of times to time the stage, taking the fastest
+        queue: Queue to return the results on
+    """
+
+    try:
+        working_directory = os.getcwd()
+        run = dict(stage_set_ups)[stage](causes, n_years, cache_directory, backend)
+
+        # plots are saved to the current directory, so save them to a temporary one
+        output_directory = tempfile.mkdtemp()
+        if stage in plot_stages:
+            os.chdir(output_directory)
+        peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        wall_times, cpu_times = [], []
+        for _ in range(repeats):
+            wall_start, cpu_start = time.time(), time.clock()
+            run()
+            wall_times.append(time.time() - wall_start)
+            cpu_times.append(time.clock() - cpu_start)
+            plt.close('all')
+        peak_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.chdir(working_directory)
+        shutil.rmtree(output_directory)
+        queue.put({'wall_time': min(wall_times), 'cpu_time': min(cpu_times),
+                   'peak_increase_mb': (peak_after - peak_before) / 1024., 'peak_rss_mb': peak_after / 1024.})
+    except Exception as error:
+        queue.put({'error': repr(error)})
+
+
+def run_benchmarks(stages, cause_counts, year_counts, cache_directory, backend='xlrd', repeats=3):
+    """
+    Run each stage over each number of causes and years.
+
+    Args:
+        stages: List of the names of the stages to run
+        cause_counts: List of the numbers of causes to run with, with zero meaning all the available causes
+        year_counts: List of the numbers of synthetic years to run with, with zero meaning the years of the data
+        cache_directory: The directory of the cache
+        backend: The reader to parse the workbooks with
+        repeats: The number of times to time each stage
+    Returns:
+        results: Dictionary of the results keyed by a string for the stage, causes and years
+    """
+
+    available_causes, results = find_available_grim_causes(), {}
+    for stage in stages:
+        for n_causes in cause_counts:
+            causes = available_causes[:n_causes] if n_causes else available_causes
+            for n_years in [0] if stage in file_stages else year_counts:
+                key = '%s causes=%d years=%s' % (stage, len(causes), n_years if n_years else 'data')
+                queue = multiprocessing.Queue()
+                process = multiprocessing.Process(
+                    target=run_stage, args=(stage, causes, n_years, cache_directory, backend, repeats, queue))
+                process.start()
+                results[key] = queue.get()
+                process.join()
+                print(format_result(key, results[key]))
+    return results
+
+
+def format_result(key, result, baseline_result=None):
+    """
+    Format a result for printing, with its change from the baseline if available.
+    """
+
+    if 'error' in result:
+        return '%-55s failed: %s' % (key, result['error'])
+    line = '%-55s %9.4f s wall %9.4f s cpu %8.1f MB peak increase' \
+           % (key, result['wall_time'], result['cpu_time'], result['peak_increase_mb'])
+    if baseline_result and 'wall_time' in baseline_result:
+        line += ' (%+.0f%% on baseline)' % (100. * (result['wall_time'] / baseline_result['wall_time'] - 1.))
+    return line
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Find the results whose wall time is slower than the baseline by more than the tolerance.
+
+    Args:
+        results: Dictionary of results from run_benchmarks
+        baseline: Dictionary of results from an earlier run
+        tolerance: Proportion slower than the baseline that is allowed before it is reported as a regression
+    Returns:
+        List of the keys of the results that have regressed
+    """
+
+    regressions = []
+    for key in sorted(results):
+        if key in baseline and 'wall_time' in results[key] and 'wall_time' in baseline[key]:
+            print(format_result(key, results[key], baseline[key]))
+            if results[key]['wall_time'] > baseline[key]['wall_time'] * (1. + tolerance):
+                regressions.append(key)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the GRIM data processing and outputs.')
+    parser.add_argument('--stages', nargs='+', default=[stage for stage, _ in stage_set_ups],
+                        choices=[stage for stage, _ in stage_set_ups])
+    parser.add_argument('--causes', nargs='+', type=int, default=[2, 10, 0],
+                        help='numbers of causes to run with, zero for all available causes')
+    parser.add_argument('--years', nargs='+', type=int, default=[0, 500, 2000],
+                        help='numbers of synthetic years to run with, zero for the years of the data')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--backend', default='xlrd', choices=['xlrd', 'stream'])
+    parser.add_argument('--cache-directory', default='grim_cache')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', default='benchmark_baseline.json',
+                        help='JSON file of earlier results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to the baseline file')
+    parser.add_argument('--tolerance', type=float, default=.25,
+                        help='proportion slower than the baseline reported as a regression')
+    arguments = parser.parse_args()
+
+    benchmark_results = run_benchmarks(arguments.stages, arguments.causes, arguments.years,
+                                       arguments.cache_directory, arguments.backend, arguments.repeats)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(benchmark_results, output_file, indent=1, sort_keys=True)
+    if arguments.save_baseline:
+        with open(arguments.baseline, 'w') as baseline_file:
+            json.dump(benchmark_results, baseline_file, indent=1, sort_keys=True)
+    elif os.path.isfile(arguments.baseline):
+        print('\nComparison with baseline ' + arguments.baseline)
+        with open(arguments.baseline) as baseline_file:
+            regressed = compare_to_baseline(benchmark_results, json.load(baseline_file), arguments.tolerance)
+        if regressed:
+            print('\nRegressions beyond %.0f%%:\n' % (100. * arguments.tolerance) + '\n'.join(regressed))
+            raise SystemExit(1)
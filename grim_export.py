@@ -0,0 +1,274 @@
+
+# export of the processed data and derived arrays as long-format tables, one cause at a time
+import csv
+import gzip
+import json
+import numpy
+
+from grim_reader import find_average_rates, find_cumulative_deaths, find_single_year_matrix
+
+# parquet output is optional, as pyarrow is only needed for it
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+long_format_columns = ['cause', 'year', 'gender', 'age_group', 'metric', 'value']
+
+
+''' static methods'''
+
+
+def flatten_labelled_array(array, age_groups, years, genders):
+    """
+    Flatten an array by age group, year and gender into columns, with a row for each element.
+
+    Args:
+        array: Array by age group, year and gender
+        age_groups: List of the labels for the first dimension
+        years: List of the labels for the second dimension
+        genders: List of the labels for the third dimension
+    Returns:
+        Dictionary of the age_group, year, gender and value columns as arrays
+    """
+
+    age_group_column, year_column, gender_column = numpy.meshgrid(
+        numpy.array(age_groups, dtype=object), numpy.array(years), numpy.array(genders, dtype=object), indexing='ij')
+    return {'age_group': age_group_column.ravel(), 'year': year_column.ravel(), 'gender': gender_column.ravel(),
+            'value': numpy.asarray(array, dtype=float).ravel()}
+
+
+def find_average_age_group(upper_age_limit, last_age_group):
+    """
+    Label for the ages that an average rate is found over, from the youngest to the upper age limit.
+    """
+
+    return 'all ages' if upper_age_limit == last_age_group else '0 to ' + upper_age_limit.split(' to ')[-1]
+
+
+def find_population_tables(data_object):
+    """
+    Populations by age group, year and gender and, if they have been found, survival and the period life tables, none
+    of which are by cause.
+
+    Returns:
+        List of column dictionaries, as described in find_cause_tables
+    """
+
+    deaths_data = data_object.grim_books_data['deaths']
+    years, genders = deaths_data['years'], deaths_data['genders']
+    tables = [dict(flatten_labelled_array(data_object.grim_books_data['population']['adjusted_data'],
+                                          deaths_data['age_groups'][:-1], years, genders), metric='population')]
+    if data_object.life_tables is not None:
+        tables.append(dict(flatten_labelled_array(data_object.life_tables,
+                                                  [str(age) for age in range(len(data_object.life_tables))],
+                                                  years, genders), metric='survival'))
+    if data_object.period_life_tables is not None:
+        period_life_tables = data_object.period_life_tables
+        for f, function in enumerate(period_life_tables['functions']):
+            tables.append(dict(flatten_labelled_array(
+                period_life_tables['data'][f], [str(age) for age in period_life_tables['ages']],
+                period_life_tables['years'], period_life_tables['genders']), metric='period_' + function))
+    return tables
+
+
+def find_cause_arrays(data_object, cause):
+    """
+    The arrays of one cause of death, taken from the data object if it has been read or else read into arrays of
+    their own, so that exporting causes that haven't been read doesn't add them to the data object.
+
+    Args:
+        data_object: The processed data object
+        cause: String for the cause
+    Returns:
+        Dictionary of the deaths, adjusted deaths and rates by age group, year and gender, the crude and standardised
+            average rates keyed by metric and then upper age limit, each by year and gender, and the cumulative deaths
+            by single year of age, year and gender if the life tables have been found (or else None)
+    """
+
+    limits, standards = data_object.upper_age_limits_to_cut_at, data_object.standards
+    if cause in data_object.grim_sheets_to_read:
+        c = data_object.grim_sheets_to_read.index(cause)
+        arrays = {'deaths': data_object.grim_books_data['deaths']['data'][:, :, :, c],
+                  'adjusted_deaths': data_object.grim_books_data['deaths']['adjusted_data'][:, :, :, c],
+                  'rate': data_object.rates['unadjusted'][:, :, :, c],
+                  'averages': {'crude_rate': {limit: data_object.average_rates_by_year['adjusted_data'][limit][:, :, c]
+                                              for limit in limits}},
+                  'cumulative_deaths': data_object.cumulative_deaths_by_cause[:, :, :, c]
+                  if data_object.cumulative_deaths_by_cause is not None else None}
+        for standard in standards:
+            arrays['averages']['standardised_rate_' + standard] = {
+                limit: data_object.average_rates_by_year['standardised_by_standard'][standard][limit][:, :, c]
+                for limit in limits}
+        return arrays
+
+    deaths, adjusted_deaths, rates = data_object.read_cause(cause)
+    age_groups = data_object.grim_books_data['deaths']['age_groups']
+    crude, standardised = find_average_rates(
+        adjusted_deaths, data_object.grim_books_data['population']['adjusted_data'], rates, age_groups, limits,
+        data_object.find_standard_age_weights_array())
+    arrays = {'deaths': deaths[:, :, :, 0], 'adjusted_deaths': adjusted_deaths[:, :, :, 0], 'rate': rates[:, :, :, 0],
+              'averages': {'crude_rate': {limit: crude[limit][:, :, 0] for limit in limits}}, 'cumulative_deaths': None}
+    for s, standard in enumerate(standards):
+        arrays['averages']['standardised_rate_' + standard] \
+            = {limit: standardised[s, l, :, :, 0] for l, limit in enumerate(limits)}
+    if data_object.life_tables is not None:
+        single_year_rates = numpy.tensordot(find_single_year_matrix(
+            age_groups, range(len(data_object.life_tables) - 1), rates.shape[0], data_object.life_tables_karup_king),
+            rates, axes=(1, 0))
+        arrays['cumulative_deaths'] = find_cumulative_deaths(data_object.life_tables, single_year_rates)[:, :, :, 0]
+    return arrays
+
+
+def find_cause_tables(data_object, cause):
+    """
+    Every metric for one cause of death as long-format columns: deaths (before and after distributing the deaths of
+    missing age), rates, crude and standardised rates averaged up to each upper age limit and, if the life tables have
+    been found, cumulative deaths.
+
+    Args:
+        data_object: The processed data object
+        cause: String for the cause
+    Returns:
+        List of dictionaries of the age_group, year, gender and value columns, each for the metric it has under metric
+    """
+
+    arrays = find_cause_arrays(data_object, cause)
+    deaths_data = data_object.grim_books_data['deaths']
+    age_groups, years, genders = deaths_data['age_groups'], deaths_data['years'], deaths_data['genders']
+    tables = []
+    for metric, array_age_groups in [('deaths', age_groups), ('adjusted_deaths', age_groups[:-1]),
+                                     ('rate', age_groups[:-1])]:
+        tables.append(dict(flatten_labelled_array(arrays[metric], array_age_groups, years, genders), metric=metric))
+
+    # average rates have one age group, for the ages they are averaged over
+    for metric in ['crude_rate'] + ['standardised_rate_' + standard for standard in data_object.standards]:
+        for upper_age_limit in data_object.upper_age_limits_to_cut_at:
+            tables.append(dict(flatten_labelled_array(
+                arrays['averages'][metric][upper_age_limit][numpy.newaxis],
+                [find_average_age_group(upper_age_limit, age_groups[-2])], years, genders), metric=metric))
+
+    # life tables, by single year of age
+    if arrays['cumulative_deaths'] is not None:
+        tables.append(dict(flatten_labelled_array(
+            arrays['cumulative_deaths'], [str(age) for age in range(len(arrays['cumulative_deaths']))], years,
+            genders), metric='cumulative_deaths'))
+    return tables
+
+
+def combine_tables(tables, cause):
+    """
+    Combine the tables of one chunk into a single set of columns, with the cause and metric repeated for every row.
+
+    Args:
+        tables: List of column dictionaries, as from find_cause_tables
+        cause: String for the cause of the chunk, or empty for populations
+    Returns:
+        Dictionary of arrays for each of the long-format columns
+    """
+
+    n_rows = [len(table['value']) for table in tables]
+    columns = {'cause': numpy.full(sum(n_rows), cause, dtype=object),
+               'metric': numpy.repeat(numpy.array([table['metric'] for table in tables], dtype=object), n_rows)}
+    for column in ['year', 'gender', 'age_group', 'value']:
+        columns[column] = numpy.concatenate([table[column] for table in tables])
+    return columns
+
+
+def find_chunk_statistics(columns, cause):
+    """
+    Statistics of a chunk, for readers to find the chunks they need without reading the others.
+    """
+
+    values = columns['value'][numpy.isfinite(columns['value'])]
+    return {'cause': cause, 'rows': len(columns['value']), 'metrics': sorted(set(columns['metric'])),
+            'year_min': int(columns['year'].min()), 'year_max': int(columns['year'].max()),
+            'value_min': float(values.min()) if len(values) else None,
+            'value_max': float(values.max()) if len(values) else None}
+
+
+def write_csv_chunk(output_file, columns, write_header):
+    """
+    Write a chunk to a gzip-compressed CSV file as its own gzip member, which gzip readers read through as one file but
+    which can also be read alone from its offset.
+
+    Args:
+        output_file: The file opened for binary writing
+        columns: Dictionary of the columns of the chunk
+        write_header: Whether to write the column names first
+    Returns:
+        The offset of the chunk's member in the file and its length in bytes
+    """
+
+    offset = output_file.tell()
+    member = gzip.GzipFile(fileobj=output_file, mode='wb', compresslevel=6)
+    writer = csv.writer(member)
+    if write_header:
+        writer.writerow(long_format_columns)
+    writer.writerows(zip(*[columns[column] for column in long_format_columns]))
+    member.close()
+    return offset, output_file.tell() - offset
+
+
+def convert_to_arrow_table(columns):
+    """
+    Convert the columns of a chunk to an arrow table, with the label columns as strings.
+    """
+
+    return pyarrow.Table.from_arrays(
+        [pyarrow.array(list(columns[column]), type=pyarrow.string()) if columns[column].dtype == object
+         else pyarrow.array(columns[column]) for column in long_format_columns], names=long_format_columns)
+
+
+def export_long_format(data_object, filename, file_format='csv', causes=None):
+    """
+    Write populations and every metric for each cause as one long-format table with the columns cause, year, gender,
+    age_group, metric and value, working through one cause at a time so that only one cause's rows are in memory.
+    Causes that the data object hasn't read are read into arrays of their own rather than added to it, so they are
+    only in memory while they are exported. Parquet files have a row group for each cause (and one for the populations
+    and life tables, which have an empty cause), with the column statistics parquet keeps for each row group.
+    Compressed CSV files have a gzip member for each and a JSON file of their offsets and statistics alongside. Either
+    way, the chunk statistics are returned.
+
+    Args:
+        data_object: The processed data object, with its life tables exported if they have been found
+        filename: The file to write to, with the statistics of CSV files written to this followed by .stats.json
+        file_format: Either csv (compressed with gzip) or parquet
+        causes: List of the causes to export, or None for all those read
+    Returns:
+        statistics: List of the statistics of each chunk, in the order they are written
+    """
+
+    if file_format == 'parquet' and pyarrow is None:
+        raise ImportError('pyarrow is needed to write parquet files')
+    if file_format not in ['csv', 'parquet']:
+        raise ValueError('Export format not recognised: ' + str(file_format))
+    causes = list(data_object.grim_sheets_to_read) if causes is None else causes
+
+    statistics, writer = [], None
+    output_file = open(filename, 'wb') if file_format == 'csv' else None
+    try:
+        for cause in [''] + causes:
+            columns = combine_tables(
+                find_population_tables(data_object) if cause == '' else find_cause_tables(data_object, cause), cause)
+            statistics.append(find_chunk_statistics(columns, cause))
+            if file_format == 'csv':
+                statistics[-1]['offset'], statistics[-1]['length'] \
+                    = write_csv_chunk(output_file, columns, write_header=not cause)
+            else:
+                table = convert_to_arrow_table(columns)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(filename, table.schema, compression='snappy')
+                writer.write_table(table)
+    finally:
+        if output_file:
+            output_file.close()
+        if writer:
+            writer.close()
+
+    if file_format == 'csv':
+        with open(filename + '.stats.json', 'w') as statistics_file:
+            json.dump({'columns': long_format_columns, 'chunks': statistics}, statistics_file, indent=1)
+    return statistics
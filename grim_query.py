@@ -0,0 +1,240 @@
+
+# queries over the arrays of a processed data object, with the filters and aggregations done as array operations
+import collections
+import numpy
+
+from grim_reader import find_agegroup_values_from_strings, find_standard_population, convert_cohort_to_array
+
+
+query_aggregations = ['deaths', 'population', 'crude_rate', 'standardised_rate', 'weighted_rate']
+
+
+''' static methods'''
+
+
+def find_age_range_indices(age_group_strings, ages=None):
+    """
+    Find the age groups starting within a range of ages, so that (70, 89) gives the groups from 70 to 74 up to 85+.
+
+    Args:
+        age_group_strings: List of the age groups, not including Missing
+        ages: Tuple of the lowest and highest starting ages, either of which can be None to leave that end open, or
+            None for all the age groups
+    Returns:
+        Array of the indices of the age groups
+    """
+
+    start_ages = numpy.array(find_agegroup_values_from_strings(age_group_strings)[0])
+    lower, upper = (None, None) if ages is None else ages
+    selected = numpy.ones(len(start_ages), dtype=bool)
+    if lower is not None:
+        selected &= start_ages >= lower
+    if upper is not None:
+        selected &= start_ages <= upper
+    if not numpy.any(selected):
+        raise ValueError('No age groups start within the ages: ' + str(ages))
+    return numpy.flatnonzero(selected)
+
+
+def find_year_range_indices(years, year_range=None):
+    """
+    Find the years within a range, or the positions of a list of years.
+
+    Args:
+        years: List of the years of the data arrays
+        year_range: Tuple of the first and last years (inclusive, either can be None to leave that end open), a list
+            of years, or None for all the years
+    Returns:
+        Array of the indices of the years
+    """
+
+    years = numpy.asarray(years)
+    if year_range is None:
+        return numpy.arange(len(years))
+    elif isinstance(year_range, tuple):
+        first, last = year_range
+        selected = numpy.ones(len(years), dtype=bool)
+        if first is not None:
+            selected &= years >= first
+        if last is not None:
+            selected &= years <= last
+        if not numpy.any(selected):
+            raise ValueError('No years within the range: ' + str(year_range))
+        return numpy.flatnonzero(selected)
+    if not len(year_range):
+        raise ValueError('No years requested')
+    positions = numpy.searchsorted(years, year_range)
+    if numpy.any(positions >= len(years)) or numpy.any(years[numpy.minimum(positions, len(years) - 1)] != year_range):
+        raise KeyError('Years not found: ' + str(year_range))
+    return positions
+
+
+def freeze_array(array):
+    """
+    Make an array read-only, so that results held in the cache can't be changed by the code they are returned to.
+    """
+
+    array.flags.writeable = False
+    return array
+
+
+''' objects '''
+
+
+class QueryCache:
+    def __init__(self, max_entries=256):
+        """
+        Cache of query results that keeps the most recently used entries, discarding the least recently used once
+        there are more than max_entries.
+        """
+
+        self.max_entries, self.entries, self.hits, self.misses = max_entries, collections.OrderedDict(), 0, 0
+
+    def get(self, key, find_value):
+        """
+        Return the value cached under key, or find it with find_value and cache it if it isn't there.
+        """
+
+        if key in self.entries:
+            self.hits += 1
+            value = self.entries.pop(key)
+        else:
+            self.misses += 1
+            value = find_value()
+            while len(self.entries) >= self.max_entries > 0:
+                self.entries.popitem(last=False)
+        if self.max_entries > 0:
+            self.entries[key] = value
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+
+class QueryEngine:
+    def __init__(self, data_object, max_entries=256):
+        """
+        Query the deaths and populations of a data object that has already been read, with filters on cause, year,
+        gender and age and with the ages (and optionally the years) aggregated. The selected elements of the arrays
+        are taken in one indexing operation and aggregated with array reductions, and both the selections and the
+        results are cached, so that queries that only differ in their aggregation share the same selection.
+
+        Args:
+            data_object: The processed data object, which can be read-only (as when attached to a shared dataset)
+            max_entries: Largest number of selections and results to keep in the cache
+        """
+
+        self.data_object, self.cache, self.data_version = data_object, QueryCache(max_entries), data_object.version
+
+    def find_query_key(self, causes, years, genders, ages, pool_years):
+        """
+        Normalise the filters of a query into positions along each dimension, which gives the key they are cached
+        under so that the same selection is recognised however it was asked for.
+        """
+
+        if self.data_object.version != self.data_version:
+            self.cache.clear()
+            self.data_version = self.data_object.version
+        deaths_data = self.data_object.grim_books_data['deaths']
+        causes = tuple(self.data_object.grim_sheets_to_read) if causes is None else tuple(causes)
+        self.data_object.load_causes(causes)
+        index = self.data_object.index
+        return (tuple(index.find_positions('causes', causes)),
+                tuple(find_year_range_indices(deaths_data['years'], years)),
+                tuple(index.find_positions('genders', deaths_data['genders'] if genders is None else genders)),
+                tuple(find_age_range_indices(deaths_data['age_groups'][:-1], ages)), bool(pool_years))
+
+    def select(self, key):
+        """
+        Take the deaths (after distributing those of missing age) and populations of a selection, with the years
+        summed if they are pooled.
+
+        Returns:
+            deaths: Array by age group, year, gender and cause
+            populations: Array by age group, year and gender
+        """
+
+        def find_selection():
+            cause_indices, year_indices, gender_indices, age_indices, pool_years = key
+            deaths = self.data_object.grim_books_data['deaths']['adjusted_data'][
+                numpy.ix_(age_indices, year_indices, gender_indices, cause_indices)].astype(float)
+            populations = self.data_object.grim_books_data['population']['adjusted_data'][
+                numpy.ix_(age_indices, year_indices, gender_indices)].astype(float)
+            if pool_years:
+                deaths, populations \
+                    = numpy.sum(deaths, axis=1, keepdims=True), numpy.sum(populations, axis=1, keepdims=True)
+            return freeze_array(deaths), freeze_array(populations)
+
+        return self.cache.get(('select',) + key, find_selection)
+
+    def aggregate(self, key, aggregation, standard, weights):
+        """
+        Aggregate a selection over its age groups (and for weighted rates its genders too).
+        """
+
+        deaths, populations = self.select(key)
+        if aggregation == 'deaths':
+            return numpy.sum(deaths, axis=0)
+        elif aggregation == 'population':
+            return numpy.sum(populations, axis=0)
+        elif aggregation == 'crude_rate':
+            return numpy.sum(deaths, axis=0) / numpy.expand_dims(numpy.sum(populations, axis=0), axis=2)
+        rates = deaths / numpy.expand_dims(populations, axis=3)
+        if aggregation == 'standardised_rate':
+            age_weights = find_standard_population(standard, self.data_object.cache_directory)[list(key[3])]
+            return numpy.einsum('a,aygc->ygc', age_weights / numpy.sum(age_weights), rates)
+        elif aggregation == 'weighted_rate':
+            return numpy.einsum('ag,aygc->yc', weights / numpy.sum(weights), rates)
+        raise ValueError('Aggregation not recognised: ' + str(aggregation))
+
+    def query(self, causes=None, years=None, genders=None, ages=None, aggregation='crude_rate', standard=None,
+              weights=None, pool_years=False):
+        """
+        Filter and aggregate the data, such as query(['all-neoplasms'], (2014, 2016), ['Females'], (70, 89),
+        'weighted_rate', weights=trial_cohort, pool_years=True) for the cancer death rate over the three years of women
+        aged 70 to 89, weighted by the ages of a cohort.
+
+        Args:
+            causes: List of the causes, with any not yet read loaded first, or None for all those read
+            years: Tuple of the first and last years, a list of years, or None for all the years
+            genders: List of the genders, or None for all three
+            ages: Tuple of the lowest and highest ages that the age groups start at, or None for all the age groups
+            aggregation: One of deaths, population, crude_rate, standardised_rate or weighted_rate
+            standard: Name of the standard population for standardised rates, or None for the data object's first
+            weights: For weighted rates, array of counts by the selected age groups and genders, or a dictionary as
+                described in convert_cohort_to_array
+            pool_years: Whether to sum the deaths and populations over the years before finding the rates
+        Returns:
+            Dictionary with the read-only result array under values, the names of its dimensions under dimensions and
+            the labels along each dimension (with the age groups that were aggregated over under age_groups)
+        """
+
+        key = self.find_query_key(causes, years, genders, ages, pool_years)
+        cause_indices, year_indices, gender_indices, age_indices, _ = key
+        deaths_data = self.data_object.grim_books_data['deaths']
+        labels = {'cause': [self.data_object.grim_sheets_to_read[c] for c in cause_indices],
+                  'gender': [deaths_data['genders'][g] for g in gender_indices],
+                  'age_groups': [deaths_data['age_groups'][a] for a in age_indices],
+                  'year': ['%d-%d' % (deaths_data['years'][year_indices[0]], deaths_data['years'][year_indices[-1]])]
+                  if pool_years else [deaths_data['years'][y] for y in year_indices]}
+
+        if aggregation == 'standardised_rate':
+            standard = self.data_object.standards[0] if standard is None else standard
+        aggregation_key = (aggregation, standard if aggregation == 'standardised_rate' else None)
+        if aggregation == 'weighted_rate':
+            if weights is None:
+                raise ValueError('Weighted rates need weights by age group and gender')
+            if isinstance(weights, dict):
+                weights = convert_cohort_to_array(weights, labels['age_groups'], labels['gender'])
+            weights = numpy.asarray(weights, dtype=float)
+            if weights.shape != (len(age_indices), len(gender_indices)):
+                raise ValueError('Weights must be by the %d age groups and %d genders selected'
+                                 % (len(age_indices), len(gender_indices)))
+            aggregation_key += (weights.tostring(),)
+
+        values = self.cache.get(('aggregate',) + key + aggregation_key,
+                                lambda: freeze_array(self.aggregate(key, aggregation, standard, weights)))
+        dimensions = {'population': ['year', 'gender'], 'weighted_rate': ['year', 'cause']}.get(
+            aggregation, ['year', 'gender', 'cause'])
+        return dict({dimension: labels[dimension] for dimension in dimensions},
+                    values=values, dimensions=dimensions, age_groups=labels['age_groups'])
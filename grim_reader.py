@@ -1,8 +1,26 @@
 
 from xlrd import open_workbook
 import numpy
+import contextlib
+import csv
+import functools
+import glob
+import json
+import multiprocessing
+import os
+import re
+import time
+import zipfile
+from xml.etree import cElementTree as ElementTree
+from xlrd.biffh import error_text_from_code
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+xlsx_namespace = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+xlsx_error_codes = {text: code for code, text in error_text_from_code.items()}
 
 
 ''' static methods'''
@@ -46,12 +64,17 @@ def convert_to_integer_if_possible(values_list):
     return values_found
 
 
-def read_standard_population():
+def read_standard_population(filename='australian_standard_population_2001.xls'):
     """
     Read in Australian Standard Population 2001 from ABS.
+
+    Args:
+        filename: The name of the ABS workbook
+    Returns:
+        data: Dictionary of the population keyed by single year of age (with 100 for 100 and over) and Total
     """
 
-    book = open_workbook('australian_standard_population_2001.xls')
+    book = open_workbook(filename)
     sheet = book.sheet_by_name('Table_1')
     data, titles = {}, sheet.row_values(5)
     for i in range(sheet.nrows):
@@ -149,106 +172,745 @@ def sum_last_elements_of_list(input_list, index):
     return revised_list
 
 
-def read_single_grim_sheet(workbook, sheet_name, years_to_keep=None, title_row_index=5, gender_row_index=3):
+def read_standard_population_csv(filename):
     """
-    Function to read a single GRIM-formatted spreadsheet.
+    Read a user-supplied standard population from a CSV file with columns headed age and population, where each age is
+    the lower limit of its age band (so 85+ or 85-89 are both read as 85) and the bands can be of any width that
+    doesn't cross the GRIM age groups.
+
+    Args:
+        filename: The name of the CSV file
+    Returns:
+        data: Dictionary of the population keyed by the lower limit of each age band
+    """
+
+    data = {}
+    with open(filename, 'rb') as csv_file:
+        for row in csv.DictReader(csv_file):
+            data[int(re.match(r'\s*(\d+)', row['age']).group(1))] = float(row['population'])
+    return data
+
+
+def rebin_standard_population(population_by_age, age_group_width=5, n_age_groups=18):
+    """
+    Sum a standard population into the GRIM age groups, with everyone above the start of the last group in that group.
+
+    Args:
+        population_by_age: Dictionary of the population keyed by the lower limit of each age band, with any keys that
+            are not integers (such as Total) ignored
+        age_group_width: Width of the GRIM age groups
+        n_age_groups: Number of GRIM age groups, not including Missing
+    Returns:
+        Array of the population in each age group
+    """
+
+    population_by_age = exclude_non_integer_keys_from_dict(population_by_age)
+    ages = numpy.array(sorted(population_by_age))
+    return numpy.bincount(numpy.minimum(ages // age_group_width, n_age_groups - 1),
+                          weights=[population_by_age[age] for age in ages], minlength=n_age_groups)
+
+
+def register_standard_population(name, filename=None, population_by_age=None):
+    """
+    Add a standard population to the registry, or replace one, so that it can be looked up by name.
+
+    Args:
+        name: String to look the standard up by
+        filename: A CSV file of the standard population, as described in read_standard_population_csv
+        population_by_age: Dictionary of the standard population keyed by the lower limit of each age band, instead of
+            a file
+    """
+
+    if (filename is None) == (population_by_age is None):
+        raise ValueError('Standard population needs either a file or a dictionary of populations')
+    standard_population_registry[name] = {'filename': filename, 'reader': read_standard_population_csv} \
+        if filename else {'population_by_age': population_by_age}
+    standard_population_vectors.pop(name, None)
+
+
+def find_standard_population(name, cache_directory=None):
+    """
+    Look up a standard population by name, binned into the GRIM age groups. Each standard is only read and binned once
+    per session, and those read from files are also kept in the cache until their file changes.
+
+    Args:
+        name: The name of the standard in the registry
+        cache_directory: The directory of the cache for the standards read from files, or None to not use it
+    Returns:
+        Array of the standard population in each age group, not including Missing
+    """
+
+    if name in standard_population_vectors:
+        return standard_population_vectors[name]
+    if name not in standard_population_registry:
+        raise KeyError('Standard population not registered: ' + str(name))
+    source = standard_population_registry[name]
+    if 'population_by_age' in source:
+        standard_population_vectors[name] = rebin_standard_population(source['population_by_age'])
+        return standard_population_vectors[name]
+
+    # standards read from files are cached in the same way as the workbook sheets, with the standard as the sheet
+    index = read_grim_cache_index(cache_directory) if cache_directory else None
+    cached = read_cached_grim_sheet(source['filename'], 'standard-' + name, cache_directory, index) \
+        if index is not None else None
+    if cached is None:
+        vector = rebin_standard_population(source['reader'](source['filename']))
+        if index is not None:
+            if not os.path.isdir(cache_directory):
+                os.makedirs(cache_directory)
+            write_cached_grim_sheet(source['filename'], 'standard-' + name, cache_directory, index,
+                                    ([], [], [], vector))
+            write_grim_cache_index(cache_directory, index)
+    else:
+        vector = cached[3]
+    standard_population_vectors[name] = vector
+    return vector
+
+
+def find_standard_age_weights(standard_population, n_age_groups, upper_age, age_group_width=5):
+    """
+    Find the proportion of the standard population in each age group, for the age groups starting below an upper
+    age, with the age groups above it weighted zero.
+
+    Args:
+        standard_population: Array of the standard population in each age group, as from find_standard_population
+        n_age_groups: The number of age groups in the rates that the weights will be applied to
+        upper_age: Integer for the age that the included age groups must start below
+        age_group_width: Width of the age groups
+    Returns:
+        age_weights: Array of the weights ordered by age group
+    """
+
+    n_included = -(-upper_age // age_group_width)
+    age_weights = numpy.zeros(n_age_groups)
+    age_weights[:n_included] = standard_population[:n_included]
+    return age_weights / numpy.sum(age_weights)
+
+
+def parse_grim_sheet(workbook, sheet_name, title_row_index=5, gender_row_index=3):
+    """
+    Read a single GRIM-formatted spreadsheet into an array, without discarding any of the years (rows) of the sheet.
 
     Args:
         workbook: The entire spreadsheet
         sheet_name: String of the sheet of the book to be read
-        years_to_keep: List of Booleans for the years of interest, only created when the all mortality sheet read
         title_row_index: Integer for the row with the titles in it
         gender_row_index: Integer for the row with the gender strings in it
     Returns:
         age_groups: List of the age groups strings
-        years: List of the year integers
+        years: List of the year integers, including zeros for the rows that are not years
         genders: List of the strings for the genders
-        final_array: The main array containing the data
-        years_to_keep: Boolean structure corresponding to the years to be kept if it is all-cause mortality being read
+        final_array: The main array containing the data for all rows
     """
 
     # initialise
     sheet = workbook.sheet_by_name(sheet_name)
-    data_type, titles, working_array, gender, new_layer, columns_to_ignore = [], {}, {}, 'start', False, ['', 'Total']
+    age_groups, genders, columns, year_column \
+        = find_grim_sheet_layout(sheet.row_values(gender_row_index), sheet.row_values(title_row_index))
+
+    # fill a single array of the size found from the header rows, one column at a time
+    final_array = numpy.zeros(shape=(len(age_groups), sheet.nrows - title_row_index, len(genders)))
+    for g, gender in enumerate(genders):
+        for a, c in enumerate(columns[gender]):
+            final_array[a, :, g] = convert_to_integer_if_possible(sheet.col_values(c, start_rowx=title_row_index))
+    years = convert_to_integer_if_possible(sheet.col_values(year_column, start_rowx=title_row_index))
+
+    return age_groups, years, genders, final_array
+
 
-    for c in range(sheet.ncols):
+def find_grim_sheet_layout(gender_row, title_row):
+    """
+    Find the columns holding data for each gender of a GRIM-formatted spreadsheet from its two header rows.
+
+    Args:
+        gender_row: List of the values of the row with the gender strings in it
+        title_row: List of the values of the row with the titles in it
+    Returns:
+        age_groups: List of the age groups strings
+        genders: List of the strings for the genders, with persons first and then in the order of the sheet
+        columns: Dictionary keyed by gender of the list of the column indices for each age group
+        year_column: Index of the (last) column with the years in it
+    """
+
+    columns, titles, gender, columns_to_ignore = {}, {}, 'start', ['', 'Total']
+    for c in range(len(title_row)):
 
         # update first level of dictionary indices if necessary, the "data type"
-        if sheet.col_values(c)[gender_row_index] != u'':
-            gender = str(sheet.col_values(c)[gender_row_index])
-            new_layer = True
-        data_type.append(gender)
+        if gender_row[c] != u'':
+            gender = str(gender_row[c])
 
         # find second level of dictionary indices, i.e. the "title"
-        title = remove_element_from_unicode(sheet.col_values(c)[title_row_index], 8211, u' to ')
+        title = remove_element_from_unicode(title_row[c], 8211, u' to ')
 
-        # process column values
-        column_values = convert_to_integer_if_possible(sheet.col_values(c)[title_row_index:])
-
-        # record year values
+        # record year column
         if 'Year' in title:
-            years = column_values
+            year_column = c
 
         # ignore columns with no data
         elif title in columns_to_ignore:
             pass
 
-        # create main data structure
-        elif new_layer:
-            working_array[gender] = numpy.array(column_values)
-            new_layer = False
-            titles[gender] = [title]
+        # record the column against its gender
         elif gender != 'start':
-            working_array[gender] = numpy.vstack((working_array[gender], numpy.array(column_values)))
-            titles[gender].append(title)
+            columns.setdefault(gender, []).append(c)
+            titles.setdefault(gender, []).append(title)
+
+    # persons first, then the other genders in the order they appear in the sheet
+    age_groups = titles['Persons']
+    genders = ['Persons'] + [gender for gender in sorted(columns, key=lambda key: columns[key][0])
+                             if gender != 'Persons']
+    return age_groups, genders, {gender: columns[gender][:len(age_groups)] for gender in genders}, year_column
+
+
+def convert_xlsx_reference(reference):
+    """
+    Convert a cell reference from an xlsx file, such as AB12, to zero-based row and column indices.
+    """
+
+    letters, digits = re.match(r'([A-Z]+)(\d+)', reference).groups()
+    column = 0
+    for letter in letters:
+        column = column * 26 + ord(letter) - ord('A') + 1
+    return int(digits) - 1, column - 1
+
+
+def read_xlsx_text(element):
+    """
+    Text of an xlsx string element, stripped and unescaped in the same way as xlrd does.
+    """
+
+    text = element.text
+    if text is None:
+        return u''
+    if element.get('{http://www.w3.org/XML/1998/namespace}space') != 'preserve':
+        text = text.strip(u'\t\n\r ')
+    return unicode(re.sub(r'_x[0-9A-Fa-f]{4}_', lambda match: unichr(int(match.group(0)[2:6], 16)), text))
+
+
+def read_xlsx_string_item(element):
+    """
+    Text of a shared string or inline string element, joining its rich text runs and ignoring phonetic runs.
+    """
+
+    texts = []
+    for child in element:
+        if child.tag == xlsx_namespace + 't':
+            texts.append(read_xlsx_text(child))
+        elif child.tag == xlsx_namespace + 'r':
+            texts.extend(read_xlsx_text(run) for run in child if run.tag == xlsx_namespace + 't')
+    return u''.join(texts)
+
+
+def read_xlsx_shared_strings(archive):
+    """
+    Read the shared strings table of an xlsx file, streaming through it one string at a time.
+
+    Args:
+        archive: The xlsx file opened as a zip file
+    Returns:
+        List of the shared strings
+    """
+
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    shared_strings = []
+    for _, element in ElementTree.iterparse(archive.open('xl/sharedStrings.xml')):
+        if element.tag == xlsx_namespace + 'si':
+            shared_strings.append(read_xlsx_string_item(element))
+            element.clear()
+    return shared_strings
+
+
+def find_xlsx_sheet_path(archive, sheet_name):
+    """
+    Find the path within an xlsx file of the XML for a named sheet.
+
+    Args:
+        archive: The xlsx file opened as a zip file
+        sheet_name: String of the sheet of the book
+    Returns:
+        The path of the sheet's XML within the zip file
+    """
+
+    relationship_ids = {
+        sheet.get('name'): sheet.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id')
+        for sheet in ElementTree.fromstring(archive.read('xl/workbook.xml')).iter(xlsx_namespace + 'sheet')}
+    if sheet_name not in relationship_ids:
+        raise ValueError('Sheet not found in workbook: ' + sheet_name)
+    for relationship in ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels')):
+        if relationship.get('Id') == relationship_ids[sheet_name]:
+            target = relationship.get('Target')
+            return target[1:] if target.startswith('/') else 'xl/' + target
+
+
+def read_xlsx_cell(element, shared_strings):
+    """
+    Read the value of a cell element from an xlsx sheet, matching the value xlrd would give the cell.
+
+    Args:
+        element: The cell element
+        shared_strings: List of the shared strings of the workbook
+    Returns:
+        The value of the cell, or None if xlrd would treat the cell as blank
+    """
+
+    cell_type, value_element = element.get('t', 'n'), element.find(xlsx_namespace + 'v')
+    value = value_element.text if value_element is not None else None
+    if cell_type == 'n':
+        return float(value) if value else None
+    elif cell_type == 's':
+        return shared_strings[int(value)] if value else None
+    elif cell_type == 'str':
+        return read_xlsx_text(value_element) if value_element is not None else u''
+    elif cell_type == 'b':
+        return value == '1'
+    elif cell_type == 'e':
+        return xlsx_error_codes[value if value else '#N/A']
+    elif cell_type == 'inlineStr':
+        inline_string = element.find(xlsx_namespace + 'is')
+        value = read_xlsx_string_item(inline_string) if inline_string is not None else value
+        return value if value else None
+    raise ValueError('Unknown cell type: ' + cell_type)
+
+
+def write_grim_cell(final_array, years, cell_positions, year_column, row, column, value):
+    """
+    Write the value of a cell into the array (or years) that stream_grim_sheet is filling, if it is in a data column.
+
+    Args:
+        final_array: The array being filled
+        years: The array of years being filled
+        cell_positions: Dictionary keyed by column of the age group and gender indices that the column holds
+        year_column: Index of the column with the years in it
+        row: Index of the cell's row, counting from the title row
+        column: Index of the cell's column
+        value: The value of the cell
+    """
+
+    if column == year_column:
+        years[row] = convert_to_integer_if_possible([value])[0]
+    elif column in cell_positions:
+        final_array[cell_positions[column][0], row, cell_positions[column][1]] \
+            = convert_to_integer_if_possible([value])[0]
 
-    # depth stack the arrays created above
-    age_groups, genders = titles['Persons'], []
-    final_array \
-        = numpy.array(numpy.zeros(shape=(working_array['Persons'].shape[0], working_array['Persons'].shape[1], 0)))
-    for gender in working_array:
-        final_array = numpy.dstack((final_array, working_array[gender]))
-        genders.append(gender)
+
+def stream_grim_sheet(filename, sheet_name, title_row_index=5, gender_row_index=3):
+    """
+    Alternative to parse_grim_sheet that streams the rows of a single sheet out of the xlsx file in one pass, without
+    building the whole workbook in memory, and writes the data straight into the array as each cell is read.
+
+    Args:
+        filename: The name of the workbook file
+        sheet_name: String of the sheet of the book to be read
+        title_row_index: Integer for the row with the titles in it
+        gender_row_index: Integer for the row with the gender strings in it
+    Returns:
+        The same outputs as parse_grim_sheet
+    """
+
+    header_rows, final_array, n_rows, cell_positions = {gender_row_index: {}, title_row_index: {}}, None, 0, {}
+    n_dimension_rows = title_row_index + 1
+    with zipfile.ZipFile(filename) as archive:
+        shared_strings = read_xlsx_shared_strings(archive)
+        for _, element in ElementTree.iterparse(archive.open(find_xlsx_sheet_path(archive, sheet_name))):
+
+            # dimensions of the sheet, to size the array with
+            if element.tag == xlsx_namespace + 'dimension':
+                n_dimension_rows = convert_xlsx_reference(element.get('ref').split(':')[-1])[0] + 1
+
+            # merged cells extend the sheet, as they do in xlrd
+            elif element.tag == xlsx_namespace + 'mergeCell':
+                n_rows = max(n_rows, convert_xlsx_reference(element.get('ref').split(':')[-1])[0] + 1)
+
+            elif element.tag == xlsx_namespace + 'c':
+                row, column = convert_xlsx_reference(element.get('r'))
+                value = read_xlsx_cell(element, shared_strings)
+                if value is None:
+                    continue
+                n_rows = max(n_rows, row + 1)
+
+                # keep the header rows until the layout of the sheet can be found from them
+                if row in header_rows:
+                    header_rows[row][column] = value
+
+                # once past the header rows, allocate the array from them and the dimensions of the sheet
+                if row > title_row_index and final_array is None:
+                    n_columns = max(max(header_rows[gender_row_index] or [0]),
+                                    max(header_rows[title_row_index] or [0])) + 1
+                    age_groups, genders, columns, year_column = find_grim_sheet_layout(
+                        [header_rows[gender_row_index].get(c, u'') for c in range(n_columns)],
+                        [header_rows[title_row_index].get(c, u'') for c in range(n_columns)])
+                    final_array = numpy.zeros(shape=(len(age_groups), max(n_dimension_rows, row + 1) - title_row_index,
+                                                     len(genders)))
+                    years = numpy.zeros(final_array.shape[1], dtype=int)
+                    for g, gender in enumerate(genders):
+                        for a, c in enumerate(columns[gender]):
+                            cell_positions[c] = (a, g)
+
+                    # the title row is the first row of the array, as in parse_grim_sheet
+                    for title_column, title_value in header_rows[title_row_index].items():
+                        write_grim_cell(final_array, years, cell_positions, year_column, 0, title_column, title_value)
+
+                # write numeric values straight into the array, doubling its length if the dimensions were too small
+                if row > title_row_index:
+                    if row - title_row_index >= final_array.shape[1]:
+                        final_array = numpy.concatenate((final_array, numpy.zeros_like(final_array)), axis=1)
+                        years = numpy.concatenate((years, numpy.zeros_like(years)))
+                    write_grim_cell(final_array, years, cell_positions, year_column, row - title_row_index, column,
+                                    value)
+            elif element.tag == xlsx_namespace + 'row':
+                element.clear()
+
+    if final_array is None:
+        raise ValueError('No data found below the title row of sheet: ' + sheet_name)
+
+    # trim or extend to the rows actually present in the sheet
+    n_data_rows = n_rows - title_row_index
+    n_missing_rows = n_data_rows - final_array.shape[1]
+    if n_missing_rows > 0:
+        final_array = numpy.concatenate(
+            (final_array, numpy.zeros((final_array.shape[0], n_missing_rows, final_array.shape[2]))), axis=1)
+        years = numpy.concatenate((years, numpy.zeros(n_missing_rows, dtype=int)))
+    return age_groups, years[:n_data_rows].tolist(), genders, final_array[:, :n_data_rows, :]
+
+
+def parse_grim_workbook_sheet(filename, sheet_name, title_row_index=5, gender_row_index=3, backend='xlrd'):
+    """
+    Read a single GRIM-formatted spreadsheet from its workbook file with either of the two readers.
+
+    Args:
+        filename: The name of the workbook file
+        sheet_name: String of the sheet of the book to be read
+        title_row_index: Integer for the row with the titles in it
+        gender_row_index: Integer for the row with the gender strings in it
+        backend: Either xlrd to open the whole workbook with xlrd, or stream to stream just the one sheet
+    Returns:
+        The outputs of parse_grim_sheet
+    """
+
+    if backend == 'xlrd':
+        return parse_grim_sheet(open_workbook(filename), sheet_name, title_row_index, gender_row_index)
+    elif backend == 'stream':
+        return stream_grim_sheet(filename, sheet_name, title_row_index, gender_row_index)
+    raise ValueError('Spreadsheet reading backend not recognised: ' + str(backend))
+
+
+def restrict_to_years_with_data(final_array, years, years_to_keep=None):
+    """
+    Discard the rows (years) of a sheet's array that contain no data.
+
+    Args:
+        final_array: The array for the sheet, as returned from parse_grim_sheet
+        years: List of the year integers for all the rows of the sheet
+        years_to_keep: List of Booleans for the years of interest, only created when the all mortality sheet read
+    Returns:
+        final_array: The array restricted to the years being kept
+        years: List of the years being kept
+        years_to_keep: Boolean structure corresponding to the years to be kept
+    """
 
     # if all data are zeros for that row across all layers, discard that row (year)
     if years_to_keep is None:
         years_to_keep = numpy.any(numpy.all(final_array, axis=0), axis=1)
     final_array = final_array[:, years_to_keep, :]
     years = list(numpy.array(years)[years_to_keep])
+    return final_array, years, years_to_keep
+
+
+def read_single_grim_sheet(workbook, sheet_name, years_to_keep=None, title_row_index=5, gender_row_index=3):
+    """
+    Function to read a single GRIM-formatted spreadsheet.
+
+    Args:
+        workbook: The entire spreadsheet
+        sheet_name: String of the sheet of the book to be read
+        years_to_keep: List of Booleans for the years of interest, only created when the all mortality sheet read
+        title_row_index: Integer for the row with the titles in it
+        gender_row_index: Integer for the row with the gender strings in it
+    Returns:
+        age_groups: List of the age groups strings
+        years: List of the year integers
+        genders: List of the strings for the genders
+        final_array: The main array containing the data
+        years_to_keep: Boolean structure corresponding to the years to be kept if it is all-cause mortality being read
+    """
 
+    age_groups, years, genders, final_array \
+        = parse_grim_sheet(workbook, sheet_name, title_row_index=title_row_index, gender_row_index=gender_row_index)
+    final_array, years, years_to_keep = restrict_to_years_with_data(final_array, years, years_to_keep)
     return age_groups, years, genders, final_array, years_to_keep
 
 
-def read_all_grim_sheets(sheet_names):
+def find_grim_filename(name):
+    """
+    Find the name of the GRIM workbook file for a cause of death.
+
+    Args:
+        name: String for the cause of death, as used in the name of the workbook
+    """
+
+    return 'grim-' + name + '-2017.xlsx'
+
+
+def find_available_grim_causes(directory='.'):
+    """
+    Find all the causes of death that have a GRIM workbook in a directory, with all-causes-combined first.
+
+    Args:
+        directory: The directory to look for workbooks in
+    Returns:
+        List of the causes of death, as used in the names of their workbooks
+    """
+
+    prefix, suffix = find_grim_filename('*').split('*')
+    causes = sorted(os.path.basename(filename)[len(prefix):-len(suffix)]
+                    for filename in glob.glob(os.path.join(directory, find_grim_filename('*'))))
+    return sorted(causes, key=lambda cause: cause != 'all-causes-combined')
+
+
+def find_workbook_signature(filename):
+    """
+    Find the details of a workbook file that the cache uses to tell whether the file has changed since it was cached.
+
+    Args:
+        filename: The name of the workbook file
+    Returns:
+        Dictionary with the absolute path, modification time and size of the file
+    """
+
+    status = os.stat(filename)
+    return {'path': os.path.abspath(filename), 'mtime': status.st_mtime, 'size': status.st_size}
+
+
+def read_grim_cache_index(cache_directory):
+    """
+    Read the JSON index of the cache, which records the source workbook and the labels for each cached array.
+
+    Args:
+        cache_directory: The directory that the cache is stored in
+    Returns:
+        Dictionary of the index entries, keyed by workbook file name and sheet name, empty if there is no cache yet
+    """
+
+    index_filename = os.path.join(cache_directory, 'index.json')
+    if not os.path.isfile(index_filename):
+        return {}
+    with open(index_filename) as index_file:
+        return json.load(index_file)
+
+
+def write_grim_cache_index(cache_directory, index):
+    """
+    Write the JSON index of the cache, replacing the previous one in a single step.
+
+    Args:
+        cache_directory: The directory that the cache is stored in
+        index: Dictionary of the index entries
+    """
+
+    index_filename = os.path.join(cache_directory, 'index.json')
+    with open(index_filename + '.tmp', 'w') as index_file:
+        json.dump(index, index_file, indent=1, sort_keys=True)
+    os.rename(index_filename + '.tmp', index_filename)
+
+
+def find_grim_cache_key(filename, sheet_name):
+    """
+    Key for a sheet of a workbook in the cache index, also used as the stem of the cached array's file name.
+    """
+
+    return os.path.splitext(os.path.basename(filename))[0] + '_' + sheet_name
+
+
+def find_cached_grim_sheet_file(filename, sheet_name, cache_directory, index):
+    """
+    Find the file of a sheet's cached array, without loading it, provided the workbook has not changed since it was
+    cached.
+
+    Args:
+        filename: The name of the workbook file
+        sheet_name: String of the sheet of the book
+        cache_directory: The directory that the cache is stored in
+        index: Dictionary of the cache index entries
+    Returns:
+        The name of the array file, or None if there is no valid cached version of the sheet
+    """
+
+    key = find_grim_cache_key(filename, sheet_name)
+    if key not in index or {field: index[key][field] for field in ['path', 'mtime', 'size']} \
+            != find_workbook_signature(filename):
+        return None
+    array_filename = os.path.join(cache_directory, index[key]['array_file'])
+    return array_filename if os.path.isfile(array_filename) else None
+
+
+def read_cached_grim_sheet(filename, sheet_name, cache_directory, index):
+    """
+    Load a parsed sheet from the cache, provided the workbook it came from has not changed since it was cached.
+
+    Args:
+        filename: The name of the workbook file
+        sheet_name: String of the sheet of the book
+        cache_directory: The directory that the cache is stored in
+        index: Dictionary of the cache index entries
+    Returns:
+        The outputs of parse_grim_sheet, or None if there is no valid cached version of the sheet
+    """
+
+    array_filename = find_cached_grim_sheet_file(filename, sheet_name, cache_directory, index)
+    if array_filename is None:
+        return None
+    key = find_grim_cache_key(filename, sheet_name)
+    return [str(age_group) for age_group in index[key]['age_groups']], list(index[key]['years']), \
+        [str(gender) for gender in index[key]['genders']], numpy.load(array_filename)
+
+
+def write_cached_grim_sheet(filename, sheet_name, cache_directory, index, parsed_sheet, signature=None):
+    """
+    Save a parsed sheet to the cache and record it in the index (which needs to be written afterwards).
+
+    Args:
+        filename: The name of the workbook file
+        sheet_name: String of the sheet of the book
+        cache_directory: The directory that the cache is stored in
+        index: Dictionary of the cache index entries, which is updated
+        parsed_sheet: The outputs of parse_grim_sheet
+        signature: The signature of the workbook from find_workbook_signature, or None to find it from the file
+    """
+
+    age_groups, years, genders, final_array = parsed_sheet
+    key = find_grim_cache_key(filename, sheet_name)
+    numpy.save(os.path.join(cache_directory, key + '.npy'), final_array)
+    index[key] = dict(find_workbook_signature(filename) if signature is None else signature)
+    index[key].update({'array_file': key + '.npy', 'age_groups': age_groups, 'years': [int(year) for year in years],
+                       'genders': genders})
+
+
+def read_grim_sheet_with_cache(filename, sheet_name, title_row_index=5, gender_row_index=3, cache_directory=None,
+                               index=None, backend='xlrd'):
+    """
+    Parse a sheet of a GRIM workbook, or load it from the cache if the workbook has not changed since it was last
+    parsed.
+
+    Args:
+        filename: The name of the workbook file
+        sheet_name: String of the sheet of the book to be read
+        title_row_index: Integer for the row with the titles in it
+        gender_row_index: Integer for the row with the gender strings in it
+        cache_directory: The directory to store the cache in, or None to always parse the workbook
+        index: Dictionary of the cache index entries, which is read and written here if not supplied
+        backend: The reader to parse the workbook with, if it isn't cached
+    Returns:
+        The outputs of parse_grim_sheet
+    """
+
+    if cache_directory is None:
+        return parse_grim_workbook_sheet(filename, sheet_name, title_row_index, gender_row_index, backend)
+    write_index = index is None
+    index = read_grim_cache_index(cache_directory) if index is None else index
+    parsed_sheet = read_cached_grim_sheet(filename, sheet_name, cache_directory, index)
+    if parsed_sheet is None:
+        parsed_sheet = parse_grim_workbook_sheet(filename, sheet_name, title_row_index, gender_row_index, backend)
+        if not os.path.isdir(cache_directory):
+            os.makedirs(cache_directory)
+        write_cached_grim_sheet(filename, sheet_name, cache_directory, index, parsed_sheet)
+        if write_index:
+            write_grim_cache_index(cache_directory, index)
+    return parsed_sheet
+
+
+def parse_grim_deaths_sheet(filename, backend='xlrd'):
+    """
+    Open a GRIM workbook and parse its deaths sheet, defined at module level so that it can be sent to worker
+    processes.
+
+    Args:
+        filename: The name of the workbook file
+        backend: The reader to parse the workbook with
+    Returns:
+        The outputs of parse_grim_sheet
+    """
+
+    return parse_grim_workbook_sheet(filename, 'Deaths', backend=backend)
+
+
+def parse_grim_deaths_sheets(filenames, workers=1, backend='xlrd'):
+    """
+    Parse the deaths sheets of several workbooks, optionally spread across a pool of worker processes, yielding each
+    as it is parsed so that only the sheets not yet used by the caller are held at once.
+
+    Args:
+        filenames: List of the names of the workbook files
+        workers: Number of processes to parse the workbooks with, or one to parse them in this process
+        backend: The reader to parse the workbooks with
+    Returns:
+        Generator of the outputs of parse_grim_sheet, in the same order as filenames
+    """
+
+    if workers <= 1 or len(filenames) <= 1:
+        for filename in filenames:
+            yield parse_grim_deaths_sheet(filename, backend)
+        return
+    pool = multiprocessing.Pool(min(workers, len(filenames)))
+    try:
+        for parsed_sheet in pool.imap(functools.partial(parse_grim_deaths_sheet, backend=backend), filenames,
+                                      chunksize=1):
+            yield parsed_sheet
+    finally:
+        pool.close()
+        pool.join()
+
+
+def read_all_grim_sheets(sheet_names, cache_directory=None, workers=1, backend='xlrd', allocate=None):
     """
     Master function loop over all sheets and read each one, then concatenate the sheets together along the fourth
-    dimension.
+    dimension. The final array is allocated once the first sheet has been read and each sheet is copied into it as it
+    is read, so that no more than a few sheets are held alongside it.
 
     Args:
         sheet_names: The sheets that need to be read
+        cache_directory: The directory to cache the parsed sheets in, or None to always parse the workbooks
+        workers: Number of processes to parse the workbooks that aren't cached with
+        backend: The reader to parse the workbooks that aren't cached with, either xlrd or stream
+        allocate: Function taking the shape of the final array and returning a zeroed array to fill, such as a
+            memory-mapped one, or None for numpy.zeros
     Returns:
         age_groups: Age group strings directly from the sheet reading function
         years: List of years as integers directly from teh sheet reading function
         final_array: The final data structure in four dimensions by age group, years, gender and sheet (cause of death)
     """
 
-    # loop through sheet names
-    for n, name in enumerate(sheet_names):
+    # find the sheets that are already cached and start parsing the remainder
+    filenames = [find_grim_filename(name) for name in sheet_names]
+    index = read_grim_cache_index(cache_directory) if cache_directory else None
+    cached_files = [find_cached_grim_sheet_file(filename, 'Deaths', cache_directory, index) if index is not None
+                    else None for filename in filenames]
+    parsed_sheets = parse_grim_deaths_sheets([filenames[n] for n in range(len(filenames)) if cached_files[n] is None],
+                                             workers, backend)
+
+    final_array = None
+    for n in range(len(filenames)):
+        if cached_files[n] is None:
+            parsed_sheet = next(parsed_sheets)
+            if index is not None:
+                if not os.path.isdir(cache_directory):
+                    os.makedirs(cache_directory)
+                write_cached_grim_sheet(filenames[n], 'Deaths', cache_directory, index, parsed_sheet)
+        else:
+            parsed_sheet = read_cached_grim_sheet(filenames[n], 'Deaths', cache_directory, index)
 
         # ensure we keep the years from the all causes sheet, as there are several years with zero data in other sheets
-        years_to_keep = None if n == 0 else years_to_keep
-
-        # open excel workbook and find deaths sheet
-        book = open_workbook('grim-' + name + '-2017.xlsx')
-
-        # read with reading function above
-        age_groups, years, genders, sheet_array, years_to_keep \
-            = read_single_grim_sheet(book, 'Deaths', years_to_keep=years_to_keep)
-        if name == sheet_names[0]: final_array = numpy.array(numpy.zeros(shape=list(sheet_array.shape) + [0L]))
-        sheet_array = numpy.expand_dims(sheet_array, axis=3)
-
-        # first dimension is age groups, second is years, third is gender, fourth is cause of death
-        final_array = numpy.concatenate((final_array, sheet_array), axis=3)
+        if final_array is None:
+            age_groups, years, genders, first_array = parsed_sheet
+            _, years, years_to_keep = restrict_to_years_with_data(first_array, years)
+
+            # first dimension is age groups, second is years, third is gender, fourth is cause of death
+            shape = (len(age_groups), len(years), len(genders), len(sheet_names))
+            final_array = allocate(shape) if allocate else numpy.zeros(shape=shape)
+        final_array[:, :, :, n] = parsed_sheet[3][:, years_to_keep, :]
+        parsed_sheet = first_array = None
+    if index is not None and None in cached_files:
+        write_grim_cache_index(cache_directory, index)
 
     return age_groups, years, genders, final_array
 
@@ -281,7 +943,47 @@ def convert_grim_string(string_to_convert, capitalise_first_letter=False):
         return string_to_return
 
 
-def distribute_missing_across_agegroups(final_array, age_groups):
+def prepare_figure(figure=None):
+    """
+    Clear a figure so that it can be drawn on again, which is much quicker than creating a new one for each plot when
+    many are being saved.
+
+    Args:
+        figure: The figure to be reused, or None to create a new one
+    Returns:
+        The empty figure
+    """
+
+    if figure is None:
+        return plt.figure()
+    figure.clf()
+
+    # clearing leaves the spacing of the subplots as any tight layout left it
+    figure.subplots_adjust(**{parameter: plt.rcParams['figure.subplot.' + parameter]
+                              for parameter in ['left', 'right', 'bottom', 'top', 'wspace', 'hspace']})
+    return figure
+
+
+def save_figure(figure, filename, dpi=None):
+    """
+    Save a figure, adding the default extension (as savefig would) if the filename doesn't end with one for a format
+    that can be saved.
+
+    Args:
+        figure: The figure to save
+        filename: Name of the file to save to, with or without its extension
+        dpi: Resolution to save at, or None for the matplotlib default
+    Returns:
+        The name of the file saved, with its extension
+    """
+
+    if os.path.splitext(filename)[1][1:].lower() not in figure.canvas.get_supported_filetypes():
+        filename += '.' + plt.rcParams['savefig.format']
+    figure.savefig(filename, dpi=dpi)
+    return filename
+
+
+def distribute_missing_across_agegroups(final_array, age_groups, out=None):
     """
     Distribute the data missing age groups proportionately across remaining age groups. Note that is typically less than
     0.1% of all data, but still preferable to do this to improve the sense of the absolute rates of death.
@@ -289,40 +991,35 @@ def distribute_missing_across_agegroups(final_array, age_groups):
     Args:
         final_array: The final data array
         age_groups: List of age groups, so that the Missing one can be indexed (although it's always the last one)
+        out: Array to write the adjusted data into, or None for a new array
     Returns:
         adjusted_for_missing_array: Array structured as final_array was, but with no missing column and adjusted age
             group values
     """
 
-    adjusted_for_missing_array \
-        = numpy.zeros([final_array.shape[0] - 1, final_array.shape[1], final_array.shape[2], final_array.shape[3]])
-    for y in range(final_array.shape[1]):
-        for g in range(final_array.shape[2]):
-            for c in range(final_array.shape[3]):
-                prop_missing = final_array[age_groups.index('Missing'), y, g, c] \
-                               / sum(final_array[:age_groups.index('Missing'), y, g, c])
-                prop_missing = 0. if numpy.isnan(prop_missing) else prop_missing
-                adjusted_for_missing_array[:, y, g, c] \
-                    = final_array[:age_groups.index('Missing'), y, g, c] * (1. + prop_missing)
-    return adjusted_for_missing_array
+    # proportion missing for every year, gender and cause at once, taking 0 / 0 (no deaths at all) as none missing
+    missing_index = age_groups.index('Missing')
+    missing, total_not_missing = final_array[missing_index], numpy.sum(final_array[:missing_index], axis=0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        prop_missing = missing / total_not_missing
+    prop_missing[(missing == 0.) & (total_not_missing == 0.)] = 0.
+    return numpy.multiply(final_array[:missing_index], 1. + prop_missing, out=out)
 
 
-def find_rates_from_deaths_and_populations(death_array, pop_array, n_sheets):
+def find_rates_from_deaths_and_populations(death_array, pop_array, n_sheets, out=None):
     """
-    Divides the matrix of numbers of deaths by the population matrix.
+    Divides the matrix of numbers of deaths by the population matrix, for every sheet at once.
 
     Args:
         death_array: Array of deaths, which should be adjusted such that "Missing" age category isn't present
         pop_array: Array of total population numbers to be used as denominator
-        n_sheets: The number of spreadsheets read in to apply this function to
+        n_sheets: The number of spreadsheets read in to apply this function to, from the start of the fourth dimension
+        out: Array to write the rates into (which can be death_array itself), or None for a new array
     Returns:
-        rates_array: The array of death rates per year
+        The array of death rates per year
     """
 
-    rates_array = numpy.zeros_like(death_array)
-    for s in range(n_sheets):
-        rates_array[:, :, :, s] = numpy.divide(death_array[:, :, :, s], pop_array)
-    return rates_array
+    return numpy.divide(death_array[:, :, :, :n_sheets], numpy.expand_dims(pop_array, axis=3), out=out)
 
 
 def restrict_population_to_relevant_years(pop_array, data_years, population_years):
@@ -337,110 +1034,628 @@ def restrict_population_to_relevant_years(pop_array, data_years, population_year
         population_years: The years available in the population matrix
     """
 
-    return pop_array[:, population_years.index(data_years[0]):population_years.index(data_years[-1]) + 1, :]
+    return pop_array[:, population_years.index(data_years[0]):population_years.index(data_years[-1]) + 1, :]
+
+
+def select_grim_sheet_years(sheet_array, sheet_years, years):
+    """
+    Take the columns of a parsed sheet for a list of years, in the order of that list, with zeros for any of the years
+    that the sheet doesn't have.
+
+    Args:
+        sheet_array: Array of a parsed sheet by age group, year and gender
+        sheet_years: List of the years of the sheet's array
+        years: List of the years to take
+    Returns:
+        Array by age group, year (as ordered in years) and gender
+    """
+
+    sheet_positions = DimensionIndex.find_label_positions(sheet_years)
+    selected_array = numpy.zeros((sheet_array.shape[0], len(years), sheet_array.shape[2]))
+    found = [y for y, year in enumerate(years) if year in sheet_positions]
+    selected_array[:, found] = sheet_array[:, [sheet_positions[years[y]] for y in found]]
+    return selected_array
+
+
+def append_zero_years(array, n_years, axis=1):
+    """
+    Extend an array along its year dimension (the second, for the data arrays) by a number of years of zeros, to be
+    filled in afterwards.
+    """
+
+    shape = list(array.shape)
+    shape[axis] = n_years
+    return numpy.concatenate((array, numpy.zeros(shape)), axis=axis)
+
+
+def find_agegroup_values_from_strings(age_group_strings):
+    """
+    Function to extract the integer values of the age groups from their strings.
+
+    Args:
+        age_group_strings: The list containing the string descriptions of the age groups
+    Returns:
+        start_ages: The starting age for each age group
+        end_ages: The ending age for each age group
+    """
+
+    start_ages = []
+    end_ages = []
+    for age_group in age_group_strings:
+        age_group_splits = age_group.split(' ')
+        if age_group_splits[0] == '85+':
+            start_ages.append(85)
+            end_ages.append(float('inf'))
+        elif age_group_splits[0] == 'Missing':
+            start_ages.append(0)
+            end_ages.append(float('inf'))
+        else:
+            start_ages.append(int(age_group_splits[0]))
+            end_ages.append(int(age_group_splits[-1]))
+    return start_ages, end_ages
+
+
+karup_king_coefficients = {'first':
+                               ((.344, -.208, .064),
+                                (.248, -.056, .008),
+                                (.176, .048, -.024),
+                                (.128, .104, -.032),
+                                (.104, .122, -.016)),
+                           'middle':
+                               ((.064, .152, -.016),
+                                (.008, .224, -.032),
+                                (-.024, .248, -.024),
+                                (-.032, .224, .008),
+                                (-.016, .152, .064)),
+                           'last':
+                               ((-.016, .112, .104),
+                                (-.032, .104, .128),
+                                (-.024, .048, .176),
+                                (.008, -.056, .248),
+                                (.064, -.208, .344))}
+karup_king_matrices = {}
+
+
+def find_karup_king_group(group_index, last_age_group_index):
+    """
+    Find which set of Karup-King coefficients applies to an age group and where its three neighbouring age groups
+    start relative to it.
+
+    Args:
+        group_index: The index for the age group of interest
+        last_age_group_index: The index for the highest age group to be analysed
+    Returns:
+        group: Key to the coefficients dictionary
+        group_start_adjustment: Index of the first of the three age groups used, relative to group_index
+    """
+
+    if group_index < 0:
+        raise ValueError('Group index cannot be negative')
+    elif group_index > last_age_group_index:
+        raise ValueError('Group index cannot be greater than number of groups')
+    elif group_index == 0:
+        return 'first', 0
+    elif group_index == last_age_group_index:
+        return 'last', -2
+    else:
+        return 'middle', -1
+
+
+def karup_king_interpolation(group_index, within_group_index, last_age_group_index, data, age_group_width=5.):
+    """
+    Method to interpolate data to yearly intervals using the relatively simple Karup-King approach, which multiplies
+    pre-defined coefficients by the rates in the age groups of interest and those on either side - except in the case
+    where these are unavailable (i.e. the first or last) for which the closest three age groups are taken.
+
+    Args:
+        group_index: The index for the age group of interest
+        within_group_index: Distance through the subgroup being analysed (i.e the five years)
+        last_age_group_index: The index for the highest age group to be analysed
+        data: List (or one-dimensional array) for the quantities being smoothed
+        age_group_width: The number of single ages in the age group (currently has to be five)
+    Returns:
+        interpolated_estimate: The interpolated rate for the single year of interest
+    """
+
+    group, group_start_adjustment = find_karup_king_group(group_index, last_age_group_index)
+    interpolated_estimate = 0.
+    for n_age_group in range(3):
+        interpolated_estimate += age_group_width * karup_king_coefficients[group][within_group_index][n_age_group] \
+                                 * data[group_index + n_age_group + group_start_adjustment]
+    return interpolated_estimate
+
+
+def find_karup_king_matrix(last_age_group_index, age_group_width=5):
+    """
+    Build the matrix that maps data by age group to single years of age with Karup-King interpolation, such that
+    multiplying it by the age group data gives the same results as karup_king_interpolation for every single year at
+    once. Matrices are only built once for each number of age groups and then kept.
+
+    Args:
+        last_age_group_index: The index for the highest age group to be analysed
+        age_group_width: The number of single ages in each age group (currently has to be five)
+    Returns:
+        Read-only array with a row for each single year of age and a column for each age group
+    """
+
+    if age_group_width != len(karup_king_coefficients['middle']):
+        raise ValueError('Karup-King coefficients are only available for age groups of width %d'
+                         % len(karup_king_coefficients['middle']))
+    key = (last_age_group_index, age_group_width)
+    if key not in karup_king_matrices:
+        matrix = numpy.zeros(((last_age_group_index + 1) * age_group_width, last_age_group_index + 1))
+        for group_index in range(last_age_group_index + 1):
+            group, group_start_adjustment = find_karup_king_group(group_index, last_age_group_index)
+            first_group = group_index + group_start_adjustment
+            matrix[group_index * age_group_width:(group_index + 1) * age_group_width, first_group:first_group + 3] \
+                = age_group_width * numpy.array(karup_king_coefficients[group])
+        matrix.setflags(write=False)
+        karup_king_matrices[key] = matrix
+    return karup_king_matrices[key]
+
+
+def interpolate_rates_to_single_years(rates, age_group_width=5):
+    """
+    Interpolate an array of data by age group to single years of age for all of its other dimensions at once.
+
+    Args:
+        rates: Array with age group as its first dimension, such as the unadjusted rates by age, year, gender and cause
+        age_group_width: The number of single ages in each age group
+    Returns:
+        Array structured as rates, but with single years of age as its first dimension
+    """
+
+    return numpy.tensordot(find_karup_king_matrix(rates.shape[0] - 1, age_group_width), rates, axes=(1, 0))
+
+
+def convert_integer_age_to_string(age):
+    """
+    Convert integer age value to string to index lists of data object.
+
+    Args:
+        age: Integer value for age
+    """
+
+    if age < 85:
+        return str(age) + ' to ' + str(age + 4)
+    else:
+        return '85+'
+
+
+def find_age_group_indices(age_group_strings, integer_ages):
+    """
+    Find the age group that each single year of age falls in, and how far through that age group it is.
+
+    Args:
+        age_group_strings: The list containing the string descriptions of the age groups
+        integer_ages: The single years of age
+    Returns:
+        group_indices: Array of the index of the age group for each single year of age
+        within_group_indices: Array of the distance through the age group for each single year of age
+    """
+
+    age_group_lower, age_group_upper = find_agegroup_values_from_strings(age_group_strings)
+    group_indices = numpy.array([next(x[0] for x in enumerate(age_group_upper) if x[1] >= age)
+                                 for age in integer_ages])
+    return group_indices, numpy.array(integer_ages) - numpy.array(age_group_lower)[group_indices]
+
+
+def find_average_rates(adjusted_deaths, populations, rates, age_group_strings, upper_age_limits, age_weights):
+    """
+    Death rates by year averaged over the age groups up to each upper age limit, crude and standardised.
+
+    Args:
+        adjusted_deaths: Array of deaths (with those of missing age distributed) by age group, year, gender and cause
+        populations: Array of populations by age group, year and gender
+        rates: Array of death rates by age group, year, gender and cause
+        age_group_strings: The list containing the string descriptions of the age groups
+        upper_age_limits: List of the age groups to average up to, inclusive
+        age_weights: Array of the standard weights by standard, upper age limit and age group
+    Returns:
+        crude: Dictionary of the crude rates by year, gender and cause, keyed by upper age limit
+        standardised: Array of the standardised rates by standard, upper age limit, year, gender and cause
+    """
+
+    crude = {}
+    for upper_age_limit in upper_age_limits:
+
+        # index for one up from the age group of interest, to make indexing inclusive
+        up = age_group_strings.index(upper_age_limit) + 1
+
+        # crude, with the denominator broadcast across causes
+        crude[upper_age_limit] = numpy.sum(adjusted_deaths[:up], axis=0) \
+            / numpy.expand_dims(numpy.sum(populations[:up], axis=0), axis=2)
+
+    # standardised to every standard and upper age limit in one pass
+    return crude, numpy.einsum('sla,aygc->slygc', age_weights, rates)
+
+
+def find_single_year_matrix(age_group_strings, integer_ages, n_age_groups, karup_king=True):
+    """
+    Build the matrix that maps rates by age group to single years of age, either with Karup-King interpolation or with
+    each single year taking the rate of its age group. Ages past those that Karup-King interpolation reaches (the
+    five years from the start of the last age group) take the rate of the last age group, which is open.
+
+    Args:
+        age_group_strings: The list containing the string descriptions of the age groups
+        integer_ages: The single years of age
+        n_age_groups: The number of age groups of the rates, starting from the first of age_group_strings
+        karup_king: Whether to use Karup-King interpolators, rather than rectangular distributions
+    Returns:
+        Array with a row for each single year of age and a column for each age group
+    """
+
+    group_indices, within_group_indices = find_age_group_indices(age_group_strings[:n_age_groups], integer_ages)
+    interpolation_matrix = numpy.zeros((len(integer_ages), n_age_groups))
+    interpolation_matrix[numpy.arange(len(integer_ages)), group_indices] = 1.
+    if karup_king:
+        age_group_width = len(karup_king_coefficients['middle'])
+        karup_king_matrix = find_karup_king_matrix(n_age_groups - 1, age_group_width)
+        rows = group_indices * age_group_width + within_group_indices
+        interpolated = rows < karup_king_matrix.shape[0]
+        interpolation_matrix[interpolated] = karup_king_matrix[rows[interpolated]]
+    return interpolation_matrix
+
+
+def find_cumulative_deaths(survival, single_year_rates):
+    """
+    Cumulative deaths by cause up to the start of each age, weighting the deaths at each age by the survival to it.
+
+    Args:
+        survival: Array of the proportion surviving to the start of each age by age, year and gender, with one more
+            age than single_year_rates
+        single_year_rates: Array of death rates by single year of age, year, gender and cause
+    Returns:
+        Array of cumulative deaths by age, year, gender and cause, with the same ages as survival
+    """
+
+    cumulative_deaths = numpy.zeros(survival.shape + single_year_rates.shape[3:])
+    cumulative_deaths[1:] = numpy.cumsum(numpy.expand_dims(survival[:-1], axis=3) * single_year_rates, axis=0)
+    return cumulative_deaths
+
+
+def find_survival_and_cumulative_deaths(rates, age_group_strings, integer_ages, all_cause_index=0, karup_king=True,
+                                        single_year_rates=None):
+    """
+    Life table engine that finds survival and cumulative deaths by cause for every year, gender and cause at once,
+    treating the (single year) rates as the probability of death over the year of age.
+
+    Args:
+        rates: Array of death rates by age group, year, gender and cause
+        age_group_strings: The list containing the string descriptions of the age groups
+        integer_ages: The single years of age to construct the life tables over
+        all_cause_index: Index of all-cause mortality along the cause dimension of the rates
+        karup_king: Whether to use Karup-King interpolators, rather than rectangular distributions
+        single_year_rates: Array of the rates already found by single year of age from zero, as from
+            find_single_year_matrix, to be used rather than interpolating the rates again
+    Returns:
+        survival: Array of the proportion surviving to the start of each age, with one more age than integer_ages
+        cumulative_deaths: Array of cumulative deaths by cause up to the start of each age, again with an extra age
+    """
+
+    # single year rates, from the matrix mapping the age group rates to them if they haven't already been found
+    if single_year_rates is None:
+        single_year_rates = numpy.tensordot(
+            find_single_year_matrix(age_group_strings, integer_ages, rates.shape[0], karup_king), rates, axes=(1, 0))
+    else:
+        single_year_rates = single_year_rates[integer_ages]
+
+    # survival from all-cause rates, then deaths by cause weighted by the survival at the start of each age
+    survival = numpy.ones((len(integer_ages) + 1,) + rates.shape[1:3])
+    survival[1:] = numpy.cumprod(1. - single_year_rates[:, :, :, all_cause_index], axis=0)
+    return survival, find_cumulative_deaths(survival, single_year_rates)
+
+
+def find_period_life_tables(rates, age_group_strings, years, genders, karup_king=True, radix=1.,
+                            single_year_rates=None):
+    """
+    Period life tables for every year and gender at once, from all-cause death rates. The rates are converted to
+    probabilities of death assuming deaths are spread evenly over each age interval and the last age interval is open,
+    with its expectation of life found from its rate.
+
+    Args:
+        rates: Array of all-cause death rates by age group, year and gender
+        age_group_strings: The list containing the string descriptions of the age groups
+        years: List of the years of the rates
+        genders: List of the genders of the rates
+        karup_king: Whether to graduate the rates to single years of age with Karup-King interpolation up to the
+            start of the open age group, rather than using the age groups
+        radix: The number alive at the start of the first age
+        single_year_rates: Array of the all-cause rates already graduated to single years of age from zero, to be
+            used rather than interpolating the rates again
+    Returns:
+        Dictionary of the labels for each dimension of its data array, which is by function, age, year and gender, with
+            the functions mx (death rate), qx (probability of death), lx (number alive), dx (deaths), Lx (person-years
+            lived), Tx (person-years remaining) and ex (expectation of life)
+    """
+
+    n_age_groups = rates.shape[0]
+    lower_ages = find_agegroup_values_from_strings(age_group_strings)[0][:n_age_groups]
+    if karup_king:
+        if single_year_rates is None:
+            single_year_rates = interpolate_rates_to_single_years(rates, lower_ages[1] - lower_ages[0])
+        mx = numpy.concatenate((single_year_rates[:lower_ages[-1]], rates[-1:]))
+        ages = range(lower_ages[-1] + 1)
+    else:
+        mx, ages = rates, lower_ages
+    mx = numpy.maximum(mx, 0.)
+
+    # closed intervals, with half the deaths' person-years lived in the interval
+    widths = numpy.diff(ages).reshape((-1, 1, 1)).astype(float)
+    qx = numpy.ones_like(mx)
+    qx[:-1] = numpy.minimum(widths * mx[:-1] / (1. + widths / 2. * mx[:-1]), 1.)
+    lx = numpy.empty_like(mx)
+    lx[0], lx[1:] = radix, radix * numpy.cumprod(1. - qx[:-1], axis=0)
+    dx = lx * qx
+    person_years = numpy.empty_like(mx)
+    person_years[:-1] = widths * (lx[:-1] - dx[:-1] / 2.)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        person_years[-1] = lx[-1] / mx[-1]
+        remaining_person_years = numpy.cumsum(person_years[::-1], axis=0)[::-1]
+        expectation_of_life = remaining_person_years / lx
+    return {'functions': ['mx', 'qx', 'lx', 'dx', 'Lx', 'Tx', 'ex'], 'ages': list(ages), 'years': list(years),
+            'genders': list(genders),
+            'data': numpy.array([mx, qx, lx, dx, person_years, remaining_person_years, expectation_of_life])}
+
+
+def find_single_year_rates_sheet_name(karup_king, max_age, dtype):
+    """
+    Name that the single year rates of a cause are cached under, as if a sheet of its workbook, which differs for each
+    way of finding them.
+    """
+
+    return 'single-year-rates-%s-%d-%s' % ('karup-king' if karup_king else 'rectangular', max_age,
+                                           numpy.dtype(dtype).name)
+
+
+def read_cached_single_year_rates(filename, sheet_name, cache_directory, index, years, signatures):
+    """
+    Load the single year rates of a cause from the cache, provided they were found from the same workbooks (for the
+    deaths and for the populations) and for the same years.
+
+    Args:
+        filename: The name of the cause's workbook
+        sheet_name: The name the rates are cached under, from find_single_year_rates_sheet_name
+        cache_directory: The directory that the cache is stored in
+        index: Dictionary of the cache index entries
+        years: List of the years of the rates
+        signatures: The signatures of the cause's workbook and the all-causes workbook when the data were read
+    Returns:
+        Array of the rates by single year of age, year and gender, or None if there is no valid cached version
+    """
+
+    key = find_grim_cache_key(filename, sheet_name)
+    if key not in index or {field: index[key][field] for field in ['path', 'mtime', 'size']} != signatures[0] \
+            or index[key].get('population') != signatures[1] or list(index[key]['years']) != list(years):
+        return None
+    array_filename = os.path.join(cache_directory, index[key]['array_file'])
+    return numpy.load(array_filename) if os.path.isfile(array_filename) else None
+
+
+def write_cached_single_year_rates(filename, sheet_name, cache_directory, index, years, genders, signatures,
+                                   single_year_rates):
+    """
+    Save the single year rates of a cause to the cache, recording the workbooks they were found from (as they were
+    when read, so that the workbooks don't need to be found again) in the index, which needs to be written afterwards.
+    """
+
+    write_cached_grim_sheet(filename, sheet_name, cache_directory, index,
+                            ([str(age) for age in range(len(single_year_rates))], years, genders, single_year_rates),
+                            signatures[0])
+    index[find_grim_cache_key(filename, sheet_name)]['population'] = signatures[1]
 
 
-def find_agegroup_values_from_strings(age_group_strings):
+def convert_cohort_to_array(cohort, age_groups, genders):
     """
-    Function to extract the integer values of the age groups from their strings.
+    Convert a cohort composition from nested dictionaries into an array of counts.
 
     Args:
-        age_group_strings: The list containing the string descriptions of the age groups
+        cohort: Dictionary keyed by age group string, with values that are dictionaries of counts keyed by gender
+        age_groups: List of the age groups, in the order of the array's first dimension
+        genders: List of the genders, in the order of the array's second dimension
     Returns:
-        start_ages: The starting age for each age group
-        end_ages: The ending age for each age group
+        Array of counts by age group and gender, with zero for any missing from the dictionaries
     """
 
-    start_ages = []
-    end_ages = []
-    for age_group in age_group_strings:
-        age_group_splits = age_group.split(' ')
-        if age_group_splits[0] == '85+':
-            start_ages.append(85)
-            end_ages.append(float('inf'))
-        elif age_group_splits[0] == 'Missing':
-            start_ages.append(0)
-            end_ages.append(float('inf'))
-        else:
-            start_ages.append(int(age_group_splits[0]))
-            end_ages.append(int(age_group_splits[-1]))
-    return start_ages, end_ages
+    return numpy.array([[float(cohort.get(age_group, {}).get(gender, 0.)) for gender in genders]
+                        for age_group in age_groups])
 
 
-def karup_king_interpolation(group_index, within_group_index, last_age_group_index, data, age_group_width=5.):
+def find_weighted_rates(cohorts, deaths, populations, z_score=1.959963984540054):
     """
-    Method to interpolate data to yearly intervals using the relatively simple Karup-King approach, which multiplies
-    pre-defined coefficients by the rates in the age groups of interest and those on either side - except in the case
-    where these are unavailable (i.e. the first or last) for which the closest three age groups are taken.
+    Death rates weighted by the age and gender composition of several cohorts at once, with confidence intervals from
+    the normal approximation to the Poisson distribution of the deaths in each age group and gender.
 
     Args:
-        group_index: The index for the age group of interest
-        within_group_index: Distance through the subgroup being analysed (i.e the five years)
-        last_age_group_index: The index for the highest age group to be analysed
-        data: List (or one-dimensional array) for the quantities being smoothed
-        age_group_width: The number of single ages in the age group (currently has to be five)
+        cohorts: Array of counts by cohort, age group and gender
+        deaths: Array of deaths by age group, year, gender and cause
+        populations: Array of populations by age group, year and gender
+        z_score: Standard normal quantile for the width of the intervals, with the default giving 95% intervals
     Returns:
-        interpolated_estimate: The interpolated rate for the single year of interest
+        Dictionary of arrays by cohort, year and cause, for the rates, standard errors and lower and upper limits
     """
 
-    coefficients = {'first':
-                        ((.344, -.208, .064),
-                         (.248, -.056, .008),
-                         (.176, .048, -.024),
-                         (.128, .104, -.032),
-                         (.104, .122, -.016)),
-                    'middle':
-                        ((.064, .152, -.016),
-                         (.008, .224, -.032),
-                         (-.024, .248, -.024),
-                         (-.032, .224, .008),
-                         (-.016, .152, .064)),
-                    'last':
-                        ((-.016, .112, .104),
-                         (-.032, .104, .128),
-                         (-.024, .048, .176),
-                         (.008, -.056, .248),
-                         (.064, -.208, .344))}
-    if group_index < 0:
-        print('Group index cannot be negative')
-    elif group_index > last_age_group_index:
-        print('Group index cannot be greater than number of groups')
-    elif group_index == 0:
-        group, group_start_adjustment = 'first', 0
-    elif group_index == last_age_group_index:
-        group, group_start_adjustment = 'last', -2
-    else:
-        group, group_start_adjustment = 'middle', -1
-    interpolated_estimate = 0.
-    for n_age_group in range(3):
-        interpolated_estimate += age_group_width * coefficients[group][within_group_index][n_age_group] \
-                                 * data[group_index + n_age_group + group_start_adjustment]
-    return interpolated_estimate
-
+    weights = cohorts / numpy.sum(cohorts, axis=(1, 2), keepdims=True)
+    populations = numpy.expand_dims(populations, axis=3)
+    rates = numpy.einsum('nag,aygc->nyc', weights, deaths / populations)
+    standard_errors = numpy.sqrt(numpy.einsum('nag,aygc->nyc', weights ** 2., deaths / populations ** 2.))
+    return {'rates': rates, 'standard_errors': standard_errors,
+            'lower_limits': numpy.maximum(rates - z_score * standard_errors, 0.),
+            'upper_limits': rates + z_score * standard_errors}
 
-def convert_integer_age_to_string(age):
-    """
-    Convert integer age value to string to index lists of data object.
 
-    Args:
-        age: Integer value for age
-    """
+# standard populations that can be looked up by name, from files or by lower limit of each age band
+standard_population_registry = {
+    'aus2001': {'filename': 'australian_standard_population_2001.xls', 'reader': read_standard_population},
+    'who2000': {'population_by_age': dict(zip(range(0, 105, 5), [
+        8860, 8690, 8600, 8470, 8220, 7930, 7610, 7150, 6590, 6040, 5370, 4550, 3720, 2960, 2210, 1520, 910, 440,
+        150, 40, 5]))},
+    'segi': {'population_by_age': dict(zip(range(0, 90, 5), [
+        12000, 10000, 9000, 9000, 8000, 8000, 6000, 6000, 6000, 6000, 5000, 4000, 4000, 3000, 2000, 1000, 500, 500]))}}
 
-    if age < 85:
-        return str(age) + ' to ' + str(age + 4)
-    else:
-        return '85+'
+# standard populations binned into the GRIM age groups, filled as each is first looked up
+standard_population_vectors = {}
 
 
 ''' objects '''
 
 
+class StageProfiler:
+    def __init__(self, enabled=True):
+        """
+        Records the wall time, CPU time and sizes of the arrays created for each stage of the data processing, if
+        enabled.
+
+        Args:
+            enabled: Whether to record anything, so that stages can always be wrapped in the profiler
+        """
+
+        self.enabled, self.stages, self.open_stages = enabled, [], []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager to profile the code run within it as a stage, which can be nested within other stages.
+
+        Args:
+            name: String to identify the stage in the report
+        """
+
+        if not self.enabled:
+            yield self
+            return
+        record = {'stage': name, 'arrays': {}, 'allocated_bytes': 0, 'depth': len(self.open_stages)}
+        self.open_stages.append(record)
+        wall_start, cpu_start = time.time(), sum(os.times()[:2])
+        try:
+            yield self
+        finally:
+            record['wall_time'], record['cpu_time'] = time.time() - wall_start, sum(os.times()[:2]) - cpu_start
+            self.open_stages.pop()
+            self.stages.append(record)
+
+    def record_arrays(self, **arrays):
+        """
+        Record the arrays created by the stage currently being run, keyed by names to identify them in the report.
+        """
+
+        if not self.open_stages:
+            return
+        for name, array in arrays.items():
+            self.open_stages[-1]['arrays'][name] \
+                = {'shape': list(array.shape), 'dtype': str(array.dtype), 'bytes': int(array.nbytes)}
+            self.open_stages[-1]['allocated_bytes'] += int(array.nbytes)
+
+    def report(self):
+        """
+        Structured report of the stages run so far, in the order they finished, with totals over the outermost stages.
+        """
+
+        outer_stages = [record for record in self.stages if record['depth'] == 0]
+        return {'stages': self.stages,
+                'total_wall_time': sum(record['wall_time'] for record in outer_stages),
+                'total_cpu_time': sum(record['cpu_time'] for record in outer_stages),
+                'total_allocated_bytes': sum(record['allocated_bytes'] for record in self.stages)}
+
+    def dump(self, filename):
+        """
+        Write the report to a JSON file.
+        """
+
+        with open(filename, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=1, sort_keys=True)
+
+
+class DimensionIndex:
+    def __init__(self, grim_books_data, causes):
+        """
+        Lookup structure built once from the data object's labels, mapping each label to its position along the
+        dimension of the data arrays that it indexes, so that elements can be found without searching lists.
+
+        Args:
+            grim_books_data: The data object's dictionary of population and deaths data and their labels
+            causes: List of the causes of death (sheets) in the order of the fourth dimension of the deaths arrays
+        """
+
+        self.positions = {
+            'age_groups': self.find_label_positions(grim_books_data['deaths']['age_groups']),
+            'years': self.find_label_positions(grim_books_data['deaths']['years']),
+            'population_years': self.find_label_positions(grim_books_data['population']['years']),
+            'genders': self.find_label_positions(grim_books_data['deaths']['genders']),
+            'causes': self.find_label_positions(causes)}
+
+    @staticmethod
+    def find_label_positions(labels):
+        """
+        Dictionary mapping each label to its position in the list of labels.
+        """
+
+        return {label: position for position, label in enumerate(labels)}
+
+    def find_positions(self, dimension, labels):
+        """
+        Find the positions of several labels along a dimension.
+
+        Args:
+            dimension: String for the dimension, which is a key to self.positions
+            labels: List of the labels to be found
+        Returns:
+            Array of the integer positions of the labels
+        """
+
+        try:
+            return numpy.array([self.positions[dimension][label] for label in labels], dtype=int)
+        except KeyError as error:
+            raise KeyError('%s not found in %s' % (error.args[0], dimension))
+
+
+class CauseRates:
+    def __init__(self, data_object):
+        """
+        Accessor for the death rates of a single cause of death, reading the cause the first time it is requested if the
+        data object is lazy and hasn't read it yet.
+
+        Args:
+            data_object: The data structure that the rates are stored in
+        """
+
+        self.data_object = data_object
+
+    def __getitem__(self, cause):
+        """
+        Rates for the cause by age group, year and gender.
+        """
+
+        self.data_object.load_causes([cause])
+        c = self.data_object.index.find_positions('causes', [cause])[0]
+        return self.data_object.rates['unadjusted'][:, :, :, c]
+
+
 class Spring:
-    def __init__(self):
+    def __init__(self, cache_directory='grim_cache', workers=1, lazy=False, backend='xlrd', profile=False,
+                 causes=None, standards=None, dtype=float, storage_directory=None):
         """
         Basic data processing structure that reads the input spreadsheets, processes them and can then be fed to the
         outputs structure for graphing, etc.
 
+        Args:
+            cache_directory: Directory for the cache of parsed workbooks, which are only re-parsed when their file has
+                changed, or None to parse all the workbooks every time
+            workers: Number of processes to parse the death workbooks with
+            lazy: Whether to only read all-cause mortality now, with each other cause read when it is first accessed,
+                either through load_cause, the cause_rates accessor or the outputs (which otherwise raise KeyError for
+                causes that weren't read)
+            backend: Reader for the workbooks that aren't cached, either xlrd or stream to stream the sheets needed
+            profile: Whether to record the time taken and arrays created by each stage of the processing in
+                self.profiler, which can then be reported with dump_profile
+            causes: List of the causes of death (sheets) to read, or None for the default list below, with
+                all-causes-combined always read first whether or not it is included
+            standards: List of the names of the standard populations to standardise the rates to, from
+                standard_population_registry, with the first used for the standardised rates in the outputs
+            dtype: Data type of the deaths, adjusted deaths and rates arrays, such as float32 to halve their memory
+            storage_directory: Directory to keep the deaths, adjusted deaths and rates arrays in as memory-mapped
+                files, rather than in memory, or None to keep them in memory
+
         For data structures, dimensions are:
         1. age group
         2. years
@@ -476,88 +1691,532 @@ class Spring:
         # 'kidney-failure', 'suicide', 'accidental-drowning', 'accidental-poisoning', 'assault',
         # 'land-transport-accidents', 'liver-disease']
 
+        if causes:
+            self.grim_sheets_to_read \
+                = ['all-causes-combined'] + [cause for cause in causes if cause != 'all-causes-combined']
+
+        # in lazy mode, the other causes are added to the end of the list as they are read
+        self.lazy = lazy
+        if lazy:
+            self.grim_sheets_to_read = self.grim_sheets_to_read[:1]
+
+        # the state of each workbook when read, for update to find those that have changed since
+        self.workbook_signatures = {cause: find_workbook_signature(find_grim_filename(cause))
+                                    for cause in self.grim_sheets_to_read}
+
+        self.cache_directory, self.backend, self.profiler = cache_directory, backend, StageProfiler(enabled=profile)
+        self.dtype, self.storage_directory, self.storage_read_only = numpy.dtype(dtype), storage_directory, False
+        if storage_directory and not os.path.isdir(storage_directory):
+            os.makedirs(storage_directory)
+        self.cause_rates = CauseRates(self)
         self.integer_ages = range(90)
-        self.life_tables, self.cumulative_deaths_by_cause, self.rates, self.average_rates_by_year = {}, {}, {}, {}
+        self.life_tables, self.cumulative_deaths_by_cause, self.rates, self.average_rates_by_year = None, None, {}, {}
+        self.period_life_tables, self.version = None, 0
+        self.single_year_rates, self.single_year_rate_options = None, None
         self.grim_books_data = {'population': {}, 'deaths': {}}
 
         # read population data
-        book = open_workbook('grim-' + self.grim_sheets_to_read[0] + '-2017.xlsx')
-        (self.grim_books_data['population']['age_groups'], self.grim_books_data['population']['years'],
-         self.grim_books_data['population']['genders'], self.grim_books_data['population']['data'], _) \
-            = read_single_grim_sheet(book, 'Populations', title_row_index=14, gender_row_index=12)
+        with self.profiler.stage('population_read'):
+            (self.grim_books_data['population']['age_groups'], population_years,
+             self.grim_books_data['population']['genders'], population_array) \
+                = read_grim_sheet_with_cache(find_grim_filename(self.grim_sheets_to_read[0]), 'Populations',
+                                             title_row_index=14, gender_row_index=12, cache_directory=cache_directory,
+                                             backend=backend)
+            self.grim_books_data['population']['data'], self.grim_books_data['population']['years'], _ \
+                = restrict_to_years_with_data(population_array, population_years)
+            self.profiler.record_arrays(population=self.grim_books_data['population']['data'])
 
         # read death data spreadsheets
-        (self.grim_books_data['deaths']['age_groups'], self.grim_books_data['deaths']['years'],
-         self.grim_books_data['deaths']['genders'], self.grim_books_data['deaths']['data']) \
-            = read_all_grim_sheets(self.grim_sheets_to_read)
-
-        # read in an process the Australian standard 2001 population data
-        self.standard_population_data = read_standard_population()
-        self.bracketed_standard_pop = sum_dict_over_brackets(self.standard_population_data)
-        self.summed_bracketed_pop = sum_last_elements_of_dict(self.bracketed_standard_pop, 85)
+        with self.profiler.stage('death_read'):
+            (self.grim_books_data['deaths']['age_groups'], self.grim_books_data['deaths']['years'],
+             self.grim_books_data['deaths']['genders'], self.grim_books_data['deaths']['data']) \
+                = read_all_grim_sheets(self.grim_sheets_to_read, cache_directory=cache_directory, workers=workers,
+                                       backend=backend, allocate=functools.partial(self.allocate_array, 'deaths'))
+            self.profiler.record_arrays(deaths=self.grim_books_data['deaths']['data'])
 
         # set any age limits that we are interested to cut at, including the last one (other than Missing, hence -2)
         # note that this indexing is inclusive, although some code below may not agree with that yet
         self.upper_age_limits_to_cut_at = ['70 to 74', '75 to 79']
         self.upper_age_limits_to_cut_at.append(self.grim_books_data['deaths']['age_groups'][-2])
 
+        # look up the standard populations (by default the Australian standard 2001) and find their weights once
+        with self.profiler.stage('standard_population'):
+            self.standards = standards if standards else ['aus2001']
+            self.standard_populations = {standard: find_standard_population(standard, cache_directory)
+                                         for standard in self.standards}
+            n_age_groups = len(self.grim_books_data['deaths']['age_groups']) - 1
+            self.standard_age_weights = {
+                standard: {upper_age_limit: find_standard_age_weights(
+                    self.standard_populations[standard], n_age_groups, int(upper_age_limit[:2]))
+                    for upper_age_limit in self.upper_age_limits_to_cut_at} for standard in self.standards}
+
         # restrict input array and find relevant years
-        self.grim_books_data['deaths']['adjusted_data'] \
-            = distribute_missing_across_agegroups(self.grim_books_data['deaths']['data'],
-                                                  self.grim_books_data['deaths']['age_groups'])
-        self.grim_books_data['population']['adjusted_data'] \
-            = restrict_population_to_relevant_years(self.grim_books_data['population']['data'],
-                                                    self.grim_books_data['deaths']['years'],
-                                                    self.grim_books_data['population']['years'])
+        with self.profiler.stage('missing_adjustment'):
+            deaths_shape = self.grim_books_data['deaths']['data'].shape
+            self.grim_books_data['deaths']['adjusted_data'] = distribute_missing_across_agegroups(
+                self.grim_books_data['deaths']['data'], self.grim_books_data['deaths']['age_groups'],
+                out=self.allocate_array('adjusted_deaths', (deaths_shape[0] - 1,) + deaths_shape[1:]))
+            self.grim_books_data['population']['adjusted_data'] \
+                = restrict_population_to_relevant_years(self.grim_books_data['population']['data'],
+                                                        self.grim_books_data['deaths']['years'],
+                                                        self.grim_books_data['population']['years'])
+            self.profiler.record_arrays(adjusted_deaths=self.grim_books_data['deaths']['adjusted_data'],
+                                        adjusted_population=self.grim_books_data['population']['adjusted_data'])
 
         # find death rates from tidied arrays
-        self.rates['unadjusted'] \
-            = find_rates_from_deaths_and_populations(self.grim_books_data['deaths']['adjusted_data'],
-                                                     self.grim_books_data['population']['adjusted_data'],
-                                                     len(self.grim_sheets_to_read))
+        with self.profiler.stage('rate_computation'):
+            self.rates['unadjusted'] = find_rates_from_deaths_and_populations(
+                self.grim_books_data['deaths']['adjusted_data'], self.grim_books_data['population']['adjusted_data'],
+                len(self.grim_sheets_to_read),
+                out=self.allocate_array('rates', self.grim_books_data['deaths']['adjusted_data'].shape))
+            self.profiler.record_arrays(rates=self.rates['unadjusted'])
 
         # find average rates summed across age groups, for each calendar year
         self.find_average_rates_by_year()
 
-    def find_average_rates_by_year(self):
+        # label lookups for accessing elements of the arrays
+        self.index = DimensionIndex(self.grim_books_data, self.grim_sheets_to_read)
+
+    def allocate_array(self, name, shape):
+        """
+        Create a zeroed array for one of the large data arrays, of the data type requested. If there is a storage
+        directory, the array is memory-mapped to a new file there, which replaces any earlier file of the same name only
+        once it has been created, so that mappings of the earlier file are left as they were.
+
+        Args:
+            name: Name of the array, used as the stem of its file
+            shape: Tuple for the shape of the array
+        Returns:
+            The zeroed array
+        """
+
+        if self.storage_directory is None:
+            return numpy.zeros(shape, dtype=self.dtype)
+        filename = os.path.join(self.storage_directory, name + '.npy')
+        array = numpy.lib.format.open_memmap(filename + '.tmp', mode='w+', dtype=self.dtype, shape=shape)
+        os.rename(filename + '.tmp', filename)
+        return array
+
+    def store_array(self, name, array):
+        """
+        Copy an array into a new array made by allocate_array, for when one of the large data arrays is replaced.
+        """
+
+        stored_array = self.allocate_array(name, array.shape)
+        stored_array[...] = array
+        return stored_array
+
+    def find_stored_arrays(self):
+        """
+        The large data arrays, as tuples of the structure holding them, their key in it and the name of their file.
+        """
+
+        return [(self.grim_books_data['deaths'], 'data', 'deaths'),
+                (self.grim_books_data['deaths'], 'adjusted_data', 'adjusted_deaths'),
+                (self.rates, 'unadjusted', 'rates')]
+
+    def open_storage_read_only(self):
+        """
+        Flush the memory-mapped data arrays to their files and map them again read-only, so that processes given this
+        data object (including by pickling) share the one mapping rather than each holding a copy. The arrays can no
+        longer be changed, so this should be done after any causes have been loaded or updates made.
+        """
+
+        if self.storage_directory is None:
+            raise ValueError('Data object has no storage directory to map its arrays from')
+        for data_structure, key, name in self.find_stored_arrays():
+            data_structure[key].flush()
+            data_structure[key] = numpy.load(os.path.join(self.storage_directory, name + '.npy'), mmap_mode='r')
+        self.storage_read_only = True
+
+    def __getstate__(self):
+        """
+        Leave the read-only memory-mapped arrays out of the pickled data object, to be mapped again when unpickled.
+        """
+
+        state = self.__dict__.copy()
+        if self.storage_read_only:
+            state['grim_books_data'] = {'population': self.grim_books_data['population'],
+                                        'deaths': dict(self.grim_books_data['deaths'], data=None, adjusted_data=None)}
+            state['rates'] = dict(self.rates, unadjusted=None)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restore a pickled data object, mapping its read-only arrays from their files again.
+        """
+
+        self.__dict__.update(state)
+        if self.storage_read_only:
+            for data_structure, key, name in self.find_stored_arrays():
+                data_structure[key] = numpy.load(os.path.join(self.storage_directory, name + '.npy'), mmap_mode='r')
+
+    def dump_profile(self, filename):
+        """
+        Write the report of the time taken and arrays created by each stage to a JSON file, if profiling.
+
+        Args:
+            filename: The name of the JSON file
+        """
+
+        self.profiler.dump(filename)
+
+    def load_causes(self, causes):
+        """
+        Read those of several causes that haven't been read yet, in lazy mode only, so that otherwise any cause that
+        hasn't been read raises KeyError when its position is found (as for any other label that isn't in the data).
+
+        Args:
+            causes: List of strings for the causes of death
+        """
+
+        if self.lazy:
+            for cause in causes:
+                self.load_cause(cause)
+
+    def load_cause(self, cause):
+        """
+        Read a cause of death that hasn't been read yet and add it to the end of the cause dimension of the deaths and
+        rates arrays, updating the average rates and the label lookups to include it.
+
+        Args:
+            cause: String for the cause of death, as used in the name of its workbook
+        Returns:
+            The index of the cause along the fourth dimension of the data arrays, with the version of the data object
+                increased if it is added
+        """
+
+        if cause in self.grim_sheets_to_read:
+            return self.grim_sheets_to_read.index(cause)
+        if self.storage_read_only:
+            raise ValueError('Cause not read and data object is read-only: ' + str(cause))
+
+        with self.profiler.stage('load_cause ' + cause):
+
+            # process as for the causes read at the start and add to the end of the arrays
+            sheet_array, adjusted_array, rates_array = self.read_cause(cause)
+            self.workbook_signatures[cause] = find_workbook_signature(find_grim_filename(cause))
+            for (data_structure, key, name), new_array \
+                    in zip(self.find_stored_arrays(), [sheet_array, adjusted_array, rates_array]):
+                data_structure[key] \
+                    = self.store_array(name, numpy.concatenate((data_structure[key], new_array), axis=3))
+            self.grim_sheets_to_read.append(cause)
+            self.profiler.record_arrays(deaths=sheet_array, adjusted_deaths=adjusted_array, rates=rates_array)
+
+        # update structures that depend on the causes read, with life tables needing to be found again
+        self.find_average_rates_by_year()
+        self.index = DimensionIndex(self.grim_books_data, self.grim_sheets_to_read)
+        self.life_tables, self.cumulative_deaths_by_cause, self.single_year_rates = None, None, None
+        self.version += 1
+        return len(self.grim_sheets_to_read) - 1
+
+    def read_cause(self, cause):
+        """
+        Read a cause of death and process it as for those in the data arrays, without adding it to them.
+
+        Args:
+            cause: String for the cause of death, as used in the name of its workbook
+        Returns:
+            Arrays of the deaths, the deaths with those of missing age distributed and the rates, each by age group,
+                year, gender and a cause dimension of length one, for the years of the data object
+        """
+
+        # read and restrict to the same years as the causes already read
+        if not os.path.isfile(find_grim_filename(cause)):
+            raise KeyError('No workbook found for cause: ' + str(cause))
+        _, sheet_years, _, sheet_array = read_grim_sheet_with_cache(
+            find_grim_filename(cause), 'Deaths', cache_directory=self.cache_directory, backend=self.backend)
+        sheet_array = numpy.expand_dims(
+            sheet_array[:, numpy.in1d(sheet_years, self.grim_books_data['deaths']['years']), :], axis=3)
+        adjusted_array \
+            = distribute_missing_across_agegroups(sheet_array, self.grim_books_data['deaths']['age_groups'])
+        return sheet_array, adjusted_array, find_rates_from_deaths_and_populations(
+            adjusted_array, self.grim_books_data['population']['adjusted_data'], 1)
+
+    def update(self):
+        """
+        Bring the data up to date with any workbooks that have changed since they were read, such as for a new GRIM
+        release, without processing everything again. Every sheet needed is read and checked before anything is
+        changed, so that if one can't be read the data object is left as it was and the update can be tried again. New
+        years are appended to the end of the year dimension and the derived arrays (adjusted deaths, rates, average
+        rates, single year rates and both kinds of life table, if they have been found) are only found again for the
+        new years and for any earlier years whose deaths or populations have been revised. New years are taken from
+        the all-causes workbook, so a changed workbook of another cause with data for years that it doesn't have
+        raises ValueError.
+
+        Returns:
+            Dictionary of the causes whose workbooks had changed, the years added and all the years found again
+        """
+
+        with self.profiler.stage('update'):
+            signatures = {cause: find_workbook_signature(find_grim_filename(cause))
+                          for cause in self.grim_sheets_to_read}
+            changed_causes = [cause for cause in self.grim_sheets_to_read
+                              if signatures[cause] != self.workbook_signatures[cause]]
+            if not changed_causes:
+                return {'changed_causes': [], 'new_years': [], 'updated_years': []}
+            if self.storage_read_only:
+                raise ValueError('Workbooks have changed but data object is read-only: ' + ', '.join(changed_causes))
+            index = read_grim_cache_index(self.cache_directory) if self.cache_directory else None
+
+            # new years are those with data in the all-causes sheet that aren't already read
+            old_years, deaths = self.grim_books_data['deaths']['years'], self.grim_books_data['deaths']['data']
+            population_data, population_years = \
+                self.grim_books_data['population']['data'], self.grim_books_data['population']['years']
+            new_years = []
+            if 'all-causes-combined' in changed_causes:
+                _, sheet_years, _, sheet_array = read_grim_sheet_with_cache(
+                    find_grim_filename('all-causes-combined'), 'Deaths', cache_directory=self.cache_directory,
+                    index=index, backend=self.backend)
+                new_years = [year for year in restrict_to_years_with_data(sheet_array, sheet_years)[1]
+                             if year not in self.index.positions['years']]
+                if new_years and min(new_years) < old_years[-1]:
+                    raise ValueError('Years can only be added after those already read, so read all the data again')
+
+                # population sheet is in the all-causes workbook
+                _, sheet_years, _, population_array = read_grim_sheet_with_cache(
+                    find_grim_filename('all-causes-combined'), 'Populations', title_row_index=14, gender_row_index=12,
+                    cache_directory=self.cache_directory, index=index, backend=self.backend)
+                population_data, population_years, _ = restrict_to_years_with_data(population_array, sheet_years)
+            years = old_years + new_years
+            population = restrict_population_to_relevant_years(population_data, years, population_years)
+
+            # read the deaths of every cause that has changed, or all of them if there are new years to fill
+            sheets = {}
+            for cause in changed_causes if not new_years else self.grim_sheets_to_read:
+                _, sheet_years, _, sheet_array = read_grim_sheet_with_cache(
+                    find_grim_filename(cause), 'Deaths', cache_directory=self.cache_directory, index=index,
+                    backend=self.backend)
+                if (sheet_array.shape[0], sheet_array.shape[2]) != (deaths.shape[0], deaths.shape[2]):
+                    raise ValueError('Age groups or genders of the workbook have changed: ' + cause)
+                unknown_years = [year for year, has_deaths in zip(sheet_years, numpy.any(sheet_array, axis=(0, 2)))
+                                 if has_deaths and year not in years]
+                if unknown_years:
+                    raise ValueError('Workbook of %s has years not in the all-causes workbook: %s'
+                                     % (cause, ', '.join(str(year) for year in unknown_years)))
+                sheets[cause] = select_grim_sheet_years(sheet_array, sheet_years, years)
+            if self.cache_directory:
+                write_grim_cache_index(self.cache_directory, index)
+
+            # revised populations affect every cause, and revised deaths only their own cause
+            n_old_years = len(old_years)
+            updated = numpy.zeros(len(years), dtype=bool)
+            updated[n_old_years:] = True
+            updated[:n_old_years] |= numpy.any(
+                population[:, :n_old_years] != self.grim_books_data['population']['adjusted_data'], axis=(0, 2))
+            for cause, sheet_array in sheets.items():
+                updated[:n_old_years] |= numpy.any(
+                    sheet_array[:, :n_old_years] != deaths[:, :n_old_years, :, self.index.positions['causes'][cause]],
+                    axis=(0, 2))
+            year_indices = numpy.flatnonzero(updated)
+
+            # with everything read, extend the arrays by the new years and replace the data and workbook signatures
+            if new_years:
+                for data_structure, key, name in self.find_stored_arrays():
+                    data_structure[key] = self.store_array(name, append_zero_years(data_structure[key], len(new_years)))
+                if self.life_tables is not None:
+                    self.life_tables = append_zero_years(self.life_tables, len(new_years))
+                    self.cumulative_deaths_by_cause = append_zero_years(self.cumulative_deaths_by_cause, len(new_years))
+                if self.single_year_rates is not None:
+                    self.single_year_rates = append_zero_years(self.single_year_rates, len(new_years))
+                if self.period_life_tables is not None:
+                    self.period_life_tables['data'] = append_zero_years(self.period_life_tables['data'],
+                                                                        len(new_years), axis=2)
+                    self.period_life_tables['years'] = list(years)
+                for averages in [self.average_rates_by_year['adjusted_data']] \
+                        + self.average_rates_by_year['standardised_by_standard'].values():
+                    for upper_age_limit in averages:
+                        averages[upper_age_limit] = append_zero_years(averages[upper_age_limit], len(new_years), axis=0)
+                self.average_rates_by_year['standardised_adjusted_data'] \
+                    = self.average_rates_by_year['standardised_by_standard'][self.standards[0]]
+            deaths = self.grim_books_data['deaths']['data']
+            for cause, sheet_array in sheets.items():
+                deaths[:, :, :, self.index.positions['causes'][cause]] = sheet_array
+            self.grim_books_data['deaths']['years'] = years
+            self.grim_books_data['population']['data'], self.grim_books_data['population']['years'], \
+                self.grim_books_data['population']['adjusted_data'] = population_data, population_years, population
+            self.workbook_signatures.update({cause: signatures[cause] for cause in changed_causes})
+            self.version += 1
+
+            # find everything derived from the deaths again for the updated years only
+            self.grim_books_data['deaths']['adjusted_data'][:, year_indices] = distribute_missing_across_agegroups(
+                deaths[:, year_indices], self.grim_books_data['deaths']['age_groups'])
+            self.rates['unadjusted'][:, year_indices] = find_rates_from_deaths_and_populations(
+                self.grim_books_data['deaths']['adjusted_data'][:, year_indices],
+                population[:, year_indices], len(self.grim_sheets_to_read))
+            self.index = DimensionIndex(self.grim_books_data, self.grim_sheets_to_read)
+        self.find_average_rates_by_year(year_indices)
+        if self.single_year_rates is not None:
+            with self.profiler.stage('single_year_rates'):
+                self.single_year_rates[:, year_indices] = self.find_single_year_rates_for_years(
+                    year_indices, self.single_year_rate_options['karup_king'], graduate=True)
+        if self.period_life_tables is not None:
+            with self.profiler.stage('period_life_tables'):
+                karup_king, all_cause_index = self.period_life_table_options['karup_king'], \
+                    self.grim_sheets_to_read.index('all-causes-combined')
+                self.period_life_tables['data'][:, :, year_indices] = find_period_life_tables(
+                    self.rates['unadjusted'][:, year_indices][:, :, :, all_cause_index],
+                    self.grim_books_data['deaths']['age_groups'], [years[y] for y in year_indices],
+                    self.grim_books_data['deaths']['genders'], karup_king, self.period_life_table_options['radix'],
+                    self.find_single_year_rates_for_years(year_indices)[:, :, :, all_cause_index] if karup_king
+                    else None)['data']
+        if self.life_tables is not None:
+            with self.profiler.stage('life_tables'):
+                self.life_tables[:, year_indices], self.cumulative_deaths_by_cause[:, year_indices] \
+                    = find_survival_and_cumulative_deaths(
+                        self.rates['unadjusted'][:, year_indices], self.grim_books_data['deaths']['age_groups'],
+                        self.integer_ages, self.grim_sheets_to_read.index('all-causes-combined'),
+                        self.life_tables_karup_king,
+                        self.find_single_year_rates_for_years(year_indices, self.life_tables_karup_king))
+        return {'changed_causes': changed_causes, 'new_years': new_years,
+                'updated_years': [years[y] for y in year_indices]}
+
+    def find_single_year_rates_for_years(self, year_indices, karup_king=True, graduate=False):
+        """
+        Rates by single year of age for some of the years, taken from those already found by find_single_year_rates
+        if they were found in the same way, or otherwise graduated for only these years.
+
+        Args:
+            year_indices: Indices of the years
+            karup_king: Whether to use Karup-King interpolation, as in find_single_year_rates
+            graduate: Whether to graduate the rates even if they have already been found, as when they have changed
+        Returns:
+            Array of the rates by single year of age from zero, year (of year_indices), gender and cause
+        """
+
+        if not graduate and self.single_year_rates is not None \
+                and self.single_year_rate_options['karup_king'] == karup_king:
+            return self.single_year_rates[:, year_indices]
+        max_age = self.single_year_rate_options['max_age'] if self.single_year_rates is not None \
+            else max(100, max(self.integer_ages))
+        rates = self.rates['unadjusted'][:, year_indices]
+        return numpy.tensordot(find_single_year_matrix(self.grim_books_data['deaths']['age_groups'],
+                                                       range(max_age + 1), rates.shape[0], karup_king),
+                               rates, axes=(1, 0))
+
+    def find_average_rates_by_year(self, year_indices=None):
+        """
+        Find death rates by year averaged over age groups, but excluding the highest ones, for every gender and cause.
+
+        Args:
+            year_indices: Indices of the years to find again in the existing arrays, or None to find all the years
+        Creates:
+            self.average_rates_by_year: Crude and standardised rates, each an array by year, gender and cause for each
+                upper age limit, with the standardised rates to every standard population under
+                standardised_by_standard, keyed by standard and then upper age limit
+        """
+
+        years = slice(None) if year_indices is None else year_indices
+        with self.profiler.stage('average_rates'):
+            crude, standardised = find_average_rates(
+                self.grim_books_data['deaths']['adjusted_data'][:, years],
+                self.grim_books_data['population']['adjusted_data'][:, years], self.rates['unadjusted'][:, years],
+                self.grim_books_data['deaths']['age_groups'], self.upper_age_limits_to_cut_at,
+                self.find_standard_age_weights_array())
+
+            # only the years requested are replaced when updating
+            if year_indices is not None:
+                for upper_age_limit in self.upper_age_limits_to_cut_at:
+                    self.average_rates_by_year['adjusted_data'][upper_age_limit][year_indices] = crude[upper_age_limit]
+                for s, standard in enumerate(self.standards):
+                    for l, upper_age_limit in enumerate(self.upper_age_limits_to_cut_at):
+                        self.average_rates_by_year['standardised_by_standard'][standard][upper_age_limit][
+                            year_indices] = standardised[s, l]
+                return
+
+            self.average_rates_by_year['adjusted_data'] = crude
+            self.average_rates_by_year['standardised_by_standard'] = {
+                standard: {upper_age_limit: standardised[s, l]
+                           for l, upper_age_limit in enumerate(self.upper_age_limits_to_cut_at)}
+                for s, standard in enumerate(self.standards)}
+            self.average_rates_by_year['standardised_adjusted_data'] \
+                = self.average_rates_by_year['standardised_by_standard'][self.standards[0]]
+            self.profiler.record_arrays(standardised=standardised, **{
+                'adjusted_data ' + upper_age_limit: self.average_rates_by_year['adjusted_data'][upper_age_limit]
+                for upper_age_limit in self.upper_age_limits_to_cut_at})
+
+    def find_standard_age_weights_array(self):
         """
-        Find death rates by year averaged over age groups, but excluding the highest ones.
+        The standard weights as an array by standard, upper age limit and age group.
         """
 
-        g = self.grim_books_data['deaths']['genders'].index('Persons')
-        self.average_rates_by_year['adjusted_data'], self.average_rates_by_year['standardised_adjusted_data'] = {}, {}
-        for upper_age_limit in self.upper_age_limits_to_cut_at:
-            self.average_rates_by_year['adjusted_data'][upper_age_limit], \
-                self.average_rates_by_year['standardised_adjusted_data'][upper_age_limit] = {}, {}
+        return numpy.array([[self.standard_age_weights[standard][upper_age_limit]
+                             for upper_age_limit in self.upper_age_limits_to_cut_at] for standard in self.standards])
 
-            # index for one up from the age group of interest, to make indexing inclusive
-            up = self.grim_books_data['deaths']['age_groups'].index(upper_age_limit) + 1
+    def find_single_year_rates(self, karup_king=True, max_age=100):
+        """
+        Find the death rates by single year of age for every year, gender and cause, graduated from the age groups once
+        and then kept (in the cache as well as here) for the life tables and age-specific outputs to index into.
 
-            # denominator for unweighted calculations
-            denominator = numpy.sum(self.grim_books_data['population']['adjusted_data'][:up, :, g], axis=0)
+        Args:
+            karup_king: Whether to use Karup-King interpolation up to five years past the start of the open age group,
+                with the rate of the open age group held above that, rather than the rate of each age's age group
+            max_age: The highest single year of age, with the rates kept from before returned if they go as high
+        Returns:
+            The array of rates by single year of age from zero, year, gender and cause, which is also kept as
+                self.single_year_rates
+        """
 
-            # restrict standard populations to relevant age groups
-            restricted_standard_pop = {key: self.summed_bracketed_pop[key] for key in self.summed_bracketed_pop
-                                       if key < int(upper_age_limit[:2])}
+        options = {'karup_king': karup_king, 'max_age': max(max_age, max(self.integer_ages))}
+        if self.single_year_rates is not None and self.single_year_rate_options['karup_king'] == karup_king \
+                and self.single_year_rate_options['max_age'] >= options['max_age']:
+            return self.single_year_rates
 
-            # normalise and create list ordered by age group
-            standard_pop_props = {key: restricted_standard_pop[key] / float(sum(restricted_standard_pop.values()))
-                                  for key in restricted_standard_pop}
-            age_weights = [standard_pop_props[key] for key in sorted(standard_pop_props.keys())]
+        with self.profiler.stage('single_year_rates'):
+            rates, ages = self.rates['unadjusted'], range(options['max_age'] + 1)
+            years, genders = self.grim_books_data['deaths']['years'], self.grim_books_data['deaths']['genders']
+            sheet_name = find_single_year_rates_sheet_name(karup_king, options['max_age'], rates.dtype)
+            index = read_grim_cache_index(self.cache_directory) if self.cache_directory else None
+            single_year_rates = numpy.empty((len(ages),) + rates.shape[1:])
 
-            # for each cause of death
+            # causes not in the cache are graduated together and then cached
+            causes_to_find = []
             for c, cause in enumerate(self.grim_sheets_to_read):
+                cached = read_cached_single_year_rates(
+                    find_grim_filename(cause), sheet_name, self.cache_directory, index, years,
+                    (self.workbook_signatures[cause], self.workbook_signatures['all-causes-combined'])) \
+                    if index is not None else None
+                if cached is None:
+                    causes_to_find.append(c)
+                else:
+                    single_year_rates[:, :, :, c] = cached
+            if causes_to_find:
+                single_year_rates[:, :, :, causes_to_find] = numpy.tensordot(
+                    find_single_year_matrix(self.grim_books_data['deaths']['age_groups'], ages, rates.shape[0],
+                                            karup_king), rates[:, :, :, causes_to_find], axes=(1, 0))
+                if index is not None:
+                    if not os.path.isdir(self.cache_directory):
+                        os.makedirs(self.cache_directory)
+                    for c in causes_to_find:
+                        cause = self.grim_sheets_to_read[c]
+                        write_cached_single_year_rates(
+                            find_grim_filename(cause), sheet_name, self.cache_directory, index, years, genders,
+                            (self.workbook_signatures[cause], self.workbook_signatures['all-causes-combined']),
+                            single_year_rates[:, :, :, c])
+                    write_grim_cache_index(self.cache_directory, index)
+            self.single_year_rates, self.single_year_rate_options = single_year_rates, options
+            self.profiler.record_arrays(single_year_rates=single_year_rates)
+        return self.single_year_rates
+
+    def find_period_life_tables(self, karup_king=True, radix=1.):
+        """
+        Find period life tables from all-cause mortality for every year and gender.
 
-                # crude
-                self.average_rates_by_year['adjusted_data'][upper_age_limit][cause] \
-                    = numpy.divide(numpy.sum(self.grim_books_data['deaths']['adjusted_data'][:up, :, g, c], axis=0),
-                                   denominator)
+        Args:
+            karup_king: Whether to graduate the rates to single years of age with Karup-King interpolation
+            radix: The number alive at the start of the first age
+        Creates:
+            self.period_life_tables: Labelled life table functions, as returned by find_period_life_tables
+        """
 
-                # standardised
-                self.average_rates_by_year['standardised_adjusted_data'][upper_age_limit][cause] = []
-                for y in range(len(self.grim_books_data['deaths']['years'])):
-                    self.average_rates_by_year['standardised_adjusted_data'][upper_age_limit][cause].append(
-                        sum([r * w for r, w in zip(self.rates['unadjusted'][:up, y, g, c], age_weights[:up])]))
+        with self.profiler.stage('period_life_tables'):
+            self.period_life_table_options = {'karup_king': karup_king, 'radix': radix}
+            all_cause_index = self.grim_sheets_to_read.index('all-causes-combined')
+            self.period_life_tables = find_period_life_tables(
+                self.rates['unadjusted'][:, :, :, all_cause_index], self.grim_books_data['deaths']['age_groups'],
+                self.grim_books_data['deaths']['years'], self.grim_books_data['deaths']['genders'], karup_king, radix,
+                self.find_single_year_rates()[:, :, :, all_cause_index] if karup_king else None)
+            self.profiler.record_arrays(period_life_tables=self.period_life_tables['data'])
 
     def find_life_tables(self, karup_king=True):
         """
@@ -566,53 +2225,17 @@ class Spring:
         Args:
             karup_king: Whether to use Karup-King interpolators, rather than rectangular distributions
         Creates:
-            self.lifetables: Survivors by age
-            self.cumulative_deaths_by_cause: Cumulative deaths by age
-        """
-
-        # construct life tables and cumulative death structures for each calendar year
-        age_group_lower, age_group_upper \
-            = find_agegroup_values_from_strings(self.grim_books_data['deaths']['age_groups'])
-        for year in range(self.grim_books_data['deaths']['years'][0], self.grim_books_data['deaths']['years'][-1] + 1):
-
-            # the life table list and the running value to populate it
-            survival_total = 1.
-            self.life_tables[year] = [1.]
-
-            # the cumulative death structures and the value to populate it, by cause of death
-            self.cumulative_deaths_by_cause[year] = {}
-            for cause in self.grim_sheets_to_read:
-                self.cumulative_deaths_by_cause[year][cause] = [0.]
-                cumulative_deaths = 0.
-
-                # looping over each age group
-                for age in self.integer_ages:
-                    age_group_index = next(x[0] for x in enumerate(age_group_upper) if x[1] >= age)
-                    within_group_age = age - age_group_lower[age_group_index]
-
-                    # find rate, either with Karup-King interpolation or without
-                    if karup_king:
-                        rate_for_age \
-                            = karup_king_interpolation(
-                                age_group_index, within_group_age, 17,
-                                self.rates['unadjusted'][:,
-                                self.grim_books_data['deaths']['years'].index(year),
-                                self.grim_books_data['deaths']['genders'].index('Persons'),
-                                self.grim_sheets_to_read.index(cause)])
-                    else:
-                        rate_for_age = self.rates['unadjusted'][
-                            age_group_index,
-                            self.grim_books_data['deaths']['years'].index(year),
-                            self.grim_books_data['deaths']['genders'].index('Persons'),
-                            self.grim_sheets_to_read.index(cause)]
-
-                    # decrement survival and increment cumulative deaths
-                    if cause == 'all-causes-combined':
-                        survival_total *= 1. - rate_for_age
-                        self.life_tables[year].append(survival_total)
-                    else:
-                        cumulative_deaths += self.life_tables[year][age] * rate_for_age
-                        self.cumulative_deaths_by_cause[year][cause].append(cumulative_deaths)
+            self.life_tables: Survivors by age, year and gender
+            self.cumulative_deaths_by_cause: Cumulative deaths by age, year, gender and cause
+        """
+
+        with self.profiler.stage('life_tables'):
+            self.life_tables_karup_king = karup_king
+            self.life_tables, self.cumulative_deaths_by_cause = find_survival_and_cumulative_deaths(
+                self.rates['unadjusted'], self.grim_books_data['deaths']['age_groups'], self.integer_ages,
+                all_cause_index=self.grim_sheets_to_read.index('all-causes-combined'), karup_king=karup_king,
+                single_year_rates=self.find_single_year_rates(karup_king))
+            self.profiler.record_arrays(survival=self.life_tables, cumulative_deaths=self.cumulative_deaths_by_cause)
 
 
 class Outputs:
@@ -638,31 +2261,98 @@ class Outputs:
             output_type: Indicator of the data structure to access
         """
 
+        result = self.get_rates([age_group], [year], [gender], [sheet], output_type)
+        return result[(0,) * result.ndim]
+
+    def get_rates(self, age_groups, years, genders, causes, output_type):
+        """
+        Access all the combinations of several age groups, years, genders and causes in a single query.
+
+        Args:
+            age_groups: List of strings representing the age groups
+            years: List of integers representing the years
+            genders: List of strings representing the genders
+            causes: List of strings for the spreadsheet names, ignored for population
+            output_type: Indicator of the data structure to access, one of population, unadjusted_rates or raw_deaths
+        Returns:
+            Array by age group, year, gender and (other than for population, which has no cause dimension) cause
+        """
+
+        if output_type != 'population':
+            self.data_object.load_causes(causes)
+        index = self.data_object.index
+        age_indices, gender_indices \
+            = index.find_positions('age_groups', age_groups), index.find_positions('genders', genders)
         if output_type == 'population':
-            data_structure_to_access = self.data_object.grim_books_data['population']['data']
+            return self.data_object.grim_books_data['population']['data'][
+                numpy.ix_(age_indices, index.find_positions('population_years', years), gender_indices)]
         elif output_type == 'unadjusted_rates':
             data_structure_to_access = self.data_object.rates['unadjusted']
         elif output_type == 'raw_deaths':
             data_structure_to_access = self.data_object.grim_books_data['deaths']['data']
-
-        if output_type == 'population':
-            sheet_index = None
-            year_index = self.data_object.grim_books_data['population']['years'].index(year)
         else:
-            sheet_index = self.data_object.grim_sheets_to_read.index(sheet)
-            year_index = self.data_object.grim_books_data['deaths']['years'].index(year)
+            raise ValueError('Output type not recognised: ' + str(output_type))
+        return data_structure_to_access[numpy.ix_(age_indices, index.find_positions('years', years), gender_indices,
+                                                  index.find_positions('causes', causes))]
+
+    def get_weighted_rates(self, cohorts, age_groups, genders, years=None, causes=None, z_score=1.959963984540054):
+        """
+        Death rates weighted by the composition of one or more external cohorts, such as the participants of trials,
+        for every combination of year and cause in a single calculation.
+
+        Args:
+            cohorts: Array of counts by age group and gender for one cohort, or by cohort, age group and gender for
+                several, or a dictionary for one cohort as described in convert_cohort_to_array
+            age_groups: List of strings for the age groups of the cohorts' counts
+            genders: List of strings for the genders of the cohorts' counts
+            years: List of integers for the years, or None for all the years
+            causes: List of strings for the causes, or None for all those that have been read
+            z_score: Standard normal quantile for the width of the intervals, with the default giving 95% intervals
+        Returns:
+            Dictionary of arrays by cohort, year and cause, as described in find_weighted_rates
+        """
+
+        if isinstance(cohorts, dict):
+            cohorts = convert_cohort_to_array(cohorts, age_groups, genders)
+        cohorts = numpy.asarray(cohorts, dtype=float)
+        if cohorts.ndim == 2:
+            cohorts = numpy.expand_dims(cohorts, axis=0)
+        if years is None:
+            years = self.data_object.grim_books_data['deaths']['years']
+        if causes is None:
+            causes = self.data_object.grim_sheets_to_read
+        return find_weighted_rates(cohorts, self.get_rates(age_groups, years, genders, causes, 'raw_deaths'),
+                                   self.get_rates(age_groups, years, genders, None, 'population'), z_score)
+
+    def get_single_year_rates(self, ages, years, genders, causes, karup_king=True):
+        """
+        Death rates by single year of age, indexed from the rates graduated once for every cause rather than
+        interpolated for each request.
+
+        Args:
+            ages: List of integers for the single years of age, up to 100 or higher if the rates have been found higher
+            years: List of integers representing the years
+            genders: List of strings representing the genders
+            causes: List of strings for the spreadsheet names
+            karup_king: Whether the rates are graduated with Karup-King interpolation, as in find_single_year_rates
+        Returns:
+            Array by single year of age, year, gender and cause
+        """
 
-        result = data_structure_to_access[
-            self.data_object.grim_books_data['deaths']['age_groups'].index(age_group)][
-            year_index][
-            self.data_object.grim_books_data['deaths']['genders'].index(gender)][
-            sheet_index]
-        return result[0] if type(result) == numpy.ndarray else result
+        if min(ages) < 0:
+            raise ValueError('Ages cannot be negative')
+        self.data_object.load_causes(causes)
+        single_year_rates = self.data_object.find_single_year_rates(karup_king, max(max(ages), 100))
+        index = self.data_object.index
+        return single_year_rates[numpy.ix_(numpy.asarray(ages, dtype=int), index.find_positions('years', years),
+                                           index.find_positions('genders', genders),
+                                           index.find_positions('causes', causes))]
 
     def plot_rates_by_age_group_over_time(self, cause='all-causes-combined', x_limits=None, y_limits=(0., 3e-4),
-                                          log_scale=False, split_by_gender=True):
+                                          log_scale=False, split_by_gender=True, genders=None, figure=None,
+                                          filename_prefix='mortality_figure_', dpi=None):
         """
-        Create graph of total death rates by age groups over time.
+        Create graph of total death rates by age groups over time, one figure for each gender.
 
         Args:
             cause: String for cause to be plotted
@@ -670,71 +2360,103 @@ class Outputs:
             y_limits: Tuple containing the two elements for the lower and upper boundary of the y-axis
             log_scale: Whether to plot with a vertical log scale or just linear (if False)
             split_by_gender: Whether to produce three graphs for males, females and both genders
+            genders: List of the genders to produce graphs for, overriding split_by_gender
+            figure: Figure to clear and reuse for each graph, rather than creating a new one
+            filename_prefix: Start of the filenames, which end with the gender
+            dpi: Resolution to save at, or None for the matplotlib default
+        Returns:
+            filenames: List of the filenames saved, with their extensions
         """
 
-        figure = plt.figure()
         if not x_limits:
             x_limits = (float(min(self.data_object.grim_books_data['deaths']['years'])),
                         float(max(self.data_object.grim_books_data['deaths']['years'])))
-        genders_to_plot = self.data_object.grim_books_data['deaths']['genders'] if split_by_gender else ['Persons']
+        if not genders:
+            genders = self.data_object.grim_books_data['deaths']['genders'] if split_by_gender else ['Persons']
 
-        for gender in genders_to_plot:
+        filenames = []
+        for gender in genders:
+            figure = prepare_figure(figure)
             ax = figure.add_axes([0.1, 0.1, 0.6, 0.75])
-            gender_string = convert_grim_string(gender) if split_by_gender else ''
             self.plot_rates_by_year(ax, cause, gender, log_scale)
             handles, labels = ax.get_legend_handles_labels()
             ax.legend(handles, labels, bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0., frameon=False,
                       prop={'size': 7})
-            # ax.set_title(gender_string)
             ax.set_ylim(y_limits)
             ax.set_xlim(x_limits)
             ax.tick_params(labelsize=10)
-            ax.set_title('Death rates due to liver disease by age group')
-        figure.savefig('mortality_figure_' + gender.lower())
+            ax.set_title('Death rates due to ' + convert_grim_string(cause) + ' by age group, '
+                         + convert_grim_string(gender).lower())
+            filenames.append(save_figure(figure, filename_prefix + gender.lower(), dpi))
+        return filenames
 
-    def plot_deaths_by_cause(self):
+    def plot_deaths_by_cause(self, analyses=('', 'standardised_'), upper_age_limits=None, figure=None,
+                             filename_prefix='mortality_figure_cause', dpi=None):
         """
         Deaths by cause with limitation by age group and with age groups unlimited.
+
+        Args:
+            analyses: The crude ('') and/or standardised ('standardised_') rates to plot
+            upper_age_limits: List of the upper age limits to plot, or None for all of them
+            figure: Figure to clear and reuse for each graph, rather than creating a new one
+            filename_prefix: Start of the filenames, which end with the analysis and upper age limit
+            dpi: Resolution to save at, or None for the matplotlib default
+        Returns:
+            filenames: List of the filenames saved, with their extensions
         """
 
-        for analysis in ['', 'standardised_']:
-            for upper_age_limit in self.data_object.upper_age_limits_to_cut_at:
+        filenames = []
+        for analysis in analyses:
+            for upper_age_limit in upper_age_limits if upper_age_limits else \
+                    self.data_object.upper_age_limits_to_cut_at:
                 upper_age_limit_string = '' \
                     if upper_age_limit == self.data_object.grim_books_data['deaths']['age_groups'][-2] \
                     else ', under ' + upper_age_limit[-2:] + 's'
-                figure = plt.figure()
+                figure = prepare_figure(figure)
                 ax = figure.add_axes([0.1, 0.1, 0.6, 0.75])
-                for cause in self.data_object.grim_sheets_to_read:
+                g = self.data_object.grim_books_data['deaths']['genders'].index('Persons')
+                for c, cause in enumerate(self.data_object.grim_sheets_to_read):
                     ax.plot(self.data_object.grim_books_data['deaths']['years'],
-                            [1e5 * i for i in self.data_object.average_rates_by_year[analysis + 'adjusted_data'][upper_age_limit][cause]],
+                            1e5 * self.data_object.average_rates_by_year[analysis + 'adjusted_data'][upper_age_limit][
+                                :, g, c],
                             label=convert_grim_string(cause))
                 handles, labels = ax.get_legend_handles_labels()
                 # ax.legend(handles, labels, bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0., frameon=False,
                 #           prop={'size': 7})
-                ax.set_title('Deaths due to liver disease in Australia (source: AIHW)')
+                ax.set_title('Deaths by cause in Australia (source: AIHW)')
                 ax.set_xlim(left=1980., right=2016.)
                 ax.set_ylim(bottom=0., top=10)
                 ax.set_xlabel('Year', fontsize=10)
                 ax.set_ylabel('Deaths per 100,000 per year', fontsize=10)
                 ax.tick_params(labelsize=8)
-                figure.savefig('mortality_figure_cause' + '_' + analysis + upper_age_limit_string + '_')
+                filenames.append(
+                    save_figure(figure, filename_prefix + '_' + analysis + upper_age_limit_string + '_', dpi))
+        return filenames
 
-    def plot_journal_figure_1(self):
+    def plot_journal_figure_1(self, figure=None, filename='journal_figure', dpi=1000):
         """
         Create figure for article to be submitted to journal.
+
+        Args:
+            figure: Figure to clear and reuse, rather than creating a new one
+            filename: Name of the file to save to
+            dpi: Resolution to save at
+        Returns:
+            List of the filename saved, with its extension
         """
 
         # preliminaries for style
-        figure = plt.figure()
+        figure = prepare_figure(figure)
         plt.style.use('ggplot')
-        plt.tight_layout()
+        figure.tight_layout()
 
         ax1 = figure.add_subplot(2, 2, 1)
         ax2 = figure.add_subplot(2, 2, 3)
         colours = [list(plt.rcParams['axes.prop_cycle'])[i] for i in [2, 0, 1]]
+        g = self.data_object.grim_books_data['deaths']['genders'].index('Persons')
         for c, cause in enumerate(self.data_object.grim_sheets_to_read):
             years = self.data_object.grim_books_data['deaths']['years']
-            data = self.data_object.average_rates_by_year['standardised_adjusted_data']['85+'][cause]
+            data = self.data_object.average_rates_by_year['standardised_adjusted_data']['85+'][:, g, c]
             label = convert_grim_string(cause, capitalise_first_letter=True)
             ax1.plot(years, data, label=label, color=colours[c]['color'])
             ax2.semilogy(years, data, label=label, color=colours[c]['color'])
@@ -768,7 +2490,7 @@ class Outputs:
                 ax.legend(fontsize=4.8, ncol=1, bbox_to_anchor=(1.005, 1.))
 
         # save
-        figure.savefig('journal_figure', dpi=1000)
+        return [save_figure(figure, filename, dpi)]
 
     def plot_rates_by_year(self, ax, cause, gender, log_scale):
         """
@@ -787,39 +2509,50 @@ class Outputs:
         # initiate colours and x-values
         colours = [plt.cm.Reds(x) for x in numpy.linspace(0., 1., n_age_groups)]
         year_values = self.data_object.grim_books_data['deaths']['years']
+        self.data_object.load_causes([cause])
+        c = self.data_object.index.find_positions('causes', [cause])[0]
 
         # loop over age_groups and plot
         for i in range(5, n_age_groups):
             rates = self.data_object.rates['unadjusted'][
-                    i, :, self.data_object.grim_books_data['deaths']['genders'].index(gender),
-                    self.data_object.grim_sheets_to_read.index(cause)]
+                    i, :, self.data_object.grim_books_data['deaths']['genders'].index(gender), c]
             label = self.data_object.grim_books_data['deaths']['age_groups'][i]
             ax.semilogy(year_values, rates, label=label, color=colours[i]) if log_scale \
                 else ax.plot(year_values, rates, label=label, color=colours[i])
 
-    def plot_cumulative_survival(self):
+    def plot_cumulative_survival(self, figure=None, filename='lifetable', dpi=1000):
         """
         Plot cumulative survival graphs by year and age.
+
+        Args:
+            figure: Figure to clear and reuse, rather than creating a new one
+            filename: Name of the file to save to
+            dpi: Resolution to save at
+        Returns:
+            List of the filename saved, with its extension
         """
 
-        figure = plt.figure()
+        if self.data_object.life_tables is None:
+            self.data_object.find_life_tables()
+        figure = prepare_figure(figure)
         n_plots, rows, columns, base_font_size, year_spacing, last_year = 3, 2, 2, 6, 25, 2014
         plt.style.use('ggplot')
-        plt.tight_layout()
+        figure.tight_layout()
         colours = [list(plt.rcParams['axes.prop_cycle'])[i] for i in [0, 2, 0, 1, 3]]
 
         for n_plot in range(n_plots):
             year = last_year + n_plot * year_spacing - (n_plots - 1) * year_spacing
             ax = figure.add_subplot(rows, columns, n_plot + 1)
-            stacked_data = {'base': numpy.zeros(len(self.data_object.life_tables[year])),
-                            'survival': self.data_object.life_tables[year],
-                            'other': numpy.ones(len(self.data_object.life_tables[year]))}
+            y = self.data_object.grim_books_data['deaths']['years'].index(year)
+            g = self.data_object.grim_books_data['deaths']['genders'].index('Persons')
+            survival = self.data_object.life_tables[:, y, g]
+            stacked_data = {'base': numpy.zeros(len(survival)), 'survival': survival,
+                            'other': numpy.ones(len(survival))}
             ordered_list_of_stacks = ['base', 'survival']
-            new_data = self.data_object.life_tables[year]
-            for cause in self.data_object.cumulative_deaths_by_cause[year]:
+            new_data = survival
+            for c, cause in enumerate(self.data_object.grim_sheets_to_read):
                 if cause != 'all-causes-combined':
-                    new_data \
-                        = [i + j for i, j in zip(new_data, self.data_object.cumulative_deaths_by_cause[year][cause])]
+                    new_data = new_data + self.data_object.cumulative_deaths_by_cause[:, y, g, c]
                     stacked_data[cause] = new_data
                     ordered_list_of_stacks.append(cause)
             ordered_list_of_stacks.append('other')
@@ -839,6 +2572,100 @@ class Outputs:
             ax.set_xlim(left=50., right=89.)
             ax.set_ylim(bottom=0., top=1.)
             ax.set_title(year, fontsize=10)
-        plt.tight_layout()
-        figure.savefig('lifetable', dpi=1000)
+        figure.tight_layout()
+        return [save_figure(figure, filename, dpi)]
+
+
+''' batch plotting '''
+
+
+# the outputs object and reusable figure of a process rendering plot jobs
+plot_worker_state = {}
+
+
+def find_cause_plot_jobs(causes, genders=('Persons', 'Males', 'Females'), dpi=None,
+                         filename_prefix='mortality_figure_'):
+    """
+    Plot jobs for the rates by age group over time of each cause and gender, with a separate file for each.
+
+    Args:
+        causes: List of the causes to plot
+        genders: The genders to plot for each cause
+        dpi: Resolution to save at, or None for the matplotlib default
+        filename_prefix: Start of the filenames, which end with the cause and gender
+    Returns:
+        List of plot job dictionaries to be passed to render_plot_jobs
+    """
+
+    return [{'plot': 'rates_by_age_group_over_time', 'cause': cause, 'genders': [gender],
+             'filename_prefix': filename_prefix + cause + '_', 'dpi': dpi}
+            for cause in causes for gender in genders]
+
+
+def start_plot_worker(data_object):
+    """
+    Set up a process to render plot jobs, with a single figure to be cleared and reused for every job. The figure is
+    drawn with the Agg canvas so no display is needed, and isn't managed by pyplot, so that the backend and figures of
+    the process are left as they were.
+
+    Args:
+        data_object: The data object to plot from
+    """
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    plot_worker_state.update(outputs=Outputs(data_object), figure=figure)
+
+
+def render_plot_job(job):
+    """
+    Render one plot job in a process set up by start_plot_worker, with any style changes made by the plot undone
+    afterwards so that the jobs look the same whichever order they are run in.
 
+    Args:
+        job: Dictionary with the name of the Outputs plot method (without the plot_ prefix) under 'plot' and the
+            arguments to call it with under the other keys
+    Returns:
+        List of the filenames saved
+    """
+
+    arguments = {key: value for key, value in job.items() if key != 'plot'}
+    with plt.rc_context():
+        return getattr(plot_worker_state['outputs'], 'plot_' + job['plot'])(
+            figure=plot_worker_state['figure'], **arguments)
+
+
+def render_plot_jobs(data_object, jobs, workers=1):
+    """
+    Render a list of independent plot jobs without a display, in a pool of processes if more than one worker is
+    requested. The causes the jobs need are loaded (and life tables found) first, so that the workers share them
+    rather than each reading them again.
+
+    Args:
+        data_object: The data object to plot from
+        jobs: List of plot job dictionaries, as described in render_plot_job
+        workers: Number of processes to render with
+    Returns:
+        List of the filenames saved, in the order of the jobs
+    """
+
+    if not jobs:
+        return []
+    data_object.load_causes([job['cause'] for job in jobs if 'cause' in job])
+    if any(job['plot'] == 'cumulative_survival' for job in jobs) and data_object.life_tables is None:
+        data_object.find_life_tables()
+
+    if workers > 1:
+        pool = multiprocessing.Pool(min(workers, len(jobs)), initializer=start_plot_worker, initargs=(data_object,))
+        try:
+            saved = pool.map(render_plot_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        start_plot_worker(data_object)
+        try:
+            saved = [render_plot_job(job) for job in jobs]
+        finally:
+            plot_worker_state.clear()
+    return [filename for job_filenames in saved for filename in job_filenames]
@@ -0,0 +1,358 @@
+
+# local HTTP service answering JSON requests for rates and life tables from one data object read at start up
+import BaseHTTPServer
+import SocketServer
+import json
+import multiprocessing
+import os
+import threading
+import urlparse
+import numpy
+
+from grim_reader import Outputs, start_plot_worker, render_plot_job
+from grim_query import QueryCache, QueryEngine
+
+
+# parameters that are lists of values, which in query strings are separated by commas
+list_parameters = ['age_groups', 'years', 'genders', 'causes', 'ages', 'functions']
+
+# the Outputs plots that can be requested, with the arguments that each can be given in a request
+service_plot_arguments = {
+    'rates_by_age_group_over_time': ['cause', 'x_limits', 'y_limits', 'log_scale', 'split_by_gender', 'genders',
+                                     'filename_prefix', 'dpi'],
+    'deaths_by_cause': ['analyses', 'upper_age_limits', 'filename_prefix', 'dpi'],
+    'journal_figure_1': ['filename', 'dpi'],
+    'cumulative_survival': ['filename', 'dpi']}
+
+
+''' static methods'''
+
+
+def parse_service_years(year_values):
+    """
+    Convert years from a request to integers, with strings such as 1990-2016 for inclusive ranges.
+    """
+
+    years = []
+    for year_value in year_values:
+        if isinstance(year_value, basestring) and '-' in year_value:
+            first_year, last_year = year_value.split('-')
+            years.extend(range(int(first_year), int(last_year) + 1))
+        else:
+            years.append(int(year_value))
+    return years
+
+
+def parse_request_parameters(query_string, body=None):
+    """
+    Combine the parameters of a request's query string with those of a JSON body, if it has one.
+
+    Args:
+        query_string: The part of the request path after the question mark
+        body: String of the request body, or None
+    Returns:
+        Dictionary of the parameters, with those in list_parameters as lists and the years as integers
+    """
+
+    parameters = {}
+    for key, values in urlparse.parse_qs(query_string).items():
+        parameters[key] = values[-1].split(',') if key in list_parameters else values[-1]
+    if body:
+        body_parameters = json.loads(body)
+        if not isinstance(body_parameters, dict):
+            raise ValueError('Request body must be a JSON object')
+        parameters.update(body_parameters)
+    for key in list_parameters:
+        if key in parameters and not isinstance(parameters[key], list):
+            parameters[key] = [parameters[key]]
+    if 'years' in parameters:
+        parameters['years'] = parse_service_years(parameters['years'])
+    return parameters
+
+
+def convert_error_to_json(error):
+    """
+    JSON string of the response reporting an error.
+    """
+
+    return json.dumps({'error': '%s: %s' % (error.__class__.__name__, error)})
+
+
+def convert_array_to_json(array):
+    """
+    Nested lists of an array's values for JSON, with the values that aren't finite (such as rates with no population)
+    as null rather than the NaN that json writes and strict parsers reject.
+    """
+
+    array = numpy.asarray(array, dtype=float)
+    return numpy.where(numpy.isfinite(array), array, None).tolist()
+
+
+''' objects '''
+
+
+class GrimService:
+    def __init__(self, data_object, max_entries=1024, plot_directory='.'):
+        """
+        Answers requests from a data object that has already been read, so that the workbooks are only read once for
+        all the requests. Responses are cached (by path, parameters and the version of the data) and the figures are
+        rendered in a separate process, so that requests are still answered while they are drawn.
+
+        Args:
+            data_object: The processed data object, which can be attached to a shared dataset
+            max_entries: Largest number of responses to keep in the cache
+            plot_directory: Directory to save figures to
+        """
+
+        self.data_object, self.outputs, self.plot_directory = data_object, Outputs(data_object), plot_directory
+        self.query_engine = QueryEngine(data_object, max_entries)
+        self.responses, self.response_lock, self.data_lock = QueryCache(max_entries), threading.Lock(), threading.Lock()
+        self.plot_pool, self.plot_pool_causes = None, None
+        self.routes = {'/health': self.find_health, '/rate': self.find_rate, '/rates': self.find_rates,
+                       '/single-year-rates': self.find_single_year_rates, '/query': self.find_query,
+                       '/life-tables': self.find_life_tables}
+
+    def respond(self, path, parameters):
+        """
+        Answer a request, from the cache if the same request has been answered since the data last changed, with
+        errors in the request (such as labels that aren't in the data) reported as JSON with status 400 and any other
+        errors with status 500.
+
+        Args:
+            path: The path of the request, without the query string
+            parameters: Dictionary of the request's parameters
+        Returns:
+            The HTTP status and the JSON string of the response
+        """
+
+        try:
+            return self.find_response(path, parameters)
+        except (KeyError, ValueError, TypeError) as error:
+            return 400, convert_error_to_json(error)
+        except Exception as error:
+            return 500, convert_error_to_json(error)
+
+    def find_response(self, path, parameters):
+        """
+        Answer a request as described in respond, raising any errors.
+        """
+
+        if path == '/plot':
+            return 200, json.dumps(self.render_plot(parameters))
+        if path not in self.routes:
+            return 404, json.dumps({'error': 'Path not found: ' + path})
+        key = (path, json.dumps(parameters, sort_keys=True), self.data_object.version)
+        with self.response_lock:
+            if key in self.responses.entries:
+                return 200, self.responses.get(key, None)
+        with self.data_lock:
+            response = json.dumps(self.routes[path](parameters))
+        with self.response_lock:
+            self.responses.get(key, lambda: response)
+        return 200, response
+
+    def find_health(self, parameters):
+        deaths_data = self.data_object.grim_books_data['deaths']
+        return {'causes': self.data_object.grim_sheets_to_read, 'years': [deaths_data['years'][0],
+                                                                          deaths_data['years'][-1]],
+                'genders': deaths_data['genders'], 'age_groups': deaths_data['age_groups'],
+                'version': self.data_object.version}
+
+    def find_rate(self, parameters):
+        """
+        One element of the data arrays, as from Outputs.get_rate.
+        """
+
+        return {'value': convert_array_to_json(self.outputs.get_rate(
+            parameters['age_group'], int(parameters['year']), parameters['gender'],
+            parameters.get('cause', 'all-causes-combined'), parameters.get('output_type', 'unadjusted_rates')))}
+
+    def find_rates(self, parameters):
+        """
+        Every combination of several age groups, years, genders and causes, as from Outputs.get_rates, defaulting to
+        all of each.
+        """
+
+        deaths_data = self.data_object.grim_books_data['deaths']
+        labels = {'age_groups': parameters.get('age_groups', deaths_data['age_groups'][:-1]),
+                  'years': parameters.get('years', deaths_data['years']),
+                  'genders': parameters.get('genders', deaths_data['genders']),
+                  'causes': parameters.get('causes', self.data_object.grim_sheets_to_read)}
+        output_type = parameters.get('output_type', 'unadjusted_rates')
+        values = self.outputs.get_rates(labels['age_groups'], labels['years'], labels['genders'], labels['causes'],
+                                        output_type)
+        dimensions = ['age_groups', 'years', 'genders'] + (['causes'] if output_type != 'population' else [])
+        return dict({dimension: labels[dimension] for dimension in dimensions},
+                    values=convert_array_to_json(values), dimensions=dimensions)
+
+    def find_single_year_rates(self, parameters):
+        """
+        Rates by single year of age, as from Outputs.get_single_year_rates, defaulting to all ages up to 100 and all of
+        the other dimensions, with ages higher than the rates have been found for rejected.
+        """
+
+        deaths_data = self.data_object.grim_books_data['deaths']
+        max_age = max(100, self.data_object.single_year_rate_options['max_age']) \
+            if self.data_object.single_year_rate_options else 100
+        labels = {'ages': [int(age) for age in parameters.get('ages', range(max_age + 1))],
+                  'years': parameters.get('years', deaths_data['years']),
+                  'genders': parameters.get('genders', deaths_data['genders']),
+                  'causes': parameters.get('causes', self.data_object.grim_sheets_to_read)}
+        if max(labels['ages']) > max_age:
+            raise ValueError('Ages can be no higher than %d' % max_age)
+        values = self.outputs.get_single_year_rates(labels['ages'], labels['years'], labels['genders'],
+                                                    labels['causes'], str(parameters.get('karup_king', True)).lower()
+                                                    not in ['0', 'false'])
+        dimensions = ['ages', 'years', 'genders', 'causes']
+        return dict(labels, values=convert_array_to_json(values), dimensions=dimensions)
+
+    def find_query(self, parameters):
+        """
+        A filtered and aggregated query, as described in QueryEngine.query, with the years either a list or the
+        first_year and last_year parameters.
+        """
+
+        years = parameters.get('years')
+        if 'first_year' in parameters or 'last_year' in parameters:
+            years = tuple(int(parameters[key]) if key in parameters else None for key in ['first_year', 'last_year'])
+        ages = tuple(int(age) if age not in [None, ''] else None for age in parameters['ages']) \
+            if 'ages' in parameters else None
+        result = self.query_engine.query(
+            parameters.get('causes'), years, parameters.get('genders'), ages,
+            parameters.get('aggregation', 'crude_rate'), parameters.get('standard'), parameters.get('weights'),
+            str(parameters.get('pool_years', False)).lower() in ['1', 'true'])
+        return dict(result, values=convert_array_to_json(result['values']))
+
+    def find_life_tables(self, parameters):
+        """
+        Functions of the period life tables for the requested years and genders, found the first time they are asked
+        for.
+        """
+
+        if self.data_object.period_life_tables is None:
+            self.data_object.find_period_life_tables()
+        life_tables = self.data_object.period_life_tables
+        functions = parameters.get('functions', ['ex'])
+        years = parameters.get('years', life_tables['years'])
+        genders = parameters.get('genders', life_tables['genders'])
+        try:
+            indices = [[life_tables[labels].index(label) for label in requested]
+                       for labels, requested in [('functions', functions), ('years', years), ('genders', genders)]]
+        except ValueError as error:
+            raise KeyError(str(error))
+        values = life_tables['data'][numpy.ix_(indices[0], range(len(life_tables['ages'])), indices[1], indices[2])]
+        return {'functions': functions, 'ages': life_tables['ages'], 'years': years, 'genders': genders,
+                'dimensions': ['functions', 'ages', 'years', 'genders'], 'values': convert_array_to_json(values)}
+
+    def render_plot(self, parameters):
+        """
+        Render a figure in the plotting process, which is started again whenever causes have been read since it was
+        started, so that it has them. Only the thread of this request waits for the figure to be drawn.
+
+        Args:
+            parameters: The plot job, as described in render_plot_job, with the filenames saved in the plot directory
+                and only the plots and arguments in service_plot_arguments allowed
+        Returns:
+            Dictionary with the list of the filenames saved
+        """
+
+        job = dict(parameters, plot=parameters.get('plot', 'rates_by_age_group_over_time'))
+        if job['plot'] not in service_plot_arguments:
+            raise ValueError('Plot not recognised: ' + str(job['plot']))
+        unknown_arguments = sorted(set(job) - set(service_plot_arguments[job['plot']]) - {'plot'})
+        if unknown_arguments:
+            raise ValueError('Arguments not recognised for plot %s: %s' % (job['plot'], ', '.join(unknown_arguments)))
+        for key in ['filename', 'filename_prefix']:
+            if key in job:
+                job[key] = os.path.join(self.plot_directory, os.path.basename(job[key]))
+        with self.data_lock:
+            if 'cause' in job:
+                self.data_object.load_causes([job['cause']])
+                self.data_object.index.find_positions('causes', [job['cause']])
+            if job['plot'] == 'cumulative_survival' and self.data_object.life_tables is None:
+                self.data_object.find_life_tables()
+            pool_causes = (tuple(self.data_object.grim_sheets_to_read), self.data_object.version,
+                           self.data_object.life_tables is not None)
+            if self.plot_pool is None or self.plot_pool_causes != pool_causes:
+                self.close()
+                self.plot_pool = multiprocessing.Pool(1, initializer=start_plot_worker, initargs=(self.data_object,))
+                self.plot_pool_causes = pool_causes
+            result = self.plot_pool.apply_async(render_plot_job, (job,))
+        return {'filenames': result.get(timeout=600)}
+
+    def close(self):
+        """
+        Stop the plotting process, if it has been started.
+        """
+
+        if self.plot_pool is not None:
+            self.plot_pool.close()
+            self.plot_pool.join()
+            self.plot_pool = None
+
+
+class GrimRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self, body=None):
+        """
+        Answer a GET or POST request from the server's service, with errors in the request reported as JSON.
+        """
+
+        path, _, query_string = self.path.partition('?')
+        try:
+            parameters = parse_request_parameters(query_string, body)
+        except (KeyError, ValueError, TypeError) as error:
+            status, response = 400, convert_error_to_json(error)
+        else:
+            status, response = self.server.service.respond(path, parameters)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request(self.rfile.read(int(self.headers.getheader('Content-Length', 0))))
+
+    def log_message(self, format_string, *arguments):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format_string, *arguments)
+
+
+class GrimHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, service, host='127.0.0.1', port=8017, verbose=False):
+        """
+        HTTP server answering each connection in its own thread, from a single service and data object.
+
+        Args:
+            service: The GrimService to answer requests with
+            host: Address to listen on, which is only the local machine by default
+            port: Port to listen on, or 0 for any free port
+            verbose: Whether to log each request
+        """
+
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), GrimRequestHandler)
+        self.service, self.verbose = service, verbose
+
+
+def serve(data_object, host='127.0.0.1', port=8017, max_entries=1024, plot_directory='.', verbose=False):
+    """
+    Answer requests from a data object until interrupted.
+    """
+
+    service = GrimService(data_object, max_entries, plot_directory)
+    server = GrimHTTPServer(service, host, port, verbose)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
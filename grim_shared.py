@@ -0,0 +1,149 @@
+
+# sharing one processed data object between processes on the same machine, through memory-mapped files in /dev/shm
+import cPickle
+import errno
+import os
+import shutil
+import tempfile
+import time
+
+
+''' static methods'''
+
+
+def find_dataset_directory(name, directory=None):
+    """
+    Directory that a published dataset is kept in, by default in /dev/shm so that its files are held in shared memory
+    rather than written to disk.
+
+    Args:
+        name: Name the dataset is published under
+        directory: Directory to keep published datasets in, or None for the default
+    Returns:
+        The directory for the dataset
+    """
+
+    if directory is None:
+        directory = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'grim_datasets')
+    return os.path.join(directory, name)
+
+
+def register_dataset_reader(publication_directory):
+    """
+    Record that this process has a publication's arrays mapped, so that the publication is kept when the dataset is
+    published again.
+    """
+
+    os.close(os.open(os.path.join(publication_directory, 'readers', str(os.getpid())), os.O_CREAT | os.O_WRONLY))
+
+
+def find_live_readers(publication_directory):
+    """
+    Find the processes recorded as reading a publication that are still running.
+
+    Args:
+        publication_directory: The directory of the published arrays
+    Returns:
+        List of the process IDs
+    """
+
+    live_readers, readers_directory = [], os.path.join(publication_directory, 'readers')
+    for entry in os.listdir(readers_directory) if os.path.isdir(readers_directory) else []:
+        try:
+            os.kill(int(entry), 0)
+            live_readers.append(int(entry))
+        except OSError as error:
+            if error.errno == errno.EPERM:
+                live_readers.append(int(entry))
+    return live_readers
+
+
+def publish_dataset(data_object, name='grim', directory=None):
+    """
+    Publish a processed data object so that other processes can attach to it rather than reading the workbooks again.
+    The deaths, adjusted deaths and rates arrays are written to a new directory of memory-mapped files and the rest of
+    the data object (populations, average rates, labels and indexes) is pickled alongside them. The data object given
+    is changed to map its arrays read-only from the published files, so that it shares them as well.
+
+    Each publication goes in its own directory, with the pickle recording the latest replaced in a single step, so
+    processes attaching while a dataset is published again get either the old or the new one. Older publications are
+    only removed once no process that attached to them (or published them) is still running, or each has called
+    release_dataset, because a data object that is pickled again (such as to send to a worker process) maps its arrays
+    from the files of its publication when it is unpickled.
+
+    Args:
+        data_object: The processed data object, which can't be used to read any more causes afterwards
+        name: Name to publish the dataset under
+        directory: Directory to keep published datasets in, or None for the default
+    Returns:
+        The directory of the published arrays
+    """
+
+    dataset_directory = find_dataset_directory(name, directory)
+    publication_directory = os.path.join(dataset_directory, '%d-%d' % (int(time.time() * 1e6), os.getpid()))
+    os.makedirs(os.path.join(publication_directory, 'readers'))
+    register_dataset_reader(publication_directory)
+    data_object.storage_directory, data_object.storage_read_only = publication_directory, False
+    for data_structure, key, array_name in data_object.find_stored_arrays():
+        data_structure[key] = data_object.store_array(array_name, data_structure[key])
+    data_object.open_storage_read_only()
+
+    # the pickle leaves out the read-only arrays, which are mapped again when it is loaded
+    pickle_filename = os.path.join(dataset_directory, 'dataset.pickle')
+    with open(pickle_filename + '.tmp', 'wb') as pickle_file:
+        cPickle.dump(data_object, pickle_file, cPickle.HIGHEST_PROTOCOL)
+    os.rename(pickle_filename + '.tmp', pickle_filename)
+
+    for entry in os.listdir(dataset_directory):
+        if entry != os.path.basename(publication_directory) \
+                and os.path.isdir(os.path.join(dataset_directory, entry)) \
+                and not find_live_readers(os.path.join(dataset_directory, entry)):
+            shutil.rmtree(os.path.join(dataset_directory, entry), ignore_errors=True)
+    return publication_directory
+
+
+def attach_dataset(name='grim', directory=None, attempts=3):
+    """
+    Attach to a published dataset, with its arrays mapped read-only from the shared files rather than copied. This
+    process is recorded as reading the publication, so that it is kept until this process ends or calls
+    release_dataset.
+
+    Args:
+        name: Name the dataset was published under
+        directory: Directory the datasets are kept in, or None for the default
+        attempts: Number of times to try, in case the dataset is published again while attaching
+    Returns:
+        The read-only data object, which can be used with Outputs as any other
+    """
+
+    pickle_filename = os.path.join(find_dataset_directory(name, directory), 'dataset.pickle')
+    for attempt in range(attempts):
+        try:
+            with open(pickle_filename, 'rb') as pickle_file:
+                data_object = cPickle.load(pickle_file)
+            register_dataset_reader(data_object.storage_directory)
+            return data_object
+        except (IOError, OSError):
+            if attempt == attempts - 1 or not os.path.isfile(pickle_filename):
+                raise
+
+
+def release_dataset(data_object):
+    """
+    Record that this process no longer needs the publication that a data object was attached to (or published as), so
+    that it can be removed when the dataset is published again. The data object shouldn't be pickled afterwards.
+    """
+
+    try:
+        os.remove(os.path.join(data_object.storage_directory, 'readers', str(os.getpid())))
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+
+
+def unpublish_dataset(name='grim', directory=None):
+    """
+    Remove a published dataset, which leaves the processes attached to it with their existing mappings.
+    """
+
+    shutil.rmtree(find_dataset_directory(name, directory), ignore_errors=True)
@@ -0,0 +1,137 @@
+
+# uncertainty intervals for the crude and standardised rates, from replicates of the deaths arrays
+import multiprocessing
+import numpy
+
+
+''' static methods'''
+
+
+def draw_death_replicates(deaths, n_replicates, random_state, method='poisson'):
+    """
+    Draw random replicates of death counts, either as Poisson counts with the observed deaths as their means or from
+    the gamma distribution with the observed deaths as its shape, which is the posterior for a Poisson rate under the
+    prior proportional to one over the rate and gives intervals that behave better when the counts are small. That
+    posterior is degenerate where no deaths were observed, so those are drawn with a shape of one (the posterior under
+    a flat prior) and have an interval from zero up to about 3.7 deaths rather than one of zero width.
+
+    Args:
+        deaths: Array of the observed deaths, of any shape
+        n_replicates: Number of replicates to draw
+        random_state: numpy RandomState to draw with
+        method: Either poisson or gamma
+    Returns:
+        Array of the replicates, with a first dimension of length n_replicates and then the dimensions of deaths
+    """
+
+    size = (n_replicates,) + deaths.shape
+    if method == 'poisson':
+        return random_state.poisson(deaths, size=size).astype(float)
+    elif method == 'gamma':
+        return random_state.gamma(numpy.where(deaths > 0., deaths, 1.), size=size)
+    raise ValueError('Replicate method not recognised: ' + str(method))
+
+
+def find_chunk_intervals(chunk):
+    """
+    Find the percentile intervals for the crude and standardised rates of a chunk of series (combinations of year,
+    gender and cause), holding all the replicates of only this chunk in memory at once.
+
+    Args:
+        chunk: Tuple of the deaths and populations of the chunk's series, each an array by age group and series, the
+            list of upper age group indices for the crude rates, the array of standard weights by standard and age
+            group, the number of replicates, the percentiles, the replicate method and the seeds of the series
+    Returns:
+        crude_intervals: Array by upper age group index, percentile and series
+        standardised_intervals: Array by row of the weights, percentile and series
+    """
+
+    deaths, populations, upper_indices, age_weights, n_replicates, percentiles, method, seeds = chunk
+    replicates = numpy.stack([draw_death_replicates(deaths[:, s], n_replicates, numpy.random.RandomState(series_seed),
+                                                    method) for s, series_seed in enumerate(seeds)], axis=2)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        crude_intervals = numpy.array([
+            numpy.percentile(numpy.sum(replicates[:, :up], axis=1) / numpy.sum(populations[:up], axis=0),
+                             percentiles, axis=0) for up in upper_indices])
+        standardised_intervals = numpy.percentile(
+            numpy.einsum('wa,ras->wrs', age_weights, replicates / populations), percentiles, axis=1)
+    return crude_intervals, numpy.swapaxes(standardised_intervals, 0, 1)
+
+
+def find_rate_intervals(deaths, populations, upper_indices, age_weights, n_replicates=1000,
+                        percentiles=(2.5, 97.5), method='poisson', chunk_size=50, workers=1, seed=0):
+    """
+    Percentile intervals for crude and age-standardised rates for every year, gender and cause. The series (each
+    combination of year, gender and cause) are split into chunks so that only chunk_size series' replicates are held in
+    memory at once, about 8 * n_replicates * age groups * chunk_size bytes, and the chunks can be spread over
+    processes. Each series has its own seed, so the results are the same whatever the chunk size and number of workers.
+
+    Args:
+        deaths: Array of deaths by age group, year, gender and cause
+        populations: Array of populations by age group, year and gender
+        upper_indices: List of the indices of the age groups after the last included in each crude rate
+        age_weights: Array of standard population weights by standard (or upper age limit) and age group
+        n_replicates: Number of replicates to draw
+        percentiles: The percentiles to find, with the default giving 95% intervals
+        method: Either poisson or gamma, as described in draw_death_replicates
+        chunk_size: Number of series to draw the replicates of at once
+        workers: Number of processes to find the intervals with
+        seed: Seed that the seeds of the series are drawn from
+    Returns:
+        crude_intervals: Array by upper age group index, percentile, year, gender and cause
+        standardised_intervals: Array by row of the weights, percentile, year, gender and cause
+    """
+
+    n_age_groups, series_shape = deaths.shape[0], deaths.shape[1:]
+    deaths_by_series = deaths.reshape(n_age_groups, -1)
+    populations_by_series = numpy.broadcast_to(numpy.expand_dims(populations, axis=3), deaths.shape).reshape(
+        n_age_groups, -1)
+    seeds = numpy.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=deaths_by_series.shape[1])
+    chunks = [(deaths_by_series[:, start:start + chunk_size], populations_by_series[:, start:start + chunk_size],
+               upper_indices, age_weights, n_replicates, percentiles, method, seeds[start:start + chunk_size])
+              for start in range(0, deaths_by_series.shape[1], chunk_size)]
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            chunk_intervals = pool.map(find_chunk_intervals, chunks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunk_intervals = [find_chunk_intervals(chunk) for chunk in chunks]
+
+    crude_intervals, standardised_intervals \
+        = [numpy.concatenate([intervals[n] for intervals in chunk_intervals], axis=-1) for n in range(2)]
+    return crude_intervals.reshape(crude_intervals.shape[:2] + series_shape), \
+        standardised_intervals.reshape(standardised_intervals.shape[:2] + series_shape)
+
+
+def find_spring_rate_intervals(data_object, n_replicates=1000, percentiles=(2.5, 97.5), method='poisson',
+                               chunk_size=50, workers=1, seed=0):
+    """
+    Intervals for the average rates of a data object, for each of its upper age limits and standard populations.
+
+    Args:
+        data_object: The data object with the deaths, populations and standard weights
+        Other arguments are as for find_rate_intervals
+    Returns:
+        intervals: Dictionary structured as the data object's average_rates_by_year, but with arrays by percentile,
+            year, gender and cause
+    """
+
+    limits, standards = data_object.upper_age_limits_to_cut_at, data_object.standards
+    upper_indices = [data_object.grim_books_data['deaths']['age_groups'].index(limit) + 1 for limit in limits]
+    age_weights = numpy.array([data_object.standard_age_weights[standard][limit]
+                               for standard in standards for limit in limits])
+    crude_intervals, standardised_intervals = find_rate_intervals(
+        data_object.grim_books_data['deaths']['adjusted_data'],
+        data_object.grim_books_data['population']['adjusted_data'], upper_indices, age_weights, n_replicates,
+        percentiles, method, chunk_size, workers, seed)
+
+    intervals = {'adjusted_data': {limit: crude_intervals[l] for l, limit in enumerate(limits)},
+                 'standardised_by_standard': {
+                     standard: {limit: standardised_intervals[s * len(limits) + l] for l, limit in enumerate(limits)}
+                     for s, standard in enumerate(standards)}}
+    intervals['standardised_adjusted_data'] = intervals['standardised_by_standard'][standards[0]]
+    return intervals
@@ -0,0 +1,148 @@
+
+# load test of the local HTTP service, reporting the throughput and latency of a mix of requests
+from grim_service import GrimService, GrimHTTPServer
+import argparse
+import collections
+import json
+import threading
+import time
+import urllib
+import urllib2
+import numpy
+
+
+# requests sent in turn by each thread, as the path and either query parameters or a JSON body to post
+default_requests = [
+    ('/rate', {'age_group': '70 to 74', 'year': 2016, 'gender': 'Females'}, None),
+    ('/rates', None, {'age_groups': ['70 to 74', '75 to 79', '80 to 84', '85+'], 'years': ['2014-2016'],
+                      'genders': ['Males', 'Females']}),
+    ('/query', {'ages': '70,89', 'first_year': 2014, 'last_year': 2016, 'aggregation': 'standardised_rate'}, None),
+    ('/query', {'ages': '0,64', 'aggregation': 'crude_rate', 'pool_years': 'true'}, None),
+    ('/life-tables', {'functions': 'ex,qx', 'years': '2016', 'genders': 'Males,Females'}, None)]
+
+
+''' static methods'''
+
+
+def send_request(base_url, request):
+    """
+    Send one request and read the whole of its response.
+
+    Args:
+        base_url: Address of the service, such as http://127.0.0.1:8017
+        request: Tuple of the path, the query parameters (or None) and the JSON body to post (or None)
+    Returns:
+        The HTTP status of the response
+    """
+
+    path, query, body = request
+    url = base_url + path + ('?' + urllib.urlencode(query) if query else '')
+    try:
+        response = urllib2.urlopen(urllib2.Request(
+            url, json.dumps(body) if body is not None else None, {'Content-Type': 'application/json'}))
+        response.read()
+        return response.getcode()
+    except urllib2.HTTPError as error:
+        error.read()
+        return error.code
+
+
+def run_client(base_url, requests, n_requests, latencies, statuses):
+    """
+    Send requests one after another from a single thread, recording the latency and status of each.
+    """
+
+    for n in range(n_requests):
+        start = time.time()
+        statuses.append(send_request(base_url, requests[n % len(requests)]))
+        latencies.append(time.time() - start)
+
+
+def run_load_test(base_url, requests=None, n_requests=1000, concurrency=8, warm_up=True):
+    """
+    Send requests from several threads at once and summarise how quickly they are answered.
+
+    Args:
+        base_url: Address of the service
+        requests: List of requests to cycle through, as described in send_request, or None for default_requests
+        n_requests: Number of requests for each thread to send
+        concurrency: Number of threads sending requests at once
+        warm_up: Whether to send each request once first, so the results describe answers from the response cache
+    Returns:
+        Dictionary of the number of requests, the number of errors, requests per second and latencies in milliseconds
+    """
+
+    requests = default_requests if requests is None else requests
+    if warm_up:
+        for request in requests:
+            send_request(base_url, request)
+    latencies, statuses = [], []
+    threads = [threading.Thread(target=run_client, args=(base_url, requests, n_requests, latencies, statuses))
+               for _ in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    latencies = numpy.array(latencies) * 1e3
+    return {'requests': len(latencies), 'errors': sum(status != 200 for status in statuses),
+            'requests_per_second': len(latencies) / elapsed, 'latency_mean_ms': float(numpy.mean(latencies)),
+            'latency_p50_ms': float(numpy.percentile(latencies, 50)),
+            'latency_p99_ms': float(numpy.percentile(latencies, 99))}
+
+
+def run_local_load_test(data_object, max_entries, n_requests=1000, concurrency=8):
+    """
+    Start a service on a free local port and load test it, sending each request once first if it caches responses.
+
+    Args:
+        data_object: The data object for the service to answer from
+        max_entries: Largest number of responses (and queries) for the service to cache, with zero for none
+        n_requests: Number of requests for each thread to send
+        concurrency: Number of threads sending requests at once
+    Returns:
+        The results, as from run_load_test
+    """
+
+    server = GrimHTTPServer(GrimService(data_object, max_entries=max_entries), port=0)
+    threading.Thread(target=server.serve_forever).start()
+    try:
+        return run_load_test('http://127.0.0.1:%d' % server.server_address[1], n_requests=n_requests,
+                             concurrency=concurrency, warm_up=max_entries > 0)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+''' load test runner '''
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='load test of the GRIM HTTP service')
+    parser.add_argument('--url', help='address of a running service, otherwise services with and without their caches '
+                                      'are started on free local ports and both are reported')
+    parser.add_argument('--requests', type=int, default=1000, help='requests sent by each thread')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads sending requests at once')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='only report the service started here with its caches turned off, so that every request '
+                             'is answered from the arrays')
+    parser.add_argument('--cache-directory', default='grim_cache')
+    arguments = parser.parse_args()
+    if arguments.url and arguments.no_cache:
+        parser.error('--no-cache can only be used with the services started here, not with --url')
+
+    # a running service is sent its requests without warming up, as whether it caches them isn't known
+    if arguments.url:
+        results = {'running': run_load_test(arguments.url, n_requests=arguments.requests,
+                                            concurrency=arguments.concurrency, warm_up=False)}
+    else:
+        from grim_reader import Spring
+        data_object = Spring(cache_directory=arguments.cache_directory, lazy=True)
+        results = collections.OrderedDict(
+            (mode, run_local_load_test(data_object, max_entries, arguments.requests, arguments.concurrency))
+            for mode, max_entries in [('uncached', 0), ('cached', 1024)][:1 if arguments.no_cache else 2])
+    print('%-20s' % 'measure' + ''.join('%12s' % mode for mode in results))
+    for measure in ['requests', 'errors', 'requests_per_second', 'latency_mean_ms', 'latency_p50_ms',
+                    'latency_p99_ms']:
+        print('%-20s' % measure + ''.join('%12.1f' % results[mode][measure] for mode in results))
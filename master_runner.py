@@ -1,47 +1,417 @@
 
-# import main objects
+# command-line entry point for reading the GRIM books and producing the outputs
 from grim_reader import *
+from grim_export import export_long_format
+from grim_query import QueryEngine, query_aggregations
+from grim_service import serve
+from grim_shared import attach_dataset, publish_dataset
+from grim_uncertainty import find_spring_rate_intervals
+import argparse
+import csv
 import itertools
+import json
+import os
+import sys
+import numpy
 
-# run data analysis
-data_object = Spring()
-# data_object.find_life_tables()
-
-# run plotting through outputs module
-outputs_object = Outputs(data_object)
-# outputs_object.plot_rates_by_age_group_over_time(
-#     cause='liver-disease', x_limits=(1980., 2014.), split_by_gender=False)
-# outputs_object.plot_journal_figure_1()
-# outputs_object.plot_cumulative_survival()
-# outputs_object.plot_deaths_by_cause()
-
-# outputs for the aspree paper
-
-aspree_data = {
-    70: {'Persons': 9668, 'Females': 5173},
-    75: {'Persons': 4432, 'Females': 2515},
-    80: {'Persons': 1963, 'Females': 1125},
-    85: {'Persons': 640, 'Females': 367}}
-aspree_total = 0
-genders = ['Males', 'Females']
-for age in range(70, 90, 5):
-    aspree_total += aspree_data[age]['Persons']
-    aspree_data[age]['Males'] = aspree_data[age]['Persons'] - aspree_data[age]['Females']
-    for gender in genders:
-        aspree_data[age]['Proportion ' + gender] = aspree_data[age][gender] / aspree_total
-aspree_weights = {}
-for age, gender in itertools.product(range(70, 90, 5), genders):
-    aspree_weights[str(age) + ' ' + gender] = float(aspree_data[age][gender]) / float(aspree_total)
-for year in range(2014, 2017):
-    weighted_rate = 0.
-    for gender, age in itertools.product(genders, range(70, 90, 5)):
-        cancer_deaths = outputs_object.get_rate(
-                convert_integer_age_to_string(age), year, gender, 'all-neoplasms', 'raw_deaths')
-        population = outputs_object.get_rate(convert_integer_age_to_string(age), year, gender, '', 'population')
-        rate = cancer_deaths / population
-        contribution = rate * aspree_weights[str(age) + ' ' + gender]
-        weighted_rate += contribution
-    print('\nWeighted rate in {} is:'.format(year))
-    print(weighted_rate * 1e3)
 
+''' input and output '''
 
+
+def parse_years(year_strings):
+    """
+    Convert the years requested on the command line to a list of integers, allowing ranges such as 1990-2016.
+
+    Args:
+        year_strings: List of strings, each either a single year or an inclusive range of years
+    Returns:
+        years: List of integer years
+    """
+
+    years = []
+    for year_string in year_strings:
+        if '-' in year_string:
+            first_year, last_year = year_string.split('-')
+            years.extend(range(int(first_year), int(last_year) + 1))
+        else:
+            years.append(int(year_string))
+    return years
+
+
+def write_table(columns, rows, output_format='csv', output=None):
+    """
+    Write rows of results in the requested format.
+
+    Args:
+        columns: List of the column names
+        rows: Iterable of the rows, each a sequence of values in the order of the columns
+        output_format: One of csv, json (a list of objects keyed by column) or text (aligned columns)
+        output: Filename to write to, or None to write to standard output
+    """
+
+    output_file = open(output, 'wb') if output else sys.stdout
+    try:
+        if output_format == 'csv':
+            writer = csv.writer(output_file)
+            writer.writerow(columns)
+            writer.writerows(rows)
+        elif output_format == 'json':
+            json.dump([dict(zip(columns, row)) for row in rows], output_file, indent=1)
+            output_file.write('\n')
+        else:
+            for row in itertools.chain([columns], rows):
+                output_file.write(' '.join('%-20s' % (value,) for value in row).rstrip() + '\n')
+    finally:
+        if output:
+            output_file.close()
+
+
+def build_data_object(arguments, causes=None):
+    """
+    Read and process only the causes requested on the command line, or attach to a dataset already published.
+
+    Args:
+        arguments: The parsed command-line arguments
+        causes: List of causes to read instead of those requested
+    Returns:
+        The processed data object
+    """
+
+    if arguments.attach:
+        return attach_dataset(arguments.attach, arguments.shared_directory)
+    for standard_csv in arguments.standard_csv if arguments.standard_csv else []:
+        name, filename = standard_csv.split('=', 1)
+        register_standard_population(name, filename=filename)
+    return Spring(cache_directory=arguments.cache_directory, workers=arguments.workers, lazy=arguments.lazy,
+                  backend=arguments.backend, profile=bool(arguments.profile),
+                  causes=causes if causes else arguments.causes, standards=arguments.standards,
+                  dtype=arguments.dtype, storage_directory=arguments.storage_directory)
+
+
+def find_requested_labels(data_object, arguments):
+    """
+    Years, genders and causes requested on the command line, defaulting to all those that have been read.
+    """
+
+    years = parse_years(arguments.years) if arguments.years else data_object.grim_books_data['deaths']['years']
+    genders = arguments.genders if arguments.genders else data_object.grim_books_data['deaths']['genders']
+    causes = arguments.causes if arguments.causes else data_object.grim_sheets_to_read
+    return years, genders, causes
+
+
+''' subcommands '''
+
+
+def run_ingest(arguments):
+    """
+    Parse the requested workbooks into the cache, so that later runs read them from there.
+    """
+
+    # all-causes-combined goes first, as the years with data are found from it
+    causes = ['all-causes-combined'] + [cause for cause in (arguments.causes if arguments.causes
+                                                            else find_available_grim_causes())
+                                        if cause != 'all-causes-combined']
+    read_grim_sheet_with_cache(find_grim_filename('all-causes-combined'), 'Populations', title_row_index=14,
+                               gender_row_index=12, cache_directory=arguments.cache_directory,
+                               backend=arguments.backend)
+    age_groups, years, genders, deaths = read_all_grim_sheets(
+        causes, cache_directory=arguments.cache_directory, workers=arguments.workers, backend=arguments.backend)
+    write_table(['cause', 'first_year', 'last_year', 'deaths'],
+                [[cause, years[0], years[-1], int(numpy.sum(deaths[:, :, genders.index('Persons'), c]))]
+                 for c, cause in enumerate(causes)], arguments.format, arguments.output)
+
+
+def run_publish(arguments):
+    """
+    Read and process the requested causes once and publish them for other runs to attach to with --attach.
+    """
+
+    data_object = build_data_object(arguments)
+    publication_directory = publish_dataset(data_object, arguments.name, arguments.shared_directory)
+    write_table(['name', 'directory', 'causes'],
+                [[arguments.name, publication_directory, ' '.join(data_object.grim_sheets_to_read)]],
+                arguments.format, arguments.output)
+    return data_object
+
+
+def run_rates(arguments):
+    """
+    Death rates by age group, year, gender and cause.
+    """
+
+    data_object = build_data_object(arguments)
+    years, genders, causes = find_requested_labels(data_object, arguments)
+    age_groups = arguments.age_groups if arguments.age_groups \
+        else data_object.grim_books_data['deaths']['age_groups'][:-1]
+    rates = Outputs(data_object).get_rates(age_groups, years, genders, causes, 'unadjusted_rates')
+    write_table(['cause', 'age_group', 'year', 'gender', 'rate'],
+                [[cause, age_group, year, gender, rates[a, y, g, c]]
+                 for c, cause in enumerate(causes) for a, age_group in enumerate(age_groups)
+                 for y, year in enumerate(years) for g, gender in enumerate(genders)],
+                arguments.format, arguments.output)
+    return data_object
+
+
+def run_standardised(arguments):
+    """
+    Crude and standardised rates averaged over the age groups up to each upper age limit, for each standard population,
+    with 95% intervals if replicates are requested.
+    """
+
+    data_object = build_data_object(arguments)
+    years, genders, causes = find_requested_labels(data_object, arguments)
+    data_object.load_causes(causes)
+    year_indices, gender_indices, cause_indices = [data_object.index.find_positions(dimension, labels) for
+                                                   dimension, labels in [('years', years), ('genders', genders),
+                                                                         ('causes', causes)]]
+    columns = ['cause', 'upper_age_limit', 'standard', 'year', 'gender', 'crude_rate', 'standardised_rate']
+    if arguments.replicates:
+        intervals = find_spring_rate_intervals(data_object, arguments.replicates, method=arguments.interval_method,
+                                               chunk_size=arguments.chunk_size, workers=arguments.workers)
+        columns += ['crude_lower', 'crude_upper', 'standardised_lower', 'standardised_upper']
+    selection, rows = numpy.ix_(year_indices, gender_indices, cause_indices), []
+    for standard, upper_age_limit in itertools.product(data_object.standards, data_object.upper_age_limits_to_cut_at):
+        values = [data_object.average_rates_by_year['adjusted_data'][upper_age_limit],
+                  data_object.average_rates_by_year['standardised_by_standard'][standard][upper_age_limit]]
+        if arguments.replicates:
+            values += list(intervals['adjusted_data'][upper_age_limit]) \
+                + list(intervals['standardised_by_standard'][standard][upper_age_limit])
+        values = [value[selection] for value in values]
+        rows.extend([[cause, upper_age_limit, standard, year, gender] + [value[y, g, c] for value in values]
+                     for c, cause in enumerate(causes) for y, year in enumerate(years)
+                     for g, gender in enumerate(genders)])
+    write_table(columns, rows, arguments.format, arguments.output)
+    return data_object
+
+
+def run_life_tables(arguments):
+    """
+    Proportion surviving to each single year of age, with the cumulative proportion that have died of each cause, or
+    period life tables from all-cause mortality.
+    """
+
+    data_object = build_data_object(arguments)
+    years, genders, causes = find_requested_labels(data_object, arguments)
+    if arguments.period:
+        data_object.find_period_life_tables(karup_king=not arguments.rectangular)
+        tables = data_object.period_life_tables
+        year_indices, gender_indices = \
+            data_object.index.find_positions('years', years), data_object.index.find_positions('genders', genders)
+        data = tables['data'][:, :, year_indices][:, :, :, gender_indices]
+        write_table(['age', 'year', 'gender'] + tables['functions'],
+                    [[age, year, gender] + list(data[:, a, y, g])
+                     for y, year in enumerate(years) for g, gender in enumerate(genders)
+                     for a, age in enumerate(tables['ages'])], arguments.format, arguments.output)
+        return data_object
+    data_object.load_causes(causes)
+    data_object.find_life_tables(karup_king=not arguments.rectangular)
+    year_indices, gender_indices = \
+        data_object.index.find_positions('years', years), data_object.index.find_positions('genders', genders)
+    other_causes = [cause for cause in causes if cause != 'all-causes-combined']
+    cause_indices = data_object.index.find_positions('causes', other_causes)
+    survival = data_object.life_tables[numpy.ix_(range(len(data_object.life_tables)), year_indices, gender_indices)]
+    cumulative_deaths = data_object.cumulative_deaths_by_cause[
+        numpy.ix_(range(len(data_object.life_tables)), year_indices, gender_indices, cause_indices)]
+    write_table(['age', 'year', 'gender', 'survival'] + ['cumulative_deaths_' + cause for cause in other_causes],
+                [[age, year, gender, survival[age, y, g]] + list(cumulative_deaths[age, y, g])
+                 for y, year in enumerate(years) for g, gender in enumerate(genders)
+                 for age in range(len(survival))], arguments.format, arguments.output)
+    return data_object
+
+
+def run_export(arguments):
+    """
+    Write the populations and every metric of the requested causes as a long-format table, one cause at a time.
+    """
+
+    if not arguments.output:
+        raise SystemExit('export needs a file to write to with --output')
+    # only all-causes-combined is read into the data object, with the causes requested read one at a time on export
+    data_object = build_data_object(arguments, ['all-causes-combined'] if arguments.causes else None)
+    years, genders, causes = find_requested_labels(data_object, arguments)
+    if arguments.life_tables:
+        data_object.find_life_tables()
+        data_object.find_period_life_tables()
+    export_long_format(data_object, arguments.output, arguments.export_format, causes)
+    return data_object
+
+
+def run_plot(arguments):
+    """
+    Save the requested figures, rendered without a display and in parallel if more than one worker is requested.
+    """
+
+    data_object = build_data_object(arguments)
+    years, genders, causes = find_requested_labels(data_object, arguments)
+    if not os.path.isdir(arguments.output_directory):
+        os.makedirs(arguments.output_directory)
+    jobs = []
+    for plot in arguments.plots:
+        if plot == 'rates_by_age_group_over_time':
+            jobs.extend(find_cause_plot_jobs(causes, genders, arguments.dpi,
+                                             os.path.join(arguments.output_directory, 'mortality_figure_')))
+        elif plot == 'deaths_by_cause':
+            jobs.append({'plot': plot, 'dpi': arguments.dpi,
+                         'filename_prefix': os.path.join(arguments.output_directory, 'mortality_figure_cause')})
+        else:
+            jobs.append({'plot': plot, 'dpi': arguments.dpi if arguments.dpi else 1000,
+                         'filename': os.path.join(arguments.output_directory,
+                                                  {'journal_figure_1': 'journal_figure',
+                                                   'cumulative_survival': 'lifetable'}[plot])})
+    filenames = render_plot_jobs(data_object, jobs, arguments.workers)
+    write_table(['filename'], [[filename] for filename in filenames], arguments.format, arguments.output)
+    return data_object
+
+
+def run_query(arguments):
+    """
+    A single filtered and aggregated query, with the age groups starting within the requested ages aggregated over.
+    """
+
+    data_object = build_data_object(arguments)
+    result = QueryEngine(data_object).query(
+        arguments.causes, parse_years(arguments.years) if arguments.years else None, arguments.genders,
+        tuple(arguments.ages) if arguments.ages else None, arguments.aggregation, arguments.standard,
+        pool_years=arguments.pool_years)
+    dimensions = result['dimensions']
+    write_table(dimensions + [arguments.aggregation],
+                [[result[dimension][i] for dimension, i in zip(dimensions, position)] + [result['values'][position]]
+                 for position in itertools.product(*[range(len(result[dimension])) for dimension in dimensions])],
+                arguments.format, arguments.output)
+    return data_object
+
+
+def run_serve(arguments):
+    """
+    Read the requested causes once and answer JSON requests for them over HTTP until interrupted.
+    """
+
+    data_object = build_data_object(arguments)
+    serve(data_object, arguments.host, arguments.port, arguments.cache_entries, arguments.output_directory,
+          arguments.verbose)
+    return data_object
+
+
+def run_aspree(arguments):
+    """
+    Death rates weighted by the age and gender distribution of the ASPREE trial participants.
+    """
+
+    aspree_cohort = {
+        '70 to 74': {'Persons': 9668, 'Females': 5173},
+        '75 to 79': {'Persons': 4432, 'Females': 2515},
+        '80 to 84': {'Persons': 1963, 'Females': 1125},
+        '85+': {'Persons': 640, 'Females': 367}}
+    for age_group in aspree_cohort:
+        aspree_cohort[age_group]['Males'] = aspree_cohort[age_group]['Persons'] - aspree_cohort[age_group]['Females']
+
+    causes = arguments.causes if arguments.causes else ['all-neoplasms']
+    data_object = build_data_object(arguments, causes)
+    years = parse_years(arguments.years) if arguments.years else range(2014, 2017)
+    weighted_rates = Outputs(data_object).get_weighted_rates(
+        aspree_cohort, sorted(aspree_cohort), ['Males', 'Females'], years, causes)
+    write_table(['cause', 'year', 'weighted_rate_per_thousand', 'lower_limit_per_thousand',
+                 'upper_limit_per_thousand'],
+                [[cause, year] + [weighted_rates[measure][0, y, c] * 1e3
+                                  for measure in ['rates', 'lower_limits', 'upper_limits']]
+                 for c, cause in enumerate(causes) for y, year in enumerate(years)], arguments.format, arguments.output)
+    return data_object
+
+
+def build_parser():
+    """
+    Command-line parser with a subcommand for each output, all sharing the options for what to read and how.
+    """
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--causes', nargs='+', help='causes of death (the part of the workbook name after grim-), '
+                                                    'by default those listed in Spring')
+    common.add_argument('--years', nargs='+', help='years or ranges of years such as 1990-2016, by default all')
+    common.add_argument('--genders', nargs='+', choices=['Persons', 'Males', 'Females'], help='by default all')
+    common.add_argument('--workers', type=int, default=1, help='processes to parse workbooks or render plots with')
+    common.add_argument('--format', default='csv', choices=['csv', 'json', 'text'])
+    common.add_argument('--output', help='file to write the results to, by default standard output')
+    common.add_argument('--cache-directory', default='grim_cache')
+    common.add_argument('--no-cache', dest='cache_directory', action='store_const', const=None,
+                        help='parse every workbook rather than reading the cache')
+    common.add_argument('--backend', default='xlrd', choices=['xlrd', 'stream'])
+    common.add_argument('--lazy', action='store_true', help='only read the causes as they are needed')
+    common.add_argument('--standards', nargs='+', help='standard populations to standardise to, such as aus2001 '
+                                                       '(the default), who2000 or segi')
+    common.add_argument('--standard-csv', nargs='+', metavar='NAME=FILE',
+                        help='register standard populations from CSV files with age and population columns')
+    common.add_argument('--dtype', default='float64', choices=['float64', 'float32'],
+                        help='data type of the deaths and rates arrays')
+    common.add_argument('--storage-directory', help='keep the deaths and rates arrays in memory-mapped files here')
+    common.add_argument('--attach', metavar='NAME', help='use a dataset published by the publish subcommand')
+    common.add_argument('--shared-directory', help='directory of the published datasets, by default in /dev/shm')
+    common.add_argument('--profile', help='JSON file to write the time and memory of each processing stage to')
+
+    parser = argparse.ArgumentParser(description='Read the AIHW GRIM books and produce death rates and figures.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('ingest', parents=[common],
+                          help='parse the workbooks into the cache, by default all those available').set_defaults(
+        run=run_ingest)
+    publish_parser = subparsers.add_parser('publish', parents=[common],
+                                           help='process the causes once and share them with other local runs')
+    publish_parser.add_argument('--name', default='grim', help='name to publish the dataset under')
+    publish_parser.set_defaults(run=run_publish)
+    rates_parser = subparsers.add_parser('rates', parents=[common], help='death rates by age group')
+    rates_parser.add_argument('--age-groups', nargs='+', help='such as "70 to 74", by default all')
+    rates_parser.set_defaults(run=run_rates)
+    standardised_parser = subparsers.add_parser('standardised', parents=[common],
+                                                help='crude and age-standardised rates for each upper age limit')
+    standardised_parser.add_argument('--replicates', type=int, default=0,
+                                     help='number of replicates of the deaths to find 95%% intervals from')
+    standardised_parser.add_argument('--interval-method', default='poisson', choices=['poisson', 'gamma'])
+    standardised_parser.add_argument('--chunk-size', type=int, default=50,
+                                     help='number of year, gender and cause combinations to replicate at once')
+    standardised_parser.set_defaults(run=run_standardised)
+    life_tables_parser = subparsers.add_parser('life-tables', parents=[common],
+                                               help='survival and cumulative deaths by cause')
+    life_tables_parser.add_argument('--rectangular', action='store_true',
+                                    help='spread the rates evenly over each age group rather than Karup-King')
+    life_tables_parser.add_argument('--period', action='store_true',
+                                    help='period life tables (qx, lx, dx, Lx, Tx and ex) from all-cause mortality')
+    life_tables_parser.set_defaults(run=run_life_tables)
+    export_parser = subparsers.add_parser('export', parents=[common],
+                                          help='long-format table of every metric, to compressed CSV or parquet')
+    export_parser.add_argument('--export-format', default='csv', choices=['csv', 'parquet'])
+    export_parser.add_argument('--life-tables', action='store_true', help='include the life tables')
+    export_parser.set_defaults(run=run_export)
+    plot_parser = subparsers.add_parser('plot', parents=[common], help='save figures')
+    plot_parser.add_argument('--plots', nargs='+', default=['rates_by_age_group_over_time'],
+                             choices=['rates_by_age_group_over_time', 'deaths_by_cause', 'journal_figure_1',
+                                      'cumulative_survival'])
+    plot_parser.add_argument('--output-directory', default='.')
+    plot_parser.add_argument('--dpi', type=int, help='resolution, by default 1000 for the journal figures')
+    plot_parser.set_defaults(run=run_plot)
+    query_parser = subparsers.add_parser('query', parents=[common], help='deaths, populations or rates aggregated over '
+                                                                         'the age groups starting within a range')
+    query_parser.add_argument('--ages', nargs=2, type=int, metavar=('LOWEST', 'HIGHEST'),
+                              help='range of ages for the age groups to start within, by default all')
+    query_parser.add_argument('--aggregation', default='crude_rate',
+                              choices=[aggregation for aggregation in query_aggregations
+                                       if aggregation != 'weighted_rate'])
+    query_parser.add_argument('--standard', help='standard population, by default the first of --standards')
+    query_parser.add_argument('--pool-years', action='store_true', help='sum over the years before the rates')
+    query_parser.set_defaults(run=run_query)
+    serve_parser = subparsers.add_parser('serve', parents=[common], help='answer requests for rates and life tables '
+                                                                         'over HTTP on the local machine')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8017)
+    serve_parser.add_argument('--cache-entries', type=int, default=1024, help='responses to keep in the cache')
+    serve_parser.add_argument('--output-directory', default='.', help='directory to save figures to')
+    serve_parser.add_argument('--verbose', action='store_true', help='log each request')
+    serve_parser.set_defaults(run=run_serve)
+    subparsers.add_parser('aspree', parents=[common],
+                          help='rates weighted by the ASPREE age and gender distribution, by default for cancer '
+                               'from 2014 to 2016').set_defaults(run=run_aspree)
+    return parser
+
+
+if __name__ == '__main__':
+    command_arguments = build_parser().parse_args()
+    run_data_object = command_arguments.run(command_arguments)
+    if command_arguments.profile and run_data_object:
+        run_data_object.dump_profile(command_arguments.profile)
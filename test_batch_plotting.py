@@ -0,0 +1,52 @@
+
+# tests of rendering plot jobs in batches, run from the directory of the workbooks
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from grim_reader import Spring, plt, plot_worker_state, render_plot_jobs
+
+
+class TestBatchPlotting(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data_object = Spring(cache_directory=None, causes=['all-causes-combined', 'suicide'])
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def find_job(self, plot, filename):
+        return {'plot': plot, 'dpi': 50, 'filename': os.path.join(self.directory, filename)}
+
+    def test_job_renders_the_same_after_other_jobs(self):
+        alone = render_plot_jobs(self.data_object, [self.find_job('journal_figure_1', 'alone')])
+        after = render_plot_jobs(self.data_object, [self.find_job('cumulative_survival', 'first'),
+                                                    self.find_job('journal_figure_1', 'after')])
+        self.assertTrue(numpy.array_equal(plt.imread(alone[0]), plt.imread(after[1])))
+
+    def test_filenames_are_those_saved(self):
+        filenames = render_plot_jobs(self.data_object, [self.find_job('journal_figure_1', 'journal')])
+        self.assertEqual(filenames, [os.path.join(self.directory, 'journal.png')])
+        self.assertTrue(os.path.isfile(filenames[0]))
+
+    def test_backend_and_figures_left_as_they_were(self):
+        backend, figure = plt.get_backend(), plt.figure()
+        try:
+            render_plot_jobs(self.data_object, [self.find_job('journal_figure_1', 'journal')])
+            self.assertEqual(plt.get_backend(), backend)
+            self.assertEqual(plt.get_fignums(), [figure.number])
+            self.assertEqual(plot_worker_state, {})
+        finally:
+            plt.close(figure)
+
+    def test_no_jobs(self):
+        self.assertEqual(render_plot_jobs(self.data_object, [], workers=4), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+
+# tests of the query engine and its cache, run from the directory of the workbooks
+import unittest
+
+from grim_reader import Spring
+from grim_query import QueryCache, QueryEngine
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_least_recently_used_evicted(self):
+        cache = QueryCache(max_entries=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: None)
+        cache.get('c', lambda: 3)
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertEqual(cache.get('b', lambda: 4), 4)
+        self.assertEqual(list(cache.entries), ['c', 'b'])
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+    def test_no_entries_kept(self):
+        cache = QueryCache(max_entries=0)
+        self.assertEqual(cache.get('a', lambda: 1), 1)
+        self.assertEqual(cache.get('a', lambda: 2), 2)
+        self.assertEqual(len(cache.entries), 0)
+
+
+class TestQueryEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data_object = Spring(cache_directory=None, causes=['all-causes-combined'], standards=['segi'])
+
+    def test_cleared_when_version_changes(self):
+        engine = QueryEngine(self.data_object)
+        result = engine.query(years=(2010, 2012), ages=(70, 89))
+        self.assertIs(engine.query(years=(2010, 2012), ages=(70, 89))['values'], result['values'])
+        misses = engine.cache.misses
+        self.data_object.version += 1
+        try:
+            changed_result = engine.query(years=(2010, 2012), ages=(70, 89))
+        finally:
+            self.data_object.version -= 1
+        self.assertIsNot(changed_result['values'], result['values'])
+        self.assertEqual(engine.cache.misses, misses + 2)
+        self.assertEqual(len(engine.cache.entries), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
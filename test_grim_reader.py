@@ -0,0 +1,255 @@
+
+# tests of reading the workbooks, run from the directory of the workbooks with copies made in temporary directories
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from grim_reader import *
+
+
+def assert_sheets_equal(test_case, sheet, other_sheet):
+    """
+    Check that two outputs of parse_grim_sheet have the same labels and values.
+    """
+
+    test_case.assertEqual(list(sheet[0]), list(other_sheet[0]))
+    test_case.assertEqual([int(year) for year in sheet[1]], [int(year) for year in other_sheet[1]])
+    test_case.assertEqual(list(sheet[2]), list(other_sheet[2]))
+    test_case.assertTrue(numpy.array_equal(sheet[3], other_sheet[3]))
+
+
+class TestGrimCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_directory = os.path.join(self.directory, 'grim_cache')
+        self.filename = os.path.join(self.directory, find_grim_filename('suicide'))
+        shutil.copy2(find_grim_filename('suicide'), self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hit_matches_parse(self):
+        parsed_sheet = read_grim_sheet_with_cache(self.filename, 'Deaths', cache_directory=self.cache_directory)
+        cached_sheet = read_cached_grim_sheet(self.filename, 'Deaths', self.cache_directory,
+                                             read_grim_cache_index(self.cache_directory))
+        self.assertIsNotNone(cached_sheet)
+        assert_sheets_equal(self, cached_sheet, parse_grim_workbook_sheet(self.filename, 'Deaths'))
+        assert_sheets_equal(self, cached_sheet, parsed_sheet)
+
+    def test_changed_mtime_misses(self):
+        read_grim_sheet_with_cache(self.filename, 'Deaths', cache_directory=self.cache_directory)
+        status = os.stat(self.filename)
+        os.utime(self.filename, (status.st_atime, status.st_mtime + 10.))
+        self.assertIsNone(read_cached_grim_sheet(self.filename, 'Deaths', self.cache_directory,
+                                                 read_grim_cache_index(self.cache_directory)))
+
+    def test_changed_size_misses(self):
+        read_grim_sheet_with_cache(self.filename, 'Deaths', cache_directory=self.cache_directory)
+        status = os.stat(self.filename)
+        with open(self.filename, 'ab') as workbook_file:
+            workbook_file.write('\0')
+        os.utime(self.filename, (status.st_atime, status.st_mtime))
+        self.assertIsNone(read_cached_grim_sheet(self.filename, 'Deaths', self.cache_directory,
+                                                 read_grim_cache_index(self.cache_directory)))
+
+    def test_miss_is_parsed_again(self):
+        read_grim_sheet_with_cache(self.filename, 'Deaths', cache_directory=self.cache_directory)
+        status = os.stat(self.filename)
+        os.utime(self.filename, (status.st_atime, status.st_mtime + 10.))
+        read_grim_sheet_with_cache(self.filename, 'Deaths', cache_directory=self.cache_directory)
+        index = read_grim_cache_index(self.cache_directory)
+        self.assertEqual(index[find_grim_cache_key(self.filename, 'Deaths')]['mtime'], status.st_mtime + 10.)
+        self.assertIsNotNone(read_cached_grim_sheet(self.filename, 'Deaths', self.cache_directory, index))
+
+
+class TestStreamingBackend(unittest.TestCase):
+    def test_deaths_match_xlrd(self):
+        filename = find_grim_filename('suicide')
+        assert_sheets_equal(self, parse_grim_workbook_sheet(filename, 'Deaths', backend='stream'),
+                            parse_grim_workbook_sheet(filename, 'Deaths', backend='xlrd'))
+
+    def test_populations_match_xlrd(self):
+        filename = find_grim_filename('suicide')
+        assert_sheets_equal(self, parse_grim_workbook_sheet(filename, 'Populations', 14, 12, backend='stream'),
+                            parse_grim_workbook_sheet(filename, 'Populations', 14, 12, backend='xlrd'))
+
+
+class SyntheticWorkbooksTestCase(unittest.TestCase):
+    """
+    Data objects read from a synthetic cache, with the workbooks stand-in files whose signatures match the cache
+    entries so that they are never parsed.
+    """
+
+    age_groups = ['%d to %d' % (age, age + 4) for age in range(0, 85, 5)] + ['85+']
+    genders = ['Persons', 'Males', 'Females']
+    causes = ['all-causes-combined', 'suicide']
+
+    def setUp(self):
+        self.working_directory, self.directory = os.getcwd(), tempfile.mkdtemp()
+        self.cache_directory = os.path.join(self.directory, 'grim_cache')
+        os.chdir(self.directory)
+        self.random_state, self.modification_time = numpy.random.RandomState(0), 1e9
+        self.populations = self.random_state.randint(10000, 100000, size=(18, 12, 3)).astype(float)
+        self.deaths = {cause: self.random_state.poisson(
+            numpy.concatenate((self.populations, self.populations[:1] / 10.)) * rate).astype(float) + 1.
+            for cause, rate in zip(self.causes, [1e-2, 1e-4])}
+
+    def tearDown(self):
+        os.chdir(self.working_directory)
+        shutil.rmtree(self.directory)
+
+    def write_workbooks(self, n_years, causes=None):
+        """
+        Write the stand-in workbooks of the causes (all of them by default) and their cached sheets, for the first
+        n_years of the synthetic data from 2000.
+        """
+
+        index, years = read_grim_cache_index(self.cache_directory), range(2000, 2000 + n_years)
+        if not os.path.isdir(self.cache_directory):
+            os.makedirs(self.cache_directory)
+        for cause in self.causes if causes is None else causes:
+            filename = find_grim_filename(cause)
+            with open(filename, 'w') as workbook_file:
+                workbook_file.write(cause)
+            self.modification_time += 10.
+            os.utime(filename, (self.modification_time, self.modification_time))
+            write_cached_grim_sheet(filename, 'Deaths', self.cache_directory, index,
+                                    (self.age_groups + ['Missing'], years, self.genders,
+                                     self.deaths[cause][:, :n_years]))
+            if cause == 'all-causes-combined':
+                write_cached_grim_sheet(filename, 'Populations', self.cache_directory, index,
+                                        (self.age_groups, years, self.genders, self.populations[:, :n_years]))
+        write_grim_cache_index(self.cache_directory, index)
+
+    def read_data_object(self, **arguments):
+        return Spring(cache_directory=self.cache_directory, causes=self.causes, standards=['segi', 'who2000'],
+                      **arguments)
+
+
+class TestUpdate(SyntheticWorkbooksTestCase):
+    def read_data_object(self):
+        data_object = SyntheticWorkbooksTestCase.read_data_object(self)
+        data_object.find_single_year_rates()
+        data_object.find_life_tables()
+        data_object.find_period_life_tables()
+        return data_object
+
+    def assert_same_arrays(self, data_object, other_data_object):
+        for data_structure in [lambda spring: spring.grim_books_data['deaths'],
+                               lambda spring: spring.grim_books_data['population']]:
+            self.assertEqual(data_structure(data_object)['years'], data_structure(other_data_object)['years'])
+        arrays = [lambda spring: spring.grim_books_data['deaths']['data'],
+                  lambda spring: spring.grim_books_data['deaths']['adjusted_data'],
+                  lambda spring: spring.grim_books_data['population']['adjusted_data'],
+                  lambda spring: spring.rates['unadjusted'], lambda spring: spring.single_year_rates,
+                  lambda spring: spring.life_tables, lambda spring: spring.cumulative_deaths_by_cause,
+                  lambda spring: spring.period_life_tables['data']]
+        for standard in ['segi', 'who2000']:
+            for upper_age_limit in data_object.upper_age_limits_to_cut_at:
+                arrays += [lambda spring, limit=upper_age_limit: spring.average_rates_by_year['adjusted_data'][limit],
+                           lambda spring, standard=standard, limit=upper_age_limit:
+                           spring.average_rates_by_year['standardised_by_standard'][standard][limit]]
+        for array in arrays:
+            numpy.testing.assert_allclose(array(data_object), array(other_data_object), rtol=1e-12)
+
+    def test_no_change(self):
+        self.write_workbooks(10)
+        data_object = self.read_data_object()
+        self.assertEqual(data_object.update(), {'changed_causes': [], 'new_years': [], 'updated_years': []})
+        self.assertEqual(data_object.version, 0)
+        self.assert_same_arrays(data_object, self.read_data_object())
+
+    def test_revised_years(self):
+        self.write_workbooks(10)
+        data_object = self.read_data_object()
+        self.deaths['suicide'][3, 4, 1] += 5.
+        self.populations[7, 6, 2] += 100.
+        self.write_workbooks(10)
+        self.assertEqual(data_object.update(), {'changed_causes': self.causes, 'new_years': [],
+                                                'updated_years': [2004, 2006]})
+        self.assert_same_arrays(data_object, self.read_data_object())
+
+    def test_appended_years(self):
+        self.write_workbooks(10)
+        data_object = self.read_data_object()
+        self.write_workbooks(12)
+        self.assertEqual(data_object.update(), {'changed_causes': self.causes, 'new_years': [2010, 2011],
+                                                'updated_years': [2010, 2011]})
+        self.assert_same_arrays(data_object, self.read_data_object())
+
+    def test_unreadable_workbook_changes_nothing(self):
+        self.write_workbooks(10)
+        data_object = self.read_data_object()
+        self.deaths['suicide'][3, 4, 1] += 5.
+        self.write_workbooks(10)
+        with open(find_grim_filename('suicide'), 'a') as workbook_file:
+            workbook_file.write(' is being copied')
+        with self.assertRaises(Exception):
+            data_object.update()
+        self.assertEqual(data_object.version, 0)
+        self.assertEqual(data_object.grim_books_data['deaths']['data'][3, 4, 1, 1],
+                         self.deaths['suicide'][3, 4, 1] - 5.)
+        self.write_workbooks(10, ['suicide'])
+        self.assertEqual(data_object.update()['updated_years'], [2004])
+        self.assert_same_arrays(data_object, self.read_data_object())
+
+    def test_new_years_only_in_another_cause(self):
+        self.write_workbooks(10)
+        data_object = self.read_data_object()
+        self.write_workbooks(12, ['suicide'])
+        with self.assertRaises(ValueError):
+            data_object.update()
+        self.assertEqual(data_object.version, 0)
+
+
+class TestSingleYearRatesCache(SyntheticWorkbooksTestCase):
+    def setUp(self):
+        SyntheticWorkbooksTestCase.setUp(self)
+        self.write_workbooks(10)
+        self.read_data_object().find_single_year_rates()
+
+        # replace every cached surface, so that any read from the cache is recognised
+        index = read_grim_cache_index(self.cache_directory)
+        for key in index:
+            if 'single-year-rates' in key:
+                array_filename = os.path.join(self.cache_directory, index[key]['array_file'])
+                numpy.save(array_filename, numpy.full_like(numpy.load(array_filename), -1.))
+
+    def find_rates(self, karup_king=True, max_age=100, **arguments):
+        """
+        The single year rates of a new data object, which may be from the cache, and the same rates graduated again.
+        """
+
+        data_object = self.read_data_object(**arguments)
+        single_year_rates = data_object.find_single_year_rates(karup_king, max_age)
+        return single_year_rates, data_object.find_single_year_rates_for_years(
+            range(len(data_object.grim_books_data['deaths']['years'])), karup_king, graduate=True)
+
+    def assert_graduated(self, **arguments):
+        single_year_rates, graduated_rates = self.find_rates(**arguments)
+        self.assertTrue(numpy.array_equal(single_year_rates, graduated_rates))
+
+    def test_same_options_hit(self):
+        self.assertTrue(numpy.all(self.find_rates()[0] == -1.))
+
+    def test_karup_king_changed(self):
+        self.assert_graduated(karup_king=False)
+
+    def test_max_age_changed(self):
+        self.assert_graduated(max_age=110)
+
+    def test_dtype_changed(self):
+        self.assert_graduated(dtype=numpy.float32)
+
+    def test_workbook_revised(self):
+        self.deaths['suicide'][3, 4, 1] += 5.
+        self.write_workbooks(10, ['suicide'])
+        single_year_rates, graduated_rates = self.find_rates()
+        self.assertTrue(numpy.all(single_year_rates[:, :, :, 0] == -1.))
+        self.assertTrue(numpy.array_equal(single_year_rates[:, :, :, 1], graduated_rates[:, :, :, 1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+
+# tests of answering service requests, called directly rather than over HTTP and run from the directory of the workbooks
+import json
+import unittest
+
+from grim_reader import Spring
+from grim_service import GrimService
+
+
+class TestGrimService(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data_object = Spring(cache_directory=None, causes=['all-causes-combined'], standards=['segi'])
+
+    def setUp(self):
+        self.service = GrimService(self.data_object)
+
+    def tearDown(self):
+        self.service.close()
+
+    def test_rate(self):
+        status, response = self.service.respond('/rate', {'age_group': '70 to 74', 'year': 2016, 'gender': 'Females'})
+        self.assertEqual(status, 200)
+        self.assertGreater(json.loads(response)['value'], 0.)
+
+    def test_unknown_path(self):
+        self.assertEqual(self.service.respond('/rats', {})[0], 404)
+
+    def test_unknown_label(self):
+        status, response = self.service.respond('/rate', {'age_group': '70 to 75', 'year': 2016, 'gender': 'Females'})
+        self.assertEqual(status, 400)
+        self.assertIn('KeyError', json.loads(response)['error'])
+
+    def test_unknown_plot_and_argument(self):
+        self.assertEqual(self.service.respond('/plot', {'plot': 'rates_by_year'})[0], 400)
+        self.assertEqual(self.service.respond('/plot', {'plot': 'journal_figure_1', 'ax': None})[0], 400)
+        self.assertIsNone(self.service.plot_pool)
+
+    def test_cache_misses_after_version_changes(self):
+        first_response = self.service.respond('/health', {})[1]
+        self.assertEqual(self.service.respond('/health', {})[1], first_response)
+        self.assertEqual((self.service.responses.hits, self.service.responses.misses), (1, 1))
+        self.data_object.version += 1
+        try:
+            changed_response = self.service.respond('/health', {})[1]
+        finally:
+            self.data_object.version -= 1
+        self.assertEqual(self.service.responses.misses, 2)
+        self.assertEqual(json.loads(changed_response)['version'], json.loads(first_response)['version'] + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
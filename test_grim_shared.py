@@ -0,0 +1,40 @@
+
+# tests of publishing and attaching shared datasets, run from the directory of the workbooks
+import cPickle
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from grim_reader import Spring
+from grim_shared import attach_dataset, publish_dataset, release_dataset
+
+
+class TestSharedDataset(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def publish(self):
+        return publish_dataset(Spring(cache_directory=None, causes=['all-causes-combined']), 'test', self.directory)
+
+    def test_attached_object_pickles_after_publishing_again(self):
+        first_directory = self.publish()
+        attached = attach_dataset('test', self.directory)
+        self.publish()
+        self.assertTrue(os.path.isdir(first_directory))
+        unpickled = cPickle.loads(cPickle.dumps(attached, cPickle.HIGHEST_PROTOCOL))
+        self.assertTrue(numpy.array_equal(unpickled.rates['unadjusted'], attached.rates['unadjusted']))
+
+    def test_released_publication_removed(self):
+        first_directory = self.publish()
+        release_dataset(attach_dataset('test', self.directory))
+        self.publish()
+        self.assertFalse(os.path.isdir(first_directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+
+# tests of the uncertainty intervals, which need no workbooks
+import unittest
+import numpy
+
+from grim_uncertainty import draw_death_replicates, find_rate_intervals
+
+
+class TestDeathReplicates(unittest.TestCase):
+    def test_gamma_interval_for_zero_deaths(self):
+        replicates = draw_death_replicates(numpy.array([0., 20.]), 10000, numpy.random.RandomState(0), 'gamma')
+        lower, upper = numpy.percentile(replicates, [2.5, 97.5], axis=0)
+        self.assertTrue(numpy.all(replicates >= 0.))
+        self.assertLess(lower[0], .05)
+        self.assertAlmostEqual(upper[0], -numpy.log(.025), delta=.2)
+        self.assertTrue(lower[1] < 20. < upper[1])
+
+    def test_gamma_rate_interval_for_zero_death_cell(self):
+        deaths, populations = numpy.zeros((2, 1, 1, 1)), numpy.full((2, 1, 1), 1e4)
+        deaths[1] = 30.
+        crude_intervals, standardised_intervals = find_rate_intervals(
+            deaths, populations, [1, 2], numpy.array([[1., 0.]]), n_replicates=2000, method='gamma')
+        self.assertGreater(crude_intervals[0, 1, 0, 0, 0], crude_intervals[0, 0, 0, 0, 0])
+        self.assertGreater(standardised_intervals[0, 1, 0, 0, 0], 0.)
+
+
+class TestRateIntervals(unittest.TestCase):
+    def setUp(self):
+        random_state = numpy.random.RandomState(1)
+        self.populations = random_state.randint(1000, 100000, size=(4, 5, 3)).astype(float)
+        self.deaths = random_state.poisson(numpy.expand_dims(self.populations, axis=3) * 1e-3,
+                                           size=(4, 5, 3, 2)).astype(float)
+        self.age_weights = numpy.array([[.4, .3, .2, .1], [.25, .25, .25, .25]])
+
+    def find_intervals(self, **arguments):
+        return find_rate_intervals(self.deaths, self.populations, [2, 4], self.age_weights, n_replicates=200,
+                                   **arguments)
+
+    def test_poisson_intervals_contain_rates(self):
+        crude_intervals, standardised_intervals = self.find_intervals()
+        crude_rates = numpy.sum(self.deaths, axis=0) / numpy.expand_dims(numpy.sum(self.populations, axis=0), axis=2)
+        standardised_rates = numpy.einsum('wa,aygc->wygc', self.age_weights,
+                                          self.deaths / numpy.expand_dims(self.populations, axis=3))
+        self.assertEqual(crude_intervals.shape, (2, 2, 5, 3, 2))
+        self.assertEqual(standardised_intervals.shape, (2, 2, 5, 3, 2))
+        self.assertTrue(numpy.all(crude_intervals[1, 0] <= crude_rates))
+        self.assertTrue(numpy.all(crude_rates <= crude_intervals[1, 1]))
+        self.assertTrue(numpy.all(standardised_intervals[:, 0] <= standardised_rates))
+        self.assertTrue(numpy.all(standardised_rates <= standardised_intervals[:, 1]))
+
+    def test_same_for_any_chunk_size_and_workers(self):
+        intervals = self.find_intervals(chunk_size=50, workers=1)
+        for chunk_size, workers in [(7, 1), (7, 2), (50, 2)]:
+            for other_interval, interval in zip(self.find_intervals(chunk_size=chunk_size, workers=workers), intervals):
+                self.assertTrue(numpy.array_equal(other_interval, interval))
+
+
+if __name__ == '__main__':
+    unittest.main()